@@ -0,0 +1,151 @@
+"""
+Confidence-gated cascade routing for /predict.
+
+Stages run cheapest first (by default the local CLIP/kNN model, then Vision,
+then Vertex) and the cascade stops at the first stage whose prediction clears
+its per-class threshold. The policy lives in cascade_policy.json (or
+CASCADE_POLICY_PATH); CASCADE_MODE overrides its mode:
+
+  off     every backend is called, as before
+  on      stages are called in order until one is confident
+  shadow  every backend is called, and the counters record where the cascade
+          would have stopped, which calls it would have skipped and whether its
+          answer agrees with the full consensus
+
+Thresholds are keyed by backend ("clip", "knn", "vision", "vertex") because
+each one is calibrated differently: zero-shot CLIP returns a softmax
+probability, kNN a vote share and Vision a label score. A stage never stops
+below the consensus CONFIDENCE_THRESHOLD, since its answer would then come
+back as ambiguous.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Any
+
+from .consensus import CONFIDENCE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY_PATH = os.path.join(os.path.dirname(__file__), "cascade_policy.json")
+MODES = ("off", "on", "shadow")
+STAGES = ("local", "vision", "vertex")
+
+
+class CascadePolicy:
+    """Stage order and per-backend, per-class confidence thresholds."""
+
+    def __init__(self, config: dict[str, Any], mode: str | None = None) -> None:
+        self.mode = (mode or config.get("mode", "off")).lower()
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown cascade mode '{self.mode}', expected one of {MODES}")
+        self.stages: list[str] = list(config.get("stages", STAGES))
+        unknown = set(self.stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown cascade stages: {sorted(unknown)}")
+        self.thresholds: dict[str, dict[str, float]] = config.get("thresholds", {})
+
+    @classmethod
+    def from_env(cls) -> "CascadePolicy":
+        path = os.getenv("CASCADE_POLICY_PATH", DEFAULT_POLICY_PATH)
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config, mode=os.getenv("CASCADE_MODE") or None)
+
+    def threshold(self, backend: str, cls: str) -> float:
+        """Threshold for `cls` on `backend`; a missing entry means the stage never stops early."""
+        table = self.thresholds.get(backend, {})
+        return float(table.get(cls, table.get("default", float("inf"))))
+
+    def accepts(self, backend: str, result: dict[str, Any] | None, classes: set[str]) -> bool:
+        if not result or result.get("prediction") not in classes:
+            return False
+        threshold = max(self.threshold(backend, result["prediction"]), CONFIDENCE_THRESHOLD)
+        return result["confidence"] >= threshold
+
+    def decide(
+        self,
+        results: dict[str, dict[str, Any] | None],
+        backends: dict[str, str],
+        classes: set[str],
+    ) -> str | None:
+        """First stage (in policy order) with a confident result, else the last one available."""
+        last = None
+        for stage in self.stages:
+            if stage not in results:
+                continue
+            last = stage
+            if self.accepts(backends[stage], results[stage], classes):
+                return stage
+        return last
+
+
+class CascadeStats:
+    """Per-route counters (per worker process), exposed through /stats."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.routes: Counter[str] = Counter()
+        self.calls: Counter[str] = Counter()
+        self.skipped: Counter[str] = Counter()
+        self.latency_ms: Counter[str] = Counter()
+        self.shadow_requests = 0
+        self.shadow_routes: Counter[str] = Counter()
+        self.shadow_skipped: Counter[str] = Counter()
+        self.shadow_saved_ms: Counter[str] = Counter()
+        self.shadow_agree = 0
+
+    def record(self, stopped_at: str | None, latencies: dict[str, int], skipped: list[str]) -> None:
+        with self._lock:
+            self.requests += 1
+            self.routes[stopped_at or "none"] += 1
+            for stage, latency in latencies.items():
+                self.calls[stage] += 1
+                self.latency_ms[stage] += latency
+            self.skipped.update(skipped)
+
+    def record_shadow(
+        self,
+        would_stop_at: str | None,
+        latencies: dict[str, int],
+        would_skip: list[str],
+        agrees: bool,
+    ) -> None:
+        with self._lock:
+            self.shadow_requests += 1
+            self.shadow_routes[would_stop_at or "none"] += 1
+            self.shadow_skipped.update(would_skip)
+            for stage in would_skip:
+                self.shadow_saved_ms[stage] += latencies.get(stage, 0)
+            self.shadow_agree += agrees
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            mean_latency = {
+                stage: round(self.latency_ms[stage] / n, 1) for stage, n in self.calls.items() if n
+            }
+            return {
+                "requests": self.requests,
+                "routes": dict(self.routes),
+                "calls": dict(self.calls),
+                "skipped": dict(self.skipped),
+                "mean_latency_ms": mean_latency,
+                # Skipped calls priced at the mean latency of the calls that did happen
+                "estimated_saved_ms": {
+                    stage: round(n * mean_latency.get(stage, 0.0)) for stage, n in self.skipped.items()
+                },
+                "shadow": {
+                    "requests": self.shadow_requests,
+                    "would_stop_at": dict(self.shadow_routes),
+                    "would_skip": dict(self.shadow_skipped),
+                    "would_save_ms": dict(self.shadow_saved_ms),
+                    "agreement": (
+                        round(self.shadow_agree / self.shadow_requests, 4) if self.shadow_requests else None
+                    ),
+                },
+            }
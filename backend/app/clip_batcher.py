@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+
+from .metrics import Histogram
+
+_STOP = object()
+
+
+class ClipBatcher:
+    """Dynamic micro-batching front for ClipService.
+
+    Callers block on `predict`/`predict_tensor` exactly as with ClipService.
+    A single worker thread gathers pending images until `max_batch_size` is
+    reached or the oldest request has waited `max_wait_ms`, then runs one
+    batched forward pass and hands every caller its own result. Image
+    decoding stays in the caller's thread, so only the forward pass is
+    serialized.
+    """
+
+    def __init__(self, clip_service, max_batch_size: int = 8, max_wait_ms: float = 5.0) -> None:
+        self.clip = clip_service
+        self.classes = clip_service.classes
+        self.preprocess = clip_service.preprocess
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.wait_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 250])
+        self.forward_ms = Histogram([5, 10, 25, 50, 100, 250, 500, 1000])
+
+        self._thread = threading.Thread(target=self._run, name="clip-batcher", daemon=True)
+        self._thread.start()
+
+    def preprocess_bytes(self, image_bytes: bytes):
+        return self.clip.preprocess_bytes(image_bytes)
+
+    def predict(self, image_bytes: bytes) -> dict[str, Any]:
+        return self.predict_tensor(self.clip.preprocess_bytes(image_bytes))
+
+    def predict_tensor(self, img_input) -> dict[str, Any]:
+        return self._submit(img_input).result()
+
+    def predict_batch(self, img_inputs: list) -> list[dict[str, Any]]:
+        """Queue several images at once; they share forward passes with other callers."""
+        futures = [self._submit(img_input) for img_input in img_inputs]
+        return [future.result() for future in futures]
+
+    def _submit(self, img_input) -> Future:
+        future: Future = Future()
+        with self._close_lock:
+            # Nothing may be queued behind _STOP: the worker would never pick it up
+            if self._closed:
+                raise RuntimeError("ClipBatcher is closed")
+            self._queue.put((img_input, future, time.perf_counter()))
+        return future
+
+    def close(self) -> None:
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batch_size": self.batch_sizes.snapshot(),
+            "wait_ms": self.wait_ms.snapshot(),
+            "forward_ms": self.forward_ms.snapshot(),
+        }
+
+    def _collect(self, first) -> tuple[list, bool]:
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        try:
+            self._serve()
+        finally:
+            # Fail whatever is still queued rather than leave callers blocked on it
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP and not item[1].done():
+                    item[1].set_exception(RuntimeError("ClipBatcher is closed"))
+
+    def _serve(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stopping = self._collect(first)
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.wait_ms.observe((started - enqueued) * 1000.0)
+            self.batch_sizes.observe(len(batch))
+
+            try:
+                results = self.clip.predict_batch([item[0] for item in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self.forward_ms.observe((time.perf_counter() - started) * 1000.0)
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,365 @@
+"""
+Shared CLIP inference process.
+
+clip_server.py loads CLIP once, with a pinned torch thread budget, and serves
+every uvicorn worker over a Unix socket. Image tensors never travel over the
+socket: each client connection owns a shared-memory slot, writes the
+preprocessed batch into it and sends only a small JSON header. The server
+reads the batch in place and micro-batches single-image requests from all
+workers through one ClipBatcher. The client side needs only numpy and
+Pillow, so web workers never import torch.
+
+Wire format, both directions: 4-byte big-endian length + JSON header.
+  hello                      -> {classes, model_name, input_resolution, max_batch_size}
+  attach {shm}               -> {ok}
+  predict {shape}            -> {ok, results}
+  encode {shape}             -> {ok, shape}   (embeddings written back to the slot)
+  stats                      -> {ok, stats}
+"""
+from __future__ import annotations
+
+import io
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Callable
+
+import numpy as np
+from PIL import Image
+
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/wasteml-clip.sock"
+_LENGTH = struct.Struct("!I")
+
+# Same values as clip_service.CLIP_MEAN/CLIP_STD (that module imports torch)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def clip_pixels(image: Image.Image, n_px: int = 224) -> np.ndarray:
+    """The resize and center crop of CLIP's preprocessing, as a (3, n_px, n_px) uint8 array."""
+    # Resize the short side to n_px (bicubic), then center-crop, as torchvision does for PIL images
+    w, h = image.size
+    size = (n_px, int(n_px * h / w)) if w <= h else (int(n_px * w / h), n_px)
+    image = image.resize(size, Image.BICUBIC)
+    left, top = int(round((size[0] - n_px) / 2.0)), int(round((size[1] - n_px) / 2.0))
+    image = image.crop((left, top, left + n_px, top + n_px)).convert("RGB")
+    return np.asarray(image, dtype=np.uint8).transpose(2, 0, 1)
+
+
+def numpy_clip_transform(n_px: int = 224) -> Callable[[Image.Image], np.ndarray]:
+    """clip_service.clip_transform with PIL and numpy only; returns a (3, n_px, n_px) float32 array."""
+    mean = np.array(CLIP_MEAN, dtype=np.float32).reshape(3, 1, 1)
+    std = np.array(CLIP_STD, dtype=np.float32).reshape(3, 1, 1)
+
+    def transform(image: Image.Image) -> np.ndarray:
+        array = clip_pixels(image, n_px).astype(np.float32) / 255.0
+        return (array - mean) / std
+
+    return transform
+
+
+def send_message(sock: socket.socket, message: dict[str, Any]) -> None:
+    data = json.dumps(message).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("CLIP server connection closed")
+        received += n
+    return bytes(buf)
+
+
+def recv_message(sock: socket.socket) -> dict[str, Any]:
+    (size,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Open a client's segment without letting this process's resource tracker unlink it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class ClipInferenceServer:
+    """Serves one ClipService to many web workers (see clip_server.py)."""
+
+    def __init__(self, clip_service, socket_path: str, max_batch_size: int = 8, max_wait_ms: float = 5.0) -> None:
+        from .clip_batcher import ClipBatcher
+
+        self.clip = clip_service
+        self.socket_path = socket_path
+        self.max_batch_size = max_batch_size
+        self.batcher = ClipBatcher(clip_service, max_batch_size, max_wait_ms)
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def info(self) -> dict[str, Any]:
+        return {
+            "classes": self.clip.classes,
+            "model_name": self.clip.model_name,
+            "input_resolution": self.clip.input_resolution,
+            "max_batch_size": self.max_batch_size,
+        }
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                server.handle_connection(self.request)
+
+        with socketserver.ThreadingUnixStreamServer(self.socket_path, Handler) as unix_server:
+            unix_server.daemon_threads = True
+            logger.info(f"CLIP inference server listening on {self.socket_path}")
+            try:
+                unix_server.serve_forever()
+            finally:
+                self.batcher.close()
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+
+    def handle_connection(self, conn: socket.socket) -> None:
+        shm = None
+        with self._lock:
+            self.connections += 1
+        try:
+            while True:
+                try:
+                    message = recv_message(conn)
+                except ConnectionError:
+                    return
+                op = message.get("op")
+                try:
+                    if op == "hello":
+                        send_message(conn, self.info())
+                    elif op == "attach":
+                        shm = _attach(message["shm"])
+                        send_message(conn, {"ok": True})
+                    elif op == "stats":
+                        send_message(conn, {"ok": True, "stats": {**self.batcher.stats(), "connections": self.connections}})
+                    elif op in ("predict", "encode"):
+                        send_message(conn, self._run(op, shm, message["shape"]))
+                    else:
+                        raise ValueError(f"unknown op {op!r}")
+                except Exception as e:
+                    send_message(conn, {"ok": False, "error": str(e)})
+        finally:
+            with self._lock:
+                self.connections -= 1
+            if shm is not None:
+                try:
+                    shm.close()
+                except BufferError:
+                    pass  # a batch view is still referenced; the mapping goes away with it
+
+    def _run(self, op: str, shm: shared_memory.SharedMemory | None, shape: list[int]) -> dict[str, Any]:
+        if shm is None:
+            raise RuntimeError("no shared-memory slot attached")
+        import torch
+
+        # Zero-copy view of the client's slot; the client waits for our reply before reusing it
+        batch = torch.from_numpy(np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+        images = list(batch)
+        if op == "predict":
+            if len(images) == 1:
+                results = [self.batcher.predict_tensor(images[0])]
+            else:
+                results = self.clip.predict_batch(images)
+            return {"ok": True, "results": results}
+
+        features = self.clip.encode_batch(images).float().cpu().numpy()
+        out = np.ndarray(features.shape, dtype=np.float32, buffer=shm.buf)
+        out[...] = features
+        return {"ok": True, "shape": list(features.shape)}
+
+
+class _Connection:
+    """One socket plus its shared-memory slot; used by one request at a time."""
+
+    def __init__(self, socket_path: str) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        send_message(self.sock, {"op": "hello"})
+        self.info = recv_message(self.sock)
+        # Room for one full float32 input batch (embeddings come back in the same slot)
+        res = self.info["input_resolution"]
+        self.shm = shared_memory.SharedMemory(create=True, size=self.info["max_batch_size"] * 3 * res * res * 4)
+        self._call({"op": "attach", "shm": self.shm.name})
+
+    def _call(self, message: dict[str, Any]) -> dict[str, Any]:
+        send_message(self.sock, message)
+        reply = recv_message(self.sock)
+        if not reply.get("ok"):
+            raise RuntimeError(f"CLIP server error: {reply.get('error')}")
+        return reply
+
+    def request(self, op: str, images: list | None = None) -> dict[str, Any]:
+        message: dict[str, Any] = {"op": op}
+        if images is not None and len(images):
+            # Each preprocessed image is written straight into the shared slot
+            shape = (len(images), *np.shape(images[0]))
+            slot = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf)
+            for i, image in enumerate(images):
+                slot[i] = image
+            message["shape"] = list(shape)
+        return self._call(message)
+
+    def read(self, shape: list[int]) -> np.ndarray:
+        return np.ndarray(tuple(shape), dtype=np.float32, buffer=self.shm.buf).copy()
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        finally:
+            self.shm.close()
+            self.shm.unlink()
+
+
+class RemoteClipService:
+    """ClipService-compatible client for the shared inference process.
+
+    Only preprocessing runs in the web worker; the forward pass runs in
+    clip_server.py. Connections (one shared-memory slot each) are pooled and
+    opened on demand up to `connections`.
+    """
+
+    def __init__(
+        self,
+        socket_path: str | None = None,
+        connections: int = 8,
+        connect_timeout: float | None = None,
+    ) -> None:
+        self.socket_path = socket_path or os.getenv("CLIP_SERVER_SOCKET", DEFAULT_SOCKET_PATH)
+        self.max_connections = max(1, connections)
+        self._pool: queue.LifoQueue = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+        timeout = connect_timeout if connect_timeout is not None else float(
+            os.getenv("CLIP_SERVER_CONNECT_TIMEOUT_S", "120")
+        )
+        first = self._connect_with_retry(time.monotonic() + timeout)
+        info = first.info
+        self.classes = info["classes"]
+        self.model_name = info["model_name"]
+        self.input_resolution = info["input_resolution"]
+        self.max_batch_size = info["max_batch_size"]
+        self.preprocess = numpy_clip_transform(self.input_resolution)
+        self._pool.put(first)
+
+    def _connect_with_retry(self, deadline: float) -> _Connection:
+        """The server may still be loading weights when the web workers start."""
+        while True:
+            try:
+                conn = _Connection(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+        self._opened = 1
+        return conn
+
+    def _borrow(self) -> _Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            open_new = self._opened < self.max_connections
+            if open_new:
+                self._opened += 1
+        if open_new:
+            try:
+                return _Connection(self.socket_path)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return self._pool.get()
+
+    def _request(self, op: str, images: list | None = None, read: bool = False):
+        conn = self._borrow()
+        try:
+            if images is not None and len(images):
+                # Round trip to the server, which runs the forward pass
+                with stage("clip_forward"):
+                    reply = conn.request(op, images)
+            else:
+                reply = conn.request(op, images)
+            result = conn.read(reply["shape"]) if read else reply
+        except RuntimeError:
+            # The server answered with an error: the connection is still in step, keep it
+            self._pool.put(conn)
+            raise
+        except BaseException:
+            # Broken socket or a half-read reply: drop this connection, a new one is opened on demand
+            with self._lock:
+                self._opened -= 1
+            conn.close()
+            raise
+        self._pool.put(conn)
+        return result
+
+    def warmup(self) -> None:
+        """The server warms the model up itself."""
+
+    def preprocess_bytes(self, image_bytes: bytes) -> np.ndarray:
+        with stage("clip_preprocess"):
+            pil_img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            return self.preprocess(pil_img)
+
+    def predict(self, image_bytes: bytes) -> dict[str, Any]:
+        return self.predict_tensor(self.preprocess_bytes(image_bytes))
+
+    def predict_tensor(self, img_input) -> dict[str, Any]:
+        return self.predict_batch([img_input])[0]
+
+    def predict_batch(self, img_inputs: list) -> list[dict[str, Any]]:
+        results = []
+        for start in range(0, len(img_inputs), self.max_batch_size):
+            results.extend(self._request("predict", img_inputs[start:start + self.max_batch_size])["results"])
+        return results
+
+    def encode_batch(self, img_inputs: list | np.ndarray) -> np.ndarray:
+        """L2-normalized embeddings as a float32 numpy array (from a list or a stacked batch)."""
+        chunks = [
+            self._request("encode", img_inputs[start:start + self.max_batch_size], read=True)
+            for start in range(0, len(img_inputs), self.max_batch_size)
+        ]
+        return np.concatenate(chunks)
+
+    def stats(self) -> dict[str, Any]:
+        return {"server": self._request("stats")["stats"], "socket": self.socket_path, "pool": self._opened}
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
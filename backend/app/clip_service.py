@@ -1,49 +1,244 @@
 from __future__ import annotations
 
+import hashlib
 import io
-from typing import Any
+import json
+import os
+import re
+from typing import Any, Callable
 
+import numpy as np
 import torch
-import clip
 from PIL import Image
 
+from .metrics import stage
+
+DEFAULT_MODEL_NAME = "ViT-B/32"
+DEFAULT_PROMPT_TEMPLATES = ["a photo of {} waste"]
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache", "clip")
+
+# Normalization constants used by CLIP's own preprocessing
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+# exp(logit_scale) of the released CLIP models; turns cosine similarities into softmax logits
+DEFAULT_LOGIT_SCALE = 100.0
+
+
+def clip_transform(n_px: int = 224) -> Callable[[Image.Image], torch.Tensor]:
+    """Same preprocessing as clip.load() returns, without importing the clip package."""
+    from torchvision.transforms import CenterCrop, Compose, InterpolationMode, Normalize, Resize, ToTensor
+
+    return Compose([
+        Resize(n_px, interpolation=InterpolationMode.BICUBIC),
+        CenterCrop(n_px),
+        lambda image: image.convert("RGB"),
+        ToTensor(),
+        Normalize(CLIP_MEAN, CLIP_STD),
+    ])
+
+
+def load_image_encoder(path: str) -> tuple[Callable[[torch.Tensor], torch.Tensor], dict[str, Any]]:
+    """Load an exported image encoder (TorchScript .pt or ONNX .onnx) and its metadata sidecar."""
+    with open(f"{path}.json") as f:
+        meta = json.load(f)
+
+    if path.endswith(".onnx"):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError(
+                f"{path} is an ONNX encoder, which needs onnxruntime (pip install onnxruntime); "
+                "or export a TorchScript artifact with export_clip.py --format torchscript"
+            ) from e
+
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        input_name = session.get_inputs()[0].name
+
+        def encode(batch: torch.Tensor) -> torch.Tensor:
+            (features,) = session.run(None, {input_name: batch.float().cpu().numpy()})
+            return torch.from_numpy(features)
+
+        return encode, meta
+
+    module = torch.jit.load(path, map_location="cpu")
+    module.eval()
+    return module, meta
+
+
+def _env_templates() -> list[str] | None:
+    """Read prompt templates from CLIP_PROMPT_TEMPLATES ('|'-separated, '{}' = class)."""
+    value = os.getenv("CLIP_PROMPT_TEMPLATES", "").strip()
+    if not value:
+        return None
+    return [t.strip() for t in value.split("|") if t.strip()]
+
 
 class ClipService:
-    """Wrapper for OpenAI CLIP zero-shot classification."""
+    """Wrapper for OpenAI CLIP zero-shot classification.
 
-    def __init__(self, classes: list[str]) -> None:
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
-        self.model.eval()
+    Class prompts are encoded once into a text-embedding bank (averaged over
+    all prompt templates) and persisted to disk, so a request only runs the
+    image encoder and a single matmul.
+
+    With `encoder_path` (or CLIP_ENCODER_PATH) set, the image encoder is an
+    artifact produced by export_clip.py (e.g. int8 TorchScript) and the
+    full `clip` model is never loaded; the text bank must then already be
+    cached for the artifact's model name. `encoder_path=""` loads the full
+    model even when CLIP_ENCODER_PATH is set.
+    """
+
+    def __init__(
+        self,
+        classes: list[str],
+        model_name: str | None = None,
+        prompt_templates: list[str] | None = None,
+        cache_dir: str | None = None,
+        encoder_path: str | None = None,
+    ) -> None:
+        if encoder_path is None:
+            encoder_path = os.getenv("CLIP_ENCODER_PATH")
+        self.encoder_path = encoder_path or None
+        if self.encoder_path:
+            self.device = "cpu"
+            self.model = None
+            self.encoder, meta = load_image_encoder(self.encoder_path)
+            self.model_name = meta["model"]
+            self.input_resolution = meta.get("input_resolution", 224)
+            self.logit_scale = float(meta.get("logit_scale", DEFAULT_LOGIT_SCALE))
+            self.preprocess = clip_transform(self.input_resolution)
+            self.dtype = torch.float32
+        else:
+            import clip
+
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.model_name = model_name or os.getenv("CLIP_MODEL", DEFAULT_MODEL_NAME)
+            # Weights are kept in a local cache dir so restarts never re-download them
+            self.model, self.preprocess = clip.load(
+                self.model_name,
+                device=self.device,
+                download_root=os.getenv("CLIP_WEIGHTS_DIR") or None,
+            )
+            self.model.eval()
+            self.input_resolution = self.model.visual.input_resolution
+            self.logit_scale = float(self.model.logit_scale.exp())
+            self.encoder = self.model.encode_image
+            self.dtype = self.model.dtype
         self.classes = classes
+        self.prompt_templates = prompt_templates or _env_templates() or DEFAULT_PROMPT_TEMPLATES
+        self.cache_dir = cache_dir or os.getenv("CLIP_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.text_features = self._load_text_features()
 
-    def predict(self, image_bytes: bytes) -> dict[str, Any]:
-        pil_img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        img_input = self.preprocess(pil_img).unsqueeze(0).to(self.device)
+    def warmup(self) -> None:
+        """Run one dummy forward pass so the first real request doesn't pay for lazy init."""
+        self.predict_batch([torch.zeros(3, self.input_resolution, self.input_resolution)])
+
+    def _text_bank_path(self) -> str:
+        key = "\n".join([self.model_name, *self.classes, "--", *self.prompt_templates])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        model_slug = re.sub(r"[^A-Za-z0-9]+", "-", self.model_name).strip("-")
+        return os.path.join(self.cache_dir, f"text_bank_{model_slug}_{digest}.pt")
+
+    def _load_text_features(self) -> torch.Tensor:
+        """Load the class embedding bank from disk, building it on a cache miss."""
+        path = self._text_bank_path()
+        if os.path.exists(path):
+            try:
+                bank = torch.load(path, map_location=self.device)
+                if (
+                    bank.get("model") == self.model_name
+                    and bank.get("classes") == list(self.classes)
+                    and bank.get("templates") == list(self.prompt_templates)
+                ):
+                    return bank["features"].to(device=self.device, dtype=self.dtype)
+            except Exception:
+                pass
+
+        if self.model is None:
+            raise RuntimeError(
+                f"No cached text bank at {path}; run export_clip.py (or start once without "
+                "CLIP_ENCODER_PATH) with the same classes and prompt templates."
+            )
+        features = self._encode_text_bank()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            torch.save(
+                {
+                    "model": self.model_name,
+                    "classes": list(self.classes),
+                    "templates": list(self.prompt_templates),
+                    "features": features.cpu(),
+                },
+                tmp_path,
+            )
+            os.replace(tmp_path, path)
+        except OSError:
+            # A read-only cache dir only costs us a rebuild on the next start.
+            pass
+        return features
+
+    def _encode_text_bank(self) -> torch.Tensor:
+        """Encode every (class, template) prompt and average per class."""
+        import clip
 
+        class_features = []
         with torch.no_grad():
-            img_feat = self.model.encode_image(img_input)
+            for c in self.classes:
+                tokens = clip.tokenize(
+                    [template.format(c) for template in self.prompt_templates]
+                ).to(self.device)
+                feats = self.model.encode_text(tokens)
+                feats /= feats.norm(dim=-1, keepdim=True)
+                mean = feats.mean(dim=0)
+                class_features.append(mean / mean.norm())
+        return torch.stack(class_features)
+
+    def preprocess_bytes(self, image_bytes: bytes) -> torch.Tensor:
+        """Decode an upload into a single (3, H, W) CLIP input tensor."""
+        with stage("clip_preprocess"):
+            pil_img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            return self.preprocess(pil_img)
+
+    def predict(self, image_bytes: bytes) -> dict[str, Any]:
+        return self.predict_tensor(self.preprocess_bytes(image_bytes))
+
+    def predict_tensor(self, img_input: torch.Tensor) -> dict[str, Any]:
+        return self.predict_batch([img_input])[0]
+
+    def encode_batch(self, img_inputs: list[torch.Tensor] | torch.Tensor | np.ndarray) -> torch.Tensor:
+        """L2-normalized image embeddings for several preprocessed images (a list or a stacked batch)."""
+        batch = torch.stack(img_inputs) if isinstance(img_inputs, list) else torch.as_tensor(img_inputs)
+        batch = batch.to(self.device)
+
+        with torch.no_grad(), stage("clip_forward"):
+            img_feat = self.encoder(batch.to(self.dtype))
             img_feat /= img_feat.norm(dim=-1, keepdim=True)
+        return img_feat
 
-            text_tokens = clip.tokenize(
-                [f"a photo of {c} waste" for c in self.classes]
-            ).to(self.device)
+    def predict_batch(self, img_inputs: list[torch.Tensor]) -> list[dict[str, Any]]:
+        """Classify several preprocessed images with one forward pass."""
+        img_feat = self.encode_batch(img_inputs)
 
-            text_feat = self.model.encode_text(text_tokens)
-            text_feat /= text_feat.norm(dim=-1, keepdim=True)
+        with torch.no_grad():
+            sims = (img_feat.to(self.text_features.dtype) @ self.text_features.T).float().cpu()
 
-            sims = (img_feat @ text_feat.T).squeeze(0)
+        return [self._format_scores(row) for row in sims]
 
+    def _format_scores(self, sims: torch.Tensor) -> dict[str, Any]:
+        """Confidence is the softmax probability over the classes, as in CLIP's zero-shot
+        head, so it shares a scale with the other backends; raw keeps the cosine similarities."""
         scores = {
             self.classes[i]: float(sims[i])
             for i in range(len(self.classes))
         }
+        probs = torch.softmax(sims.float() * self.logit_scale, dim=-1)
 
-        best_class = max(scores, key=scores.get)
+        best = int(probs.argmax())
+        best_class = self.classes[best]
 
         return {
             "prediction": best_class,
-            "confidence": round(scores[best_class], 4),
-            "precision": float(scores[best_class]),
+            "confidence": round(float(probs[best]), 4),
+            "precision": float(probs[best]),
             "raw": scores,
         }
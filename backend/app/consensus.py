@@ -0,0 +1,153 @@
+"""
+Consensus engine: applies the Waste Guard and confidence thresholds to the
+Vertex and Vision+CLIP results and reconciles them into one recommendation.
+"""
+from __future__ import annotations
+
+from typing import Any
+
+from .label_rules import LabelRules, default_rules
+
+# Waste Guard vocabularies (negative domains / positive indicators) live in label_rules.json
+CONFIDENCE_THRESHOLD = 0.60
+# Placeholder prediction for a backend that was not called: cascade routing (cascade.py),
+# an open circuit breaker or a missed deadline (resilience.py)
+SKIPPED = "skipped"
+SKIP_REASONS = {"deadline_exceeded": "it missed its deadline", "circuit_open": "its circuit breaker is open"}
+
+
+def skipped_result(backend: str, reason: str) -> dict[str, Any]:
+    """Stand-in result for a backend that was not called or ran out of time."""
+    return {"prediction": SKIPPED, "confidence": 0.0, "raw": {}, "skipped": {backend: reason}}
+
+
+def build_response(
+    vertex_res: dict[str, Any],
+    v_latency: int,
+    vc_res: dict[str, Any],
+    vc_latency: int,
+    rules: LabelRules | None = None,
+) -> dict[str, Any]:
+    """Assemble the /predict response from both backend results (either may be SKIPPED)."""
+    # Waste Guard Logic (guard and validation terms matched in a single pass)
+    label_match = (rules or default_rules().current()).evaluate(vc_res.get("top_labels", []))
+    is_negative = label_match.is_negative
+    has_positive = label_match.has_positive
+
+    is_unrecognized = label_match.is_unrecognized
+
+    # Final result assembly with thresholds and guard
+    v_pred = vertex_res["prediction"]
+    v_conf = vertex_res["confidence"]
+    v_skipped = v_pred == SKIPPED
+    if not v_skipped and (is_unrecognized or v_conf < CONFIDENCE_THRESHOLD):
+        v_pred = "unrecognized" if is_unrecognized else f"ambiguous ({v_pred})"
+
+    vc_pred = vc_res["prediction"]
+    vc_conf = vc_res["confidence"]
+    vc_skipped = vc_pred == SKIPPED
+    if not vc_skipped and (is_unrecognized or vc_conf < CONFIDENCE_THRESHOLD):
+        vc_pred = "unrecognized" if is_unrecognized else f"ambiguous ({vc_pred})"
+
+    # Comparison Logic
+    match = v_pred.lower() == vc_pred.lower()
+    faster = "vertex" if v_latency < vc_latency else "vision"
+    if v_skipped or vc_skipped:
+        faster = "vision" if v_skipped else "vertex"
+
+    # Consensus Reasoning (Multi-Label Validation & Tie-Breaking)
+    raw_v_pred = vertex_res.get("prediction", "disabled").lower()
+    
+    # 1. Multi-Label Validation: Check if Vertex pred is in Vision's descriptive labels
+    is_validated = label_match.is_validated(raw_v_pred)
+    
+    # 2. Recommendation Logic
+    recommendation = v_pred
+    reasoning = "Vertex AI (Custom) and Pretrained Models are in full agreement."
+    reliability = max(v_conf, vc_conf)
+
+    if is_unrecognized:
+        recommendation = "unrecognized"
+        reasoning = "Both models agree this item is outside the waste domain (Waste Guard trigger)."
+        reliability = 1.0
+    elif not match:
+        if is_validated:
+            recommendation = v_pred
+            reasoning = f"Vertex predicted '{v_pred}', which was validated by Vision's descriptive labels."
+        else:
+            # Tie-break: Priority to Custom Model for specific waste classes
+            recommendation = v_pred
+            reasoning = f"Models disagree. Prioritizing Vertex AI as the domain specialist for waste classification."
+            reliability = v_conf * 0.9 # Slight penalty for disagreement
+
+    # 3. One side was not called: the cascade stopped before it, or its guard skipped it
+    v_reason = vertex_res.get("skipped", {}).get("vertex") if v_skipped else None
+    vc_reason = vc_res.get("skipped", {}).get("vision") if vc_skipped else None
+    if v_skipped and vc_skipped:
+        recommendation = "unavailable"
+        reasoning = f"Neither model answered (Vertex AI: {v_reason}, Vision + CLIP: {vc_reason})."
+        reliability = 0.0
+    elif v_skipped and not is_unrecognized:
+        # Thresholded like any other answer, so a low-confidence cascade stop reads as ambiguous
+        recommendation = vc_pred
+        if v_reason == "cascade":
+            reasoning = "Vision + CLIP cleared the cascade threshold, so Vertex AI was not called."
+        else:
+            reasoning = f"Vertex AI was skipped ({SKIP_REASONS.get(v_reason, v_reason)}); Vision + CLIP answered alone."
+        reliability = vc_conf
+    elif vc_skipped and not is_unrecognized:
+        recommendation = v_pred
+        if vc_reason == "cascade":
+            reasoning = "Vertex AI cleared the cascade threshold, so Vision + CLIP was not called."
+        else:
+            reasoning = f"Vision + CLIP was skipped ({SKIP_REASONS.get(vc_reason, vc_reason)}); Vertex AI answered alone."
+        reliability = v_conf
+    if (v_reason == "cascade" or vc_reason == "cascade") and recommendation.startswith("ambiguous"):
+        reasoning += " Its confidence is below the consensus threshold, so the answer is reported as ambiguous."
+
+    if "ambiguous" in v_pred and "ambiguous" in vc_pred:
+        recommendation = "ambiguous"
+        reasoning = "Both models are uncertain. Please provide a clearer image."
+        reliability = 0.5
+
+    return {
+        "consensus": {
+            "recommendation": recommendation,
+            "reasoning": reasoning,
+            "reliability": round(reliability, 2),
+            "is_validated_by_vision": is_validated,
+            "prediction_match": match,
+            "faster_model": faster
+        },
+        "vertex": {
+            "prediction": v_pred,
+            "confidence": v_conf,
+            "precision": vertex_res.get("precision", v_conf),
+            "latency_ms": v_latency,
+            "raw": {
+                **vertex_res.get("raw", {}),
+                "waste_guard": {
+                    "is_negative": is_negative,
+                    "has_positive": has_positive,
+                    "is_unrecognized": is_unrecognized,
+                    "threshold_applied": v_conf < CONFIDENCE_THRESHOLD
+                }
+            },
+        },
+        "vision": {
+            "prediction": vc_pred,
+            "confidence": vc_conf,
+            "precision": vc_res.get("precision", vc_conf),
+            "top_labels": vc_res.get("top_labels", []),
+            "latency_ms": vc_latency,
+            "raw": {
+                **vc_res.get("raw", {}),
+                "waste_guard": {
+                    "is_negative": is_negative,
+                    "has_positive": has_positive,
+                    "is_unrecognized": is_unrecognized,
+                    "threshold_applied": vc_conf < CONFIDENCE_THRESHOLD
+                }
+            },
+        }
+    }
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import io
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from PIL import Image
+
+from .metrics import stage
+
+# Formats the remote APIs accept as-is
+PASSTHROUGH_FORMATS = {"JPEG", "PNG"}
+
+
+@dataclass
+class PreparedImage:
+    """Artifacts shared by every backend for a single upload."""
+
+    original: bytes
+    image: Image.Image  # decoded RGB, downscaled to at most max_side
+    payload: bytes  # bytes sent to the remote APIs (original or re-encoded JPEG)
+    source_format: str | None
+    source_size: tuple[int, int]
+    clip_input: Any = None  # CLIP-ready (3, H, W) tensor when a preprocess fn is set
+
+    @property
+    def payload_reencoded(self) -> bool:
+        return self.payload is not self.original
+
+
+class ImagePipeline:
+    """Decode an upload once and derive what each backend needs from it.
+
+    Large JPEGs are decoded with draft mode (DCT-domain downscaling), the
+    remote-API payload is capped at `max_side` pixels, and the CLIP input
+    tensor is built from the same decoded image.
+    """
+
+    def __init__(
+        self,
+        max_side: int = 1024,
+        jpeg_quality: int = 90,
+        clip_preprocess: Callable[[Image.Image], Any] | None = None,
+    ) -> None:
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.clip_preprocess = clip_preprocess
+
+    def prepare(self, image_bytes: bytes) -> PreparedImage:
+        with stage("image_decode"):
+            img = Image.open(io.BytesIO(image_bytes))
+            source_format = img.format
+            source_size = img.size
+
+            if source_format == "JPEG":
+                # Lets libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= max_side
+                img.draft("RGB", (self.max_side, self.max_side))
+            img = img.convert("RGB")
+            if max(img.size) > self.max_side:
+                img.thumbnail((self.max_side, self.max_side), Image.BICUBIC)
+
+            if source_format in PASSTHROUGH_FORMATS and max(source_size) <= self.max_side:
+                payload = image_bytes
+            else:
+                buffer = io.BytesIO()
+                img.save(buffer, format="JPEG", quality=self.jpeg_quality)
+                payload = buffer.getvalue()
+
+        clip_input = None
+        if self.clip_preprocess:
+            with stage("clip_preprocess"):
+                clip_input = self.clip_preprocess(img)
+
+        return PreparedImage(
+            original=image_bytes,
+            image=img,
+            payload=payload,
+            source_format=source_format,
+            source_size=source_size,
+            clip_input=clip_input,
+        )
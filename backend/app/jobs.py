@@ -0,0 +1,386 @@
+"""
+Bulk classification jobs.
+
+A job classifies every image in an uploaded zip/tar archive or in an allowed
+server-side directory (e.g. split/test). Progress lives in a local SQLite
+store, so a restart resumes unfinished jobs where they stopped, and results
+are appended as they complete so /jobs/{id}/results can stream them as
+NDJSON while the job is still running.
+
+Tables:
+  jobs     one row per job (status, source, counters)
+  items    one row per image (pending | done | failed)
+  results  one compact record per finished image, in completion order
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache", "jobs")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELED = "queued", "running", "done", "failed", "canceled"
+FINAL_STATES = (DONE, FAILED, CANCELED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    source_kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    root TEXT,
+    total INTEGER,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    label TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS items_pending ON items (job_id, status, seq);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_job ON results (job_id, id);
+"""
+
+
+class JobStore:
+    """SQLite-backed job, item and result storage (safe to call from any thread)."""
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def create(self, source_kind: str, source: str) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, source_kind, source, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, source_kind, source, now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, limit: int = 50) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def unfinished(self) -> list[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def set_status(self, job_id: str, status: str, error: str | None = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def set_items(self, job_id: str, root: str, items: list[tuple[str, str | None]]) -> None:
+        """Record the job's images (relative path, label) in one transaction."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+            self._db.executemany(
+                "INSERT INTO items (job_id, seq, path, label) VALUES (?, ?, ?, ?)",
+                ((job_id, seq, path, label) for seq, (path, label) in enumerate(items, start=1)),
+            )
+            self._db.execute(
+                "UPDATE jobs SET root = ?, total = ?, updated_at = ? WHERE id = ?",
+                (root, len(items), time.time(), job_id),
+            )
+            self._db.execute("COMMIT")
+
+    def pending(self, job_id: str, limit: int) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, path, label FROM items WHERE job_id = ? AND status = 'pending' ORDER BY seq LIMIT ?",
+                (job_id, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def complete(self, job_id: str, records: list[dict[str, Any]]) -> None:
+        """Store finished records and mark their items, atomically, so a resume never repeats them."""
+        failed = sum(1 for record in records if record["status"] == FAILED)
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO results (job_id, seq, record) VALUES (?, ?, ?)",
+                ((job_id, record["seq"], json.dumps(record)) for record in records),
+            )
+            self._db.executemany(
+                "UPDATE items SET status = ? WHERE job_id = ? AND seq = ?",
+                ((record["status"], job_id, record["seq"]) for record in records),
+            )
+            self._db.execute(
+                "UPDATE jobs SET done = done + ?, failed = failed + ?, updated_at = ? WHERE id = ?",
+                (len(records) - failed, failed, time.time(), job_id),
+            )
+            self._db.execute("COMMIT")
+
+    def results(self, job_id: str, after: int = 0, limit: int = 500) -> list[tuple[int, str]]:
+        """(cursor, NDJSON line) pairs in completion order, starting after `after`."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, record FROM results WHERE job_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (job_id, after, limit),
+            ).fetchall()
+        return [(row["id"], row["record"]) for row in rows]
+
+
+def is_within(path: str, roots: list[str]) -> bool:
+    real = os.path.realpath(path)
+    return any(os.path.commonpath([real, os.path.realpath(root)]) == os.path.realpath(root) for root in roots)
+
+
+def list_images(root: str, root_label: str | None = None) -> list[tuple[str, str | None]]:
+    """(relative path, label) for every image under root; the label is the parent folder name,
+    or `root_label` for files directly under root (a job rooted at a class folder)."""
+    items = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith("."):
+                rel = os.path.relpath(os.path.join(dirpath, name), root)
+                parent = os.path.dirname(rel)
+                items.append((rel, os.path.basename(parent) if parent else root_label))
+    return items
+
+
+def extract_archive(archive: str, dest: str, max_file_bytes: int, max_total_bytes: int) -> None:
+    """Extract only regular image files, refusing paths that escape `dest` and oversized content."""
+    total = 0
+
+    def write(name: str, size: int, open_member: Callable[[], Any]) -> None:
+        nonlocal total
+        if not name.lower().endswith(IMAGE_EXTENSIONS) or size > max_file_bytes:
+            return
+        target = os.path.realpath(os.path.join(dest, name))
+        if not is_within(target, [dest]):
+            return
+        total += size
+        if total > max_total_bytes:
+            raise ValueError(f"Archive expands beyond {max_total_bytes // (1024 * 1024)} MB")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open_member() as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    os.makedirs(dest, exist_ok=True)
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    write(info.filename, info.file_size, lambda info=info: zf.open(info))
+    elif tarfile.is_tarfile(archive):
+        with tarfile.open(archive) as tf:
+            for member in tf:
+                if member.isfile():
+                    write(member.name, member.size, lambda member=member: tf.extractfile(member))
+    else:
+        raise ValueError("Upload is neither a zip nor a tar archive")
+
+
+def compact_result(response: dict[str, Any]) -> dict[str, Any]:
+    """The parts of a /predict response kept per job item."""
+    record = {
+        "recommendation": response["consensus"]["recommendation"],
+        "reliability": response["consensus"]["reliability"],
+        "vertex": {k: response["vertex"][k] for k in ("prediction", "confidence", "latency_ms")},
+        "vision": {k: response["vision"][k] for k in ("prediction", "confidence", "latency_ms")},
+    }
+    if "skipped" in response:
+        record["skipped"] = response["skipped"]
+    return record
+
+
+BatchClassifier = Callable[[list[bytes]], Awaitable[list[dict[str, Any]]]]
+
+
+class JobRunner:
+    """Processes queued jobs in the background with bounded parallelism."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        classify_batch: BatchClassifier,
+        jobs_dir: str,
+        batch_size: int = 16,
+        parallel_batches: int = 2,
+        max_running: int = 1,
+        max_file_bytes: int = 10 * 1024 * 1024,
+        max_extract_bytes: int = 20 * 1024 ** 3,
+        wait_until_ready: Callable[[], Awaitable[None]] | None = None,
+    ) -> None:
+        self.store = store
+        self.classify_batch = classify_batch
+        self.jobs_dir = jobs_dir
+        self.batch_size = max(1, batch_size)
+        self.parallel_batches = max(1, parallel_batches)
+        self.max_running = max(1, max_running)
+        self.max_file_bytes = max_file_bytes
+        self.max_extract_bytes = max_extract_bytes
+        self.wait_until_ready = wait_until_ready
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._canceled: set[str] = set()
+        self._active: set[str] = set()
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the workers and re-queue jobs left unfinished by a previous run."""
+        for job_id in self.store.unfinished():
+            self._queue.put_nowait(job_id)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_running)]
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def submit(self, job_id: str) -> None:
+        self._canceled.discard(job_id)
+        self.store.set_status(job_id, QUEUED)
+        self._queue.put_nowait(job_id)
+
+    def cancel(self, job_id: str) -> None:
+        self._canceled.add(job_id)
+        self.store.set_status(job_id, CANCELED)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            if job_id in self._canceled:
+                continue
+            if job_id in self._active:
+                # Resumed while its canceled run is still finishing its last batches
+                await asyncio.sleep(0.5)
+                self._queue.put_nowait(job_id)
+                continue
+            self._active.add(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Job {job_id} failed")
+                self.store.set_status(job_id, FAILED, error=str(e))
+            finally:
+                self._active.discard(job_id)
+
+    async def _run(self, job_id: str) -> None:
+        if self.wait_until_ready:
+            await self.wait_until_ready()
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINAL_STATES:
+            return
+        self.store.set_status(job_id, RUNNING)
+        if job["total"] is None:
+            await asyncio.to_thread(self._enumerate, job)
+            job = self.store.get(job_id)
+        logger.info(f"Job {job_id}: {job['total'] - job['done'] - job['failed']} of {job['total']} images to go.")
+
+        window = self.batch_size * self.parallel_batches
+        while job_id not in self._canceled:
+            items = await asyncio.to_thread(self.store.pending, job_id, window)
+            if not items:
+                break
+            chunks = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            await asyncio.gather(*(self._process(job_id, job["root"], chunk) for chunk in chunks))
+
+        if job_id not in self._canceled:
+            self.store.set_status(job_id, DONE)
+            logger.info(f"Job {job_id} finished.")
+            # Results live in the store; the uploaded archive and its extraction are no longer needed
+            if job["source_kind"] == "archive":
+                shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+                if os.path.exists(job["source"]):
+                    os.remove(job["source"])
+
+    def _enumerate(self, job: dict[str, Any]) -> None:
+        if job["source_kind"] == "archive":
+            root = os.path.join(self.job_dir(job["id"]), "images")
+            shutil.rmtree(root, ignore_errors=True)  # a previous run may have stopped mid-extraction
+            extract_archive(job["source"], root, self.max_file_bytes, self.max_extract_bytes)
+            root_label = None  # the extraction folder name says nothing about the images
+        else:
+            root = job["source"]
+            root_label = os.path.basename(os.path.normpath(root))
+        self.store.set_items(job["id"], root, list_images(root, root_label))
+
+    async def _process(self, job_id: str, root: str, items: list[dict[str, Any]]) -> None:
+        def read(item: dict[str, Any]) -> bytes | Exception:
+            try:
+                with open(os.path.join(root, item["path"]), "rb") as f:
+                    data = f.read(self.max_file_bytes + 1)
+                if len(data) > self.max_file_bytes:
+                    return ValueError("File too large")
+                return data
+            except OSError as e:
+                return e
+
+        contents = await asyncio.to_thread(lambda: [read(item) for item in items])
+        readable = [i for i, data in enumerate(contents) if not isinstance(data, Exception)]
+        results: dict[int, dict[str, Any]] = {}
+        if readable:
+            try:
+                batch = await self.classify_batch([contents[i] for i in readable])
+                results = dict(zip(readable, batch))
+            except Exception as e:
+                logger.warning(f"Job {job_id}: batch failed: {e}")
+                contents = [data if i not in readable else e for i, data in enumerate(contents)]
+
+        records = []
+        for i, item in enumerate(items):
+            record = {"job_id": job_id, "seq": item["seq"], "path": item["path"], "label": item["label"]}
+            result = results.get(i)
+            if result is None or "error" in result:
+                error = result["error"] if result else contents[i]
+                records.append({**record, "status": FAILED, "error": str(error)})
+            else:
+                records.append({**record, "status": DONE, **compact_result(result)})
+        await asyncio.to_thread(self.store.complete, job_id, records)
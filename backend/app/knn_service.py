@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from itertools import islice
+from typing import Any
+
+import numpy as np
+
+from .model_metadata import VISION_METRICS
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache", "knn")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _as_numpy(features) -> np.ndarray:
+    """encode_batch returns a torch tensor in-process and a numpy array from the shared CLIP server."""
+    if isinstance(features, np.ndarray):
+        return features.astype(np.float32, copy=False)
+    return features.float().cpu().numpy()
+
+
+class EmbeddingIndex:
+    """Append-only on-disk embedding index.
+
+    Layout of `index_dir`:
+      embeddings.f16  raw float16 matrix, one L2-normalized row per image (memory-mapped)
+      labels.i16      int16 class id per row (sidecar, same order)
+      paths.txt       source path per row, used to skip files already indexed
+      meta.json       model name, dim, row count and class names
+
+    Rows are appended in place, and `meta.json` is rewritten last, so an
+    interrupted add never exposes partial rows.
+    """
+
+    def __init__(self, index_dir: str, model_name: str | None = None, dim: int | None = None) -> None:
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self.meta: dict[str, Any] = {"model": model_name, "dim": dim, "count": 0, "classes": []}
+        self.paths: set[str] = set()
+        self.embeddings = np.zeros((0, dim or 0), dtype=np.float16)
+        self.labels = np.zeros(0, dtype=np.int16)
+
+        if os.path.exists(self._path("meta.json")):
+            self._load()
+            if model_name and self.meta["model"] != model_name:
+                raise ValueError(
+                    f"Index at {index_dir} was built with {self.meta['model']}, not {model_name}"
+                )
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    @property
+    def classes(self) -> list[str]:
+        return self.meta["classes"]
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _load(self) -> None:
+        with open(self._path("meta.json")) as f:
+            self.meta = json.load(f)
+        count, dim = self.meta["count"], self.meta["dim"]
+        if count:
+            self.embeddings = np.memmap(self._path("embeddings.f16"), dtype=np.float16, mode="r", shape=(count, dim))
+            self.labels = np.memmap(self._path("labels.i16"), dtype=np.int16, mode="r", shape=(count,))
+        else:
+            self.embeddings = np.zeros((0, dim or 0), dtype=np.float16)
+            self.labels = np.zeros(0, dtype=np.int16)
+        if os.path.exists(self._path("paths.txt")):
+            # Only the first `count` lines: later ones belong to rows an interrupted add never committed
+            with open(self._path("paths.txt"), encoding="utf-8") as f:
+                self.paths = {line.rstrip("\n") for line in islice(f, count) if line.strip()}
+
+    def add(self, embeddings: np.ndarray, labels: list[str], paths: list[str]) -> None:
+        """Append rows without rewriting the existing index."""
+        if len(embeddings) == 0:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if not self.meta["dim"]:
+                self.meta["dim"] = int(embeddings.shape[1])
+            if embeddings.shape[1] != self.meta["dim"]:
+                raise ValueError(f"Expected {self.meta['dim']}-d embeddings, got {embeddings.shape[1]}")
+
+            class_ids = []
+            for label in labels:
+                if label not in self.meta["classes"]:
+                    self.meta["classes"].append(label)
+                class_ids.append(self.meta["classes"].index(label))
+
+            os.makedirs(self.index_dir, exist_ok=True)
+            count, dim = self.meta["count"], self.meta["dim"]
+            # Drop any rows left behind by an interrupted add before appending
+            for name, row_bytes in (("embeddings.f16", dim * 2), ("labels.i16", 2)):
+                with open(self._path(name), "ab") as f:
+                    f.truncate(count * row_bytes)
+                    f.write(
+                        embeddings.astype(np.float16).tobytes()
+                        if name == "embeddings.f16"
+                        else np.asarray(class_ids, dtype=np.int16).tobytes()
+                    )
+            with open(self._path("paths.txt"), "a+b") as f:
+                f.seek(0)
+                f.truncate(sum(len(line) for line in islice(f, count)))
+                f.writelines(f"{p}\n".encode("utf-8") for p in paths)
+
+            self.meta["count"] = count + len(embeddings)
+            tmp_path = self._path("meta.json.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.meta, f, indent=2)
+            os.replace(tmp_path, self._path("meta.json"))
+            self._load()
+
+    def search(self, queries: np.ndarray, k: int, chunk_rows: int = 65536) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k cosine similarity per query. Returns (scores, row ids), each (n_queries, k)."""
+        queries = np.asarray(queries, dtype=np.float32)
+        embeddings, count = self.embeddings, len(self)
+        k = min(k, count)
+        if k == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, count, chunk_rows):
+            chunk = np.asarray(embeddings[start:start + chunk_rows], dtype=np.float32)
+            scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+            ids = np.concatenate(
+                [best_ids, np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk)))],
+                axis=1,
+            )
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                ids = np.take_along_axis(ids, top, axis=1)
+            best_scores, best_ids = scores, ids
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+
+class KnnService:
+    """Local nearest-neighbour classifier over CLIP image embeddings.
+
+    Exposes the same predict/predict_tensor/predict_batch interface as
+    ClipService, so VisionClipService can use it as its fallback with no
+    network round trip.
+    """
+
+    def __init__(self, clip_service, index_dir: str | None = None, k: int | None = None) -> None:
+        self.clip = clip_service
+        self.classes = clip_service.classes
+        self.k = k or int(os.getenv("KNN_K", "7"))
+        self.index = EmbeddingIndex(
+            index_dir or os.getenv("KNN_INDEX_DIR", DEFAULT_INDEX_DIR),
+            model_name=clip_service.model_name,
+        )
+
+    def predict(self, image_bytes: bytes) -> dict[str, Any]:
+        return self.predict_tensor(self.clip.preprocess_bytes(image_bytes))
+
+    def predict_tensor(self, img_input) -> dict[str, Any]:
+        return self.predict_batch([img_input])[0]
+
+    def predict_batch(self, img_inputs: list) -> list[dict[str, Any]]:
+        if len(self.index) == 0:
+            raise RuntimeError("kNN index is empty; build it with build_knn_index.py")
+        queries = _as_numpy(self.clip.encode_batch(img_inputs))
+        scores, ids = self.index.search(queries, self.k)
+        return [self._vote(row_scores, row_ids) for row_scores, row_ids in zip(scores, ids)]
+
+    def _vote(self, scores: np.ndarray, ids: np.ndarray) -> dict[str, Any]:
+        classes = self.index.classes
+        votes: dict[str, float] = {}
+        for score, class_id in zip(scores, self.index.labels[ids]):
+            label = classes[int(class_id)]
+            votes[label] = votes.get(label, 0.0) + max(float(score), 0.0)
+
+        total = sum(votes.values()) or 1.0
+        best_class = max(votes, key=votes.get)
+        confidence = votes[best_class] / total
+        return {
+            "prediction": best_class,
+            "confidence": round(confidence, 4),
+            "precision": VISION_METRICS.get(best_class, 0.0),
+            "raw": {
+                "votes": {label: round(v / total, 4) for label, v in votes.items()},
+                "neighbour_similarity": [round(float(s), 4) for s in scores],
+            },
+        }
+
+    def sync_shards(self, dataset, batch_size: int = 64) -> int:
+        """Embed and append every image of a tensor_shards.ShardDataset that is not indexed yet."""
+        added = 0
+        for images, class_ids, paths in dataset.batches(batch_size):
+            keep = [i for i, path in enumerate(paths) if path not in self.index.paths]
+            if not keep:
+                continue
+            embeddings = _as_numpy(self.clip.encode_batch(images[keep]))
+            self.index.add(
+                embeddings, [dataset.classes[class_ids[i]] for i in keep], [paths[i] for i in keep]
+            )
+            added += len(keep)
+        return added
+
+    def sync_directory(self, split_dir: str, batch_size: int = 32) -> int:
+        """Embed and append every image under split_dir/<class>/ that is not indexed yet."""
+        pending = []
+        for cls in sorted(os.listdir(split_dir)):
+            class_dir = os.path.join(split_dir, cls)
+            if not os.path.isdir(class_dir) or cls.startswith("."):
+                continue
+            for name in sorted(os.listdir(class_dir)):
+                path = os.path.abspath(os.path.join(class_dir, name))
+                if name.lower().endswith(IMAGE_EXTENSIONS) and path not in self.index.paths:
+                    pending.append((path, cls))
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            tensors = []
+            for path, _ in chunk:
+                with open(path, "rb") as f:
+                    tensors.append(self.clip.preprocess_bytes(f.read()))
+            embeddings = _as_numpy(self.clip.encode_batch(tensors))
+            self.index.add(embeddings, [label for _, label in chunk], [path for path, _ in chunk])
+        return len(pending)
@@ -0,0 +1,233 @@
+"""
+Label rule engine shared by VisionClipService (class mapping) and the
+consensus engine (Waste Guard and Vertex validation).
+
+All keyword lists live in label_rules.json (or RULES_PATH) and are compiled
+into one Aho-Corasick automaton, so matching a label costs one pass over its
+characters however large the vocabulary grows. Matching keeps the original
+substring semantics: a term matches if it occurs anywhere in the label.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "label_rules.json")
+
+NEGATIVE = "negative"
+POSITIVE = "positive"
+CLASS_PREFIX = "class:"
+VALIDATE_PREFIX = "validate:"
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher; reports the tags of every term found."""
+
+    def __init__(self, patterns: dict[str, set[str]]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[frozenset[str]] = [frozenset()]
+        outputs: list[set[str]] = [set()]
+
+        for term, tags in patterns.items():
+            node = 0
+            for ch in term:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                node = nxt
+            outputs[node].update(tags)
+
+        # Breadth-first failure links; each node inherits the outputs of its suffixes
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0) if node else 0
+                outputs[child] |= outputs[self._fail[child]]
+        self._out = [frozenset(o) for o in outputs]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def tags(self, text: str) -> set[str]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found: set[str] = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+@dataclass
+class LabelMatch:
+    """Everything the request path needs to know about one set of Vision labels."""
+
+    predicted_class: str | None = None
+    matched_label: dict[str, Any] | None = None
+    is_negative: bool = False
+    has_positive: bool = False
+    validated_classes: set[str] = field(default_factory=set)
+    labels: list[str] = field(default_factory=list)
+    known_classes: frozenset[str] = frozenset()
+
+    @property
+    def is_unrecognized(self) -> bool:
+        return self.is_negative and not self.has_positive
+
+    def is_validated(self, prediction: str) -> bool:
+        """True if `prediction` occurs in any label (same semantics as a substring scan)."""
+        prediction = prediction.lower()
+        if prediction in self.validated_classes:
+            return True
+        if prediction in self.known_classes:
+            return False
+        return any(prediction in label for label in self.labels)
+
+
+class LabelRules:
+    """Compiled rule set built from a rules dict (see label_rules.json)."""
+
+    def __init__(self, config: dict[str, Any]) -> None:
+        self.classes: list[str] = list(config["classes"])
+        self.term_count = 0
+
+        patterns: dict[str, set[str]] = {}
+
+        def add(term: str, tag: str) -> None:
+            term = term.strip().lower()
+            if term:
+                patterns.setdefault(term, set()).add(tag)
+
+        for cls, keywords in config["classes"].items():
+            for keyword in keywords:
+                add(keyword, CLASS_PREFIX + cls)
+            # Class names double as validation terms for Vertex predictions
+            add(cls, VALIDATE_PREFIX + cls)
+        for term in config.get("negative_domains", []):
+            add(term, NEGATIVE)
+        for term in config.get("positive_indicators", []):
+            add(term, POSITIVE)
+
+        self.term_count = len(patterns)
+        self._matcher = AhoCorasick(patterns)
+        self._class_names = frozenset(c.lower() for c in self.classes)
+
+    @property
+    def state_count(self) -> int:
+        return len(self._matcher)
+
+    def evaluate(self, top_labels: list[dict[str, Any]]) -> LabelMatch:
+        """Class mapping, guard detection and validation for Vision labels in one pass."""
+        match = LabelMatch(known_classes=self._class_names)
+        for label in top_labels:
+            text = label["label"].lower()
+            match.labels.append(text)
+            tags = self._matcher.tags(text)
+            if not tags:
+                continue
+            match.is_negative = match.is_negative or NEGATIVE in tags
+            match.has_positive = match.has_positive or POSITIVE in tags
+            for tag in tags:
+                if tag.startswith(VALIDATE_PREFIX):
+                    match.validated_classes.add(tag[len(VALIDATE_PREFIX):])
+            if match.predicted_class is None:
+                for cls in self.classes:
+                    if CLASS_PREFIX + cls in tags:
+                        match.predicted_class = cls
+                        match.matched_label = label
+                        break
+        return match
+
+    def evaluate_batch(self, batch: list[list[dict[str, Any]]]) -> list[LabelMatch]:
+        return [self.evaluate(top_labels) for top_labels in batch]
+
+
+class RuleStore:
+    """Holds the current LabelRules and hot-reloads them when the file changes."""
+
+    def __init__(self, path: str | None = None, check_interval: float | None = None) -> None:
+        self.path = path or os.getenv("RULES_PATH", DEFAULT_RULES_PATH)
+        self.check_interval = (
+            check_interval if check_interval is not None
+            else float(os.getenv("RULES_RELOAD_INTERVAL_S", "5"))
+        )
+        self._lock = threading.Lock()
+        self._mtime = 0.0
+        self._checked = 0.0
+        self.reloads = 0
+        self._rules = self._compile()
+
+    def _compile(self) -> LabelRules:
+        with open(self.path) as f:
+            config = json.load(f)
+        rules = LabelRules(config)
+        self._mtime = os.path.getmtime(self.path)
+        return rules
+
+    def reload(self) -> LabelRules:
+        """Recompile from disk now; keeps the previous rules if the file is invalid."""
+        with self._lock:
+            try:
+                self._rules = self._compile()
+                self.reloads += 1
+                logger.info(f"Label rules reloaded from {self.path} ({self._rules.term_count} terms).")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Label rules reload failed, keeping previous rules: {e}")
+                try:
+                    self._mtime = os.path.getmtime(self.path)  # don't retry until it changes again
+                except OSError:
+                    pass
+            return self._rules
+
+    def current(self) -> LabelRules:
+        now = time.monotonic()
+        if self.check_interval > 0 and now - self._checked >= self.check_interval:
+            self._checked = now
+            try:
+                changed = os.path.getmtime(self.path) != self._mtime
+            except OSError:
+                changed = False
+            if changed:
+                return self.reload()
+        return self._rules
+
+    def stats(self) -> dict[str, Any]:
+        rules = self._rules
+        return {
+            "path": self.path,
+            "terms": rules.term_count,
+            "classes": rules.classes,
+            "automaton_states": rules.state_count,
+            "reloads": self.reloads,
+        }
+
+
+_default_store: RuleStore | None = None
+
+
+def default_rules() -> RuleStore:
+    global _default_store
+    if _default_store is None:
+        _default_store = RuleStore()
+    return _default_store
@@ -0,0 +1,176 @@
+"""
+Lightweight in-process metrics used by the service layer.
+Values are kept per worker process and exposed through the /stats endpoint
+and, in Prometheus text format, through /metrics.
+
+Request stages are timed with `stage(name)`, which feeds the
+wasteml_stage_seconds histogram and the wasteml_stage_in_flight gauge and,
+when a request trace is active (see start_trace), records the span for the
+slow-request profiler.
+"""
+from __future__ import annotations
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+# Request stages timed across the services (label values of wasteml_stage_seconds)
+STAGES = (
+    "upload_read",
+    "image_decode",
+    "clip_preprocess",
+    "base64_encode",
+    "token_refresh",
+    "vertex_network",
+    "vision_rpc",
+    "clip_forward",
+    "consensus",
+    "response_encode",
+)
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Histogram:
+    """Cumulative bucketed histogram (Prometheus-style upper bounds)."""
+
+    def __init__(self, buckets: list[float]) -> None:
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    def cumulative(self) -> tuple[list[tuple[str, int]], float, int]:
+        """(upper bound, cumulative count) pairs plus the unrounded sum and the count."""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+
+        running = 0
+        buckets = []
+        for bound, n in zip(self.buckets + [float("inf")], counts):
+            running += n
+            buckets.append(("+Inf" if bound == float("inf") else f"{bound:g}", running))
+        return buckets, total, count
+
+    def snapshot(self) -> dict[str, Any]:
+        buckets, total, count = self.cumulative()
+        return {
+            "count": count,
+            "sum": round(total, 3),
+            "mean": round(total / count, 3) if count else 0.0,
+            "buckets": dict(buckets),
+        }
+
+
+def _label_key(labels: dict[str, Any]) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple[tuple[str, str], ...]) -> str:
+    if not key:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Labeled counters, gauges and histograms rendered in Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._families: dict[str, tuple[str, str, list[float] | None]] = {}
+        self._values: dict[str, dict[tuple, Any]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, kind: str, help_text: str, buckets: list[float] | None = None) -> None:
+        with self._lock:
+            if name not in self._families:
+                self._families[name] = (kind, help_text, buckets)
+                self._values[name] = {}
+
+    def _child(self, name: str, labels: dict[str, Any]) -> tuple[tuple, dict[tuple, Any]]:
+        return _label_key(labels), self._values[name]
+
+    def inc(self, name: str, amount: float = 1.0, **labels: Any) -> None:
+        key, values = self._child(name, labels)
+        with self._lock:
+            values[key] = values.get(key, 0.0) + amount
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        """Set a gauge, or mirror a counter kept elsewhere (e.g. cache stats)."""
+        key, values = self._child(name, labels)
+        with self._lock:
+            values[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key, values = self._child(name, labels)
+        histogram = values.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = values.setdefault(key, Histogram(self._families[name][2] or SECONDS_BUCKETS))
+        histogram.observe(value)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = [(name, *meta, dict(self._values[name])) for name, meta in self._families.items()]
+        for name, kind, help_text, _, values in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(values.items()):
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+                    continue
+                buckets, total, count = value.cumulative()
+                for bound, cumulative in buckets:
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total:.6g}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.register("wasteml_stage_seconds", "histogram", "Duration of each request stage.")
+REGISTRY.register("wasteml_stage_in_flight", "gauge", "Stage executions currently running.")
+REGISTRY.register("wasteml_stage_errors_total", "counter", "Stage executions that raised.")
+for _name in STAGES:
+    REGISTRY.set("wasteml_stage_in_flight", 0, stage=_name)
+
+# Spans of the current request, when the slow-request profiler is tracing it
+_trace: contextvars.ContextVar[list | None] = contextvars.ContextVar("wasteml_trace", default=None)
+
+
+def start_trace() -> list:
+    """Collect (stage, start, seconds) spans for the current request and its copied contexts."""
+    spans: list = []
+    _trace.set(spans)
+    return spans
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time one request stage."""
+    REGISTRY.inc("wasteml_stage_in_flight", 1, stage=name)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        REGISTRY.inc("wasteml_stage_errors_total", stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.inc("wasteml_stage_in_flight", -1, stage=name)
+        REGISTRY.observe("wasteml_stage_seconds", elapsed, stage=name)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((name, start, elapsed))
@@ -1,7 +1,21 @@
 """
 Centralized store for historical model accuracy metrics (Precision).
 In a production system, these might be fetched from a Model Registry or Evaluation Database.
+
+The defaults below are overlaid at import time with measured values from the
+metrics file written by `benchmark.py` (MODEL_METRICS_PATH, default
+backend/model_metrics.json), when that file exists.
 """
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = os.getenv(
+    "MODEL_METRICS_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "model_metrics.json"),
+)
 
 # Precision = How often the model is correct when it predicts a specific class
 # Based on historical benchmarking data (example values for this project)
@@ -21,3 +35,24 @@ VISION_METRICS = {
     "disabled": 0.0,
     "unrecognized": 0.0
 }
+
+
+def load_metrics(path: str = METRICS_PATH) -> bool:
+    """Overlay per-class precision from a benchmark metrics file. Returns True if loaded."""
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read model metrics from {path}: {e}")
+        return False
+
+    for key, target in (("vertex", VERTEX_METRICS), ("vision", VISION_METRICS)):
+        precision = data.get(key, {}).get("precision")
+        if precision:
+            target.update({cls: float(value) for cls, value in precision.items()})
+    return True
+
+
+load_metrics()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 difference hash -> 64-bit fingerprint
+
+
+def perceptual_hash(image: bytes | Image.Image) -> int | None:
+    """64-bit difference hash (dHash); robust to re-encoding and small shifts."""
+    try:
+        if isinstance(image, Image.Image):
+            img = image
+        else:
+            img = Image.open(io.BytesIO(image))
+            # JPEG draft mode decodes at 1/2..1/8 scale, far cheaper than a full decode
+            img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    except Exception:
+        return None
+
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass(frozen=True)
+class CacheKey:
+    digest: str
+    phash: int | None = None
+
+
+@dataclass
+class _Entry:
+    phash: int | None
+    results: dict[str, tuple[dict[str, Any], float, int]] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return sum(size for _, _, size in self.results.values())
+
+
+class PredictionCache:
+    """Per-backend prediction cache keyed by image content.
+
+    Exact lookups use the SHA-256 of the upload. When `phash_distance` is
+    >= 0, misses fall back to the closest cached perceptual hash within that
+    Hamming distance. Entries are evicted LRU-first when `max_entries` or
+    `max_bytes` is exceeded, and individual results expire after `ttl_seconds`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600.0,
+        phash_distance: int = -1,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.phash_distance = phash_distance
+
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[str, int]] = {}
+        self.evictions = 0
+
+    @property
+    def near_duplicates_enabled(self) -> bool:
+        return self.phash_distance >= 0
+
+    def key_for(self, image_bytes: bytes, image: Image.Image | None = None) -> CacheKey:
+        """Build a lookup key; pass the decoded `image` to avoid decoding twice."""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        if not self.near_duplicates_enabled:
+            return CacheKey(digest)
+        with self._lock:
+            if digest in self._entries:
+                return CacheKey(digest, self._entries[digest].phash)
+        return CacheKey(digest, perceptual_hash(image if image is not None else image_bytes))
+
+    def get(self, key: CacheKey, backend: str) -> tuple[dict[str, Any], str] | None:
+        """Return (result, "exact" | "near") or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            result = self._lookup(key.digest, backend, now)
+            if result is not None:
+                self._count(backend, "exact_hits")
+                return result, "exact"
+
+            if self.near_duplicates_enabled and key.phash is not None:
+                digest = self._nearest(key.phash, backend)
+                if digest is not None:
+                    result = self._lookup(digest, backend, now)
+                    if result is not None:
+                        self._count(backend, "near_hits")
+                        return result, "near"
+
+            self._count(backend, "misses")
+            return None
+
+    def put(self, key: CacheKey, backend: str, result: dict[str, Any]) -> None:
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            entry = self._entries.get(key.digest)
+            if entry is None:
+                entry = self._entries[key.digest] = _Entry(phash=key.phash)
+            else:
+                self._entries.move_to_end(key.digest)
+                if backend in entry.results:
+                    self._bytes -= entry.results[backend][2]
+            entry.results[backend] = (result, expires, size)
+            self._bytes += size
+            self._count(backend, "stores")
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "phash_distance": self.phash_distance,
+                "evictions": self.evictions,
+                "backends": {name: dict(c) for name, c in self._counters.items()},
+            }
+
+    def _count(self, backend: str, name: str) -> None:
+        counters = self._counters.setdefault(
+            backend, {"exact_hits": 0, "near_hits": 0, "misses": 0, "stores": 0}
+        )
+        counters[name] += 1
+
+    def _lookup(self, digest: str, backend: str, now: float) -> dict[str, Any] | None:
+        entry = self._entries.get(digest)
+        if entry is None or backend not in entry.results:
+            return None
+        result, expires, size = entry.results[backend]
+        if expires < now:
+            del entry.results[backend]
+            self._bytes -= size
+            if not entry.results:
+                del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return result
+
+    def _nearest(self, phash: int, backend: str) -> str | None:
+        best_digest, best_distance = None, self.phash_distance + 1
+        for digest, entry in self._entries.items():
+            if entry.phash is None or backend not in entry.results:
+                continue
+            distance = hamming_distance(entry.phash, phash)
+            if distance < best_distance:
+                best_digest, best_distance = digest, distance
+                if distance == 0:
+                    break
+        return best_digest
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
@@ -0,0 +1,103 @@
+"""
+Sampling profiler for slow requests.
+
+While requests are in flight, a background thread samples the stack of every
+thread each PROFILE_INTERVAL_MS. When a request takes longer than
+PROFILE_SLOW_MS, the samples taken during it are written to PROFILE_DIR as
+folded stacks (one "frame;frame;frame count" line per stack, the input format
+of flamegraph.pl and speedscope), headed by the request's stage spans.
+
+Samples cover the whole process, so stacks of concurrent requests show up
+too. Disabled (no thread, no sampling) unless PROFILE_SLOW_MS > 0.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class SlowRequestProfiler:
+    def __init__(self, slow_ms: float, interval_ms: float = 5.0, out_dir: str = "cache/profiles", max_depth: int = 48) -> None:
+        self.slow_s = slow_ms / 1000.0
+        self.interval_s = max(interval_ms, 1.0) / 1000.0
+        self.out_dir = out_dir
+        self.max_depth = max_depth
+        # (timestamp, folded stacks) for roughly the last minute of sampling
+        self._samples: deque[tuple[float, list[str]]] = deque(maxlen=int(60 / self.interval_s))
+        self._active = 0
+        self._wake = threading.Condition()
+        self._stopped = False
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    def begin(self) -> float:
+        with self._wake:
+            self._active += 1
+            self._wake.notify()
+        return time.perf_counter()
+
+    def end(self, started: float, label: str, spans: list[tuple[str, float, float]]) -> str | None:
+        """Finish a request; returns the profile path if it was slow."""
+        ended = time.perf_counter()
+        with self._wake:
+            self._active -= 1
+        if ended - started < self.slow_s:
+            return None
+        stacks = Counter(
+            stack for taken, sampled in list(self._samples) if started <= taken <= ended for stack in sampled
+        )
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int((ended - started) * 1000)}ms-{re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')}.folded"
+        path = os.path.join(self.out_dir, name)
+        with open(path, "w") as f:
+            f.write(f"# {label} took {(ended - started) * 1000:.1f} ms\n")
+            for stage_name, start, seconds in sorted(spans, key=lambda span: span[1]):
+                f.write(f"# stage {stage_name} +{(start - started) * 1000:.1f} ms for {seconds * 1000:.1f} ms\n")
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.written += 1
+        logger.warning(f"Slow request {label}: {(ended - started) * 1000:.0f} ms, profile written to {path}")
+        return path
+
+    def close(self) -> None:
+        with self._wake:
+            self._stopped = True
+            self._wake.notify()
+
+    def stats(self) -> dict[str, Any]:
+        return {"slow_ms": self.slow_s * 1000, "interval_ms": self.interval_s * 1000, "profiles_written": self.written}
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            with self._wake:
+                while self._active == 0 and not self._stopped:
+                    self._wake.wait()
+                if self._stopped:
+                    return
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = [
+                self._fold(names.get(ident, str(ident)), frame)
+                for ident, frame in sys._current_frames().items()
+                if ident != own
+            ]
+            self._samples.append((now, sampled))
+            time.sleep(self.interval_s)
+
+    def _fold(self, thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join([thread_name, *reversed(frames)])
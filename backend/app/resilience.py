@@ -0,0 +1,275 @@
+"""
+Deadlines, hedged requests and circuit breakers for the remote backends.
+
+Each BackendGuard wraps one backend (settings read from <NAME>_* env vars):
+  deadline  the call is abandoned after <NAME>_DEADLINE_S seconds
+  hedging   if the call is still running after the <NAME>_HEDGE_PERCENTILE of
+            recent latencies, one identical request is sent and the first good
+            answer wins (0 disables hedging)
+  breaker   after <NAME>_BREAKER_FAILURES consecutive errors or timeouts the
+            backend is fast-failed for <NAME>_BREAKER_RESET_S seconds, then a
+            single probe request decides whether it is closed again
+
+A call that is not made (open circuit) or runs out of time raises
+BackendSkipped, so callers can report the backend as skipped.
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class BackendSkipped(Exception):
+    def __init__(self, backend: str, reason: str) -> None:
+        super().__init__(f"{backend} skipped: {reason}")
+        self.backend = backend
+        self.reason = reason
+
+
+class SharedFailure(Exception):
+    """Error of one RPC made for several callers (e.g. a coalesced batch).
+
+    Only one caller gets the original error; the others get this wrapper, so
+    the breaker counts the failed RPC once rather than once per caller.
+    """
+
+    def __init__(self, error: BaseException) -> None:
+        super().__init__(str(error))
+        self.error = error
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self, failure_threshold: int, reset_timeout_s: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_s:
+                self.state, self._probing = HALF_OPEN, False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state, self.failures, self._probing = CLOSED, 0, False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state, self._opened_at, self._probing = OPEN, time.monotonic(), False
+
+    def release(self) -> None:
+        """Give up a probe that ended without an outcome (the caller was cancelled)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+
+class BackendGuard:
+    """Deadline + hedging + circuit breaker around one backend's calls."""
+
+    def __init__(
+        self,
+        name: str,
+        deadline_s: float,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_timeout_s: float = 30.0,
+        is_failure: Callable[[Any], bool] | None = None,
+    ) -> None:
+        self.name = name
+        self.deadline_s = deadline_s
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout_s)
+        self._is_failure = is_failure or (lambda result: False)
+        self._latencies: deque[float] = deque(maxlen=256)
+        self._lock = threading.Lock()
+        self._pool: concurrent.futures.ThreadPoolExecutor | None = None
+        self.counters = {"calls": 0, "errors": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0, "skipped": 0}
+
+    @classmethod
+    def from_env(cls, name: str, deadline_s: float, **kwargs) -> "BackendGuard":
+        prefix = name.upper()
+        return cls(
+            name,
+            deadline_s=float(os.getenv(f"{prefix}_DEADLINE_S", str(deadline_s))),
+            hedge_percentile=float(os.getenv(f"{prefix}_HEDGE_PERCENTILE", "95")),
+            failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+            reset_timeout_s=float(os.getenv(f"{prefix}_BREAKER_RESET_S", "30")),
+            **kwargs,
+        )
+
+    def hedge_delay(self) -> float | None:
+        """Seconds to wait before hedging, or None until enough latencies are known."""
+        if self.hedge_percentile <= 0:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        rank = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100.0))
+        return ordered[rank]
+
+    def _admit(self) -> None:
+        with self._lock:
+            self.counters["calls"] += 1
+        if not self.breaker.allow():
+            with self._lock:
+                self.counters["skipped"] += 1
+            raise BackendSkipped(self.name, "circuit_open")
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def _succeeded(self, started: float, hedge_won: bool) -> None:
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+            if hedge_won:
+                self.counters["hedge_wins"] += 1
+        self.breaker.record_success()
+
+    def _failed(self, key: str) -> None:
+        self._count(key)
+        self.breaker.record_failure()
+
+    async def acall(self, fn: Callable, *args) -> Any:
+        """Guarded call of an async backend function."""
+        self._admit()
+        started = time.monotonic()
+        deadline = started + self.deadline_s
+        hedge_at = None if (delay := self.hedge_delay()) is None else started + delay
+        primary = asyncio.ensure_future(fn(*args))
+        pending = {primary}
+        outcome: tuple[Any, BaseException | None] = (None, None)
+        try:
+            while pending:
+                wake = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, wake - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.cancelled():
+                        outcome = (None, RuntimeError(f"{self.name} attempt was cancelled"))
+                        continue
+                    error = task.exception()
+                    result = None if error else task.result()
+                    if error is None and not self._is_failure(result):
+                        self._succeeded(started, task is not primary)
+                        return result
+                    outcome = (result, error)
+                if pending and time.monotonic() >= deadline:
+                    self._failed("timeouts")
+                    raise BackendSkipped(self.name, "deadline_exceeded")
+                if pending and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    self._count("hedges")
+                    pending.add(asyncio.ensure_future(fn(*args)))
+        except BaseException:
+            # Cancelled mid-call: without this a half-open probe would never report back
+            # and the breaker would stay half-open, skipping every call
+            self.breaker.release()
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+
+        result, error = outcome
+        if isinstance(error, SharedFailure):
+            self._count("errors")
+            self.breaker.release()
+        else:
+            self._failed("errors")
+        if error is not None:
+            raise error
+        return result
+
+    def call(self, fn: Callable, *args) -> Any:
+        """Guarded call of a blocking backend function (run on the guard's own threads).
+
+        Abandoned attempts cannot be interrupted, so the backend client should
+        also enforce a timeout of its own.
+        """
+        self._admit()
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=32, thread_name_prefix=f"{self.name}-guard"
+                    )
+        started = time.monotonic()
+        deadline = started + self.deadline_s
+        hedge_at = None if (delay := self.hedge_delay()) is None else started + delay
+        # Attempts run in the caller's context so request-scoped state (stage spans) follows them
+        primary = self._pool.submit(contextvars.copy_context().run, fn, *args)
+        pending = {primary}
+        outcome: tuple[Any, BaseException | None] = (None, None)
+        while pending:
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, pending = concurrent.futures.wait(
+                pending, timeout=max(0.0, wake - time.monotonic()),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                error = future.exception()
+                result = None if error else future.result()
+                if error is None and not self._is_failure(result):
+                    self._succeeded(started, future is not primary)
+                    return result
+                outcome = (result, error)
+            if pending and time.monotonic() >= deadline:
+                self._failed("timeouts")
+                raise BackendSkipped(self.name, "deadline_exceeded")
+            if pending and hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                self._count("hedges")
+                pending.add(self._pool.submit(contextvars.copy_context().run, fn, *args))
+
+        self._failed("errors")
+        result, error = outcome
+        if error is not None:
+            raise error
+        return result
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, Any]:
+        delay = self.hedge_delay()
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "circuit_trips": self.breaker.trips,
+            "deadline_s": self.deadline_s,
+            "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+        }
@@ -0,0 +1,124 @@
+"""
+Response views and serialization for /predict and /ws/stream.
+
+Views:
+  verbose  the full response: consensus, per-backend results with raw Vertex
+           JSON, Vision label annotations and the Waste Guard block
+  compact  the consensus plus prediction, confidence and latency per backend,
+           for high-rate device clients
+
+Encodings are negotiated from the Accept header: MessagePack
+(application/msgpack) when the msgpack package is installed, otherwise JSON,
+encoded with orjson when it is installed and the standard library if not.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+from .metrics import REGISTRY, stage
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the json module
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: MessagePack is then not offered
+    msgpack = None
+
+VIEWS = ("verbose", "compact")
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_ALIASES = {MSGPACK, "application/x-msgpack", "application/vnd.msgpack"}
+
+REGISTRY.register(
+    "wasteml_response_bytes", "histogram", "Encoded prediction response size by view and format.",
+    buckets=[256, 512, 1024, 2048, 4096, 8192, 16384, 65536],
+)
+
+
+def compact_view(response: dict[str, Any]) -> dict[str, Any]:
+    """The consensus and per-backend prediction, confidence and latency of a verbose response."""
+    compact = {
+        "consensus": response["consensus"],
+        "vertex": {k: response["vertex"].get(k) for k in ("prediction", "confidence", "latency_ms")},
+        "vision": {k: response["vision"].get(k) for k in ("prediction", "confidence", "latency_ms")},
+    }
+    for key in ("skipped", "cascade"):
+        if key in response:
+            compact[key] = response[key]
+    return compact
+
+
+def apply_view(response: dict[str, Any], view: str) -> dict[str, Any]:
+    return compact_view(response) if view == "compact" else response
+
+
+def offered_types() -> list[str]:
+    return [JSON, MSGPACK] if msgpack is not None else [JSON]
+
+
+def negotiate(accept: str | None) -> str:
+    """Media type to answer with for an Accept header; JSON when nothing better matches."""
+    if not accept:
+        return JSON
+    ranges = []
+    for part in accept.split(","):
+        media, *params = (p.strip() for p in part.split(";"))
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        media = MSGPACK if media.lower() in MSGPACK_ALIASES else media.lower()
+        ranges.append((media, q))
+
+    def quality(offer: str) -> float:
+        # The most specific matching range decides: type/subtype, then type/*, then */*
+        for pattern in (offer, offer.split("/")[0] + "/*", "*/*"):
+            matches = [q for media, q in ranges if media == pattern]
+            if matches:
+                return max(matches)
+        return 0.0
+
+    best, best_q = JSON, 0.0
+    for offer in offered_types():  # JSON first, so it wins ties such as */*
+        q = quality(offer)
+        if q > best_q:
+            best, best_q = offer, q
+    return best
+
+
+def encode(content: Any, media_type: str = JSON) -> bytes:
+    if media_type == MSGPACK and msgpack is not None:
+        try:
+            return msgpack.packb(content, use_bin_type=True)
+        except TypeError:
+            return msgpack.packb(jsonable_encoder(content), use_bin_type=True)
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(jsonable_encoder(content), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps(content: Any) -> str:
+    """JSON text (for WebSocket text frames)."""
+    return encode(content).decode("utf-8")
+
+
+def prediction_response(response: dict[str, Any], view: str, accept: str | None) -> Response:
+    """Encode a /predict response in the requested view and the negotiated format."""
+    media_type = negotiate(accept)
+    with stage("response_encode"):
+        body = encode(apply_view(response, view), media_type)
+    REGISTRY.observe("wasteml_response_bytes", len(body), view=view, format=media_type.split("/")[1])
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
@@ -0,0 +1,123 @@
+"""
+In-process stand-ins for the Google backends, used for offline benchmarking
+and development without credentials or network access.
+
+Predictions are deterministic per image (derived from its hash) and carry
+no real signal; they only exercise the request path, concurrency and
+consensus logic with realistic latencies.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Any
+
+from .metrics import stage
+from .model_metadata import VERTEX_METRICS
+
+CLASSES = ["metal", "cardboard", "plastic"]
+
+CANNED_LABELS = {
+    "metal": ["Tin can", "Aluminium foil", "Metal", "Recycling", "Silver"],
+    "plastic": ["Plastic bottle", "Bottled water", "Plastic", "Container", "Packaging"],
+    "cardboard": ["Cardboard", "Shipping box", "Carton", "Paper product", "Packaging"],
+}
+
+
+def _image_seed(image_bytes: bytes) -> int:
+    return int.from_bytes(hashlib.sha1(image_bytes).digest()[:8], "big")
+
+
+class _StandIn:
+    def __init__(self, latency_ms: float | None = None, jitter_ms: float | None = None,
+                 error_rate: float | None = None) -> None:
+        self.latency_ms = latency_ms if latency_ms is not None else float(os.getenv("STANDIN_LATENCY_MS", "80"))
+        self.jitter_ms = jitter_ms if jitter_ms is not None else float(os.getenv("STANDIN_JITTER_MS", "20"))
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv("STANDIN_ERROR_RATE", "0"))
+
+    def _delay(self, rng: random.Random) -> float:
+        return max(0.0, rng.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+
+
+class LocalVertexService(_StandIn):
+    """Drop-in replacement for VertexService with the same result shape."""
+
+    def predict(self, image_bytes: bytes) -> dict[str, Any]:
+        rng = random.Random(_image_seed(image_bytes))
+        with stage("vertex_network"):
+            time.sleep(self._delay(rng))
+        return self._result(rng)
+
+    async def apredict(self, image_bytes: bytes) -> dict[str, Any]:
+        rng = random.Random(_image_seed(image_bytes))
+        with stage("vertex_network"):
+            await asyncio.sleep(self._delay(rng))
+        return self._result(rng)
+
+    def predict_batch(self, images: list[bytes]) -> list[dict[str, Any]]:
+        with stage("vertex_network"):
+            time.sleep(self._delay(random.Random()))
+        return [self._result(random.Random(_image_seed(b))) for b in images]
+
+    async def apredict_batch(self, images: list[bytes]) -> list[dict[str, Any]]:
+        with stage("vertex_network"):
+            await asyncio.sleep(self._delay(random.Random()))
+        return [self._result(random.Random(_image_seed(b))) for b in images]
+
+    async def aclose(self) -> None:
+        pass
+
+    def _result(self, rng: random.Random) -> dict[str, Any]:
+        if rng.random() < self.error_rate:
+            return {"prediction": "error: stand-in failure", "confidence": 0.0, "time": 0.0, "raw": {}}
+        label = rng.choice(CLASSES)
+        confidence = round(rng.uniform(0.4, 0.99), 4)
+        return {
+            "prediction": label,
+            "confidence": confidence,
+            "precision": VERTEX_METRICS.get(label, 0.0),
+            "time": 0.0,
+            "raw": {"predictions": [{"displayNames": [label], "confidences": [confidence]}], "standin": True},
+        }
+
+
+class LocalVisionService(_StandIn):
+    """Drop-in replacement for VisionService.detect_labels/adetect_labels (no request coalescing)."""
+
+    def detect_labels(self, image_bytes: bytes, max_results: int = 5) -> dict[str, Any]:
+        rng = random.Random(_image_seed(image_bytes))
+        with stage("vision_rpc"):
+            time.sleep(self._delay(rng))
+        return self._labels(rng, max_results)
+
+    async def adetect_labels(self, image_bytes: bytes, max_results: int = 5) -> dict[str, Any]:
+        rng = random.Random(_image_seed(image_bytes))
+        with stage("vision_rpc"):
+            await asyncio.sleep(self._delay(rng))
+        return self._labels(rng, max_results)
+
+    async def aclose(self) -> None:
+        pass
+
+    def _labels(self, rng: random.Random, max_results: int) -> dict[str, Any]:
+        if rng.random() < self.error_rate:
+            raise RuntimeError("Vision API error: stand-in failure")
+
+        names = CANNED_LABELS[rng.choice(CLASSES)][:max_results]
+        scores = sorted((rng.uniform(0.5, 0.99) for _ in names), reverse=True)
+        labels = [
+            {"label": name, "confidence": round(score, 4), "precision": score}
+            for name, score in zip(names, scores)
+        ]
+        return {
+            "top_labels": labels,
+            "raw": {
+                "label_annotations": [
+                    {"description": name, "score": round(score, 6), "topicality": round(score, 6)}
+                    for name, score in zip(names, scores)
+                ]
+            },
+        }
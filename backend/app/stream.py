@@ -0,0 +1,79 @@
+"""
+Helpers for the /ws/stream camera endpoint: a latest-frame-wins mailbox and
+per-connection counters.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any
+
+
+class LatestFrame:
+    """Single-slot mailbox: a new frame replaces one that has not been picked up yet."""
+
+    def __init__(self) -> None:
+        self._frame: Any = None
+        self._event = asyncio.Event()
+        self._closed = False
+
+    def put(self, frame: Any) -> bool:
+        """Store `frame`; returns True if it replaced an unprocessed (stale) one."""
+        replaced = self._frame is not None
+        self._frame = frame
+        self._event.set()
+        return replaced
+
+    async def get(self) -> Any:
+        """Wait for the newest frame; None once the mailbox is closed."""
+        while self._frame is None and not self._closed:
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return None if self._closed else frame
+
+    def close(self) -> None:
+        self._closed = True
+        self._event.set()
+
+
+class StreamStats:
+    """Frame, drop and latency counters for one stream connection."""
+
+    def __init__(self, window: int = 200) -> None:
+        self.started = time.monotonic()
+        self.received = 0
+        self.processed = 0
+        self.dropped_unchanged = 0
+        self.dropped_stale = 0
+        self.dropped_not_ready = 0
+        self.errors = 0
+        # Frame latency: arrival on the socket until its prediction is sent
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._latency_sum = 0.0
+
+    def observe(self, latency_ms: float) -> None:
+        self.processed += 1
+        self._latencies.append(latency_ms)
+        self._latency_sum += latency_ms
+
+    def snapshot(self) -> dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        recent = sorted(self._latencies)
+        return {
+            "frames_received": self.received,
+            "frames_processed": self.processed,
+            "dropped_unchanged": self.dropped_unchanged,
+            "dropped_stale": self.dropped_stale,
+            "dropped_not_ready": self.dropped_not_ready,
+            "errors": self.errors,
+            "fps_in": round(self.received / elapsed, 2),
+            "fps_out": round(self.processed / elapsed, 2),
+            "latency_ms": {
+                "last": round(self._latencies[-1], 1) if recent else None,
+                "mean": round(self._latency_sum / self.processed, 1) if self.processed else None,
+                "p50": round(recent[len(recent) // 2], 1) if recent else None,
+                "p95": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1) if recent else None,
+            },
+        }
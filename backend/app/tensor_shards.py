@@ -0,0 +1,283 @@
+"""
+Preprocessed, memory-mapped tensor shards of a split directory.
+
+Decoding every JPEG with PIL dominates dataset-wide CLIP passes (evaluation,
+kNN index builds, prompt experiments). build_shards.py decodes each image
+once into CLIP's resized and center-cropped pixels and stores them in a few
+.npy shard files that are memory-mapped on load.
+
+Layout of a store directory:
+  shard-00000.npy          uint8 (rows, 3, n_px, n_px), written by several worker processes
+  shard-00000.labels.npy   int16 class id per row
+  manifest.json            resolution, classes, shards, one entry per source file
+                           (class, sha256, size, mtime, shard and row) and the
+                           files that could not be decoded
+
+Pixels are kept as uint8 and normalized in the loader, which reproduces
+clip_transform exactly at a quarter of the float32 size. Updates are
+incremental: only new or changed files are decoded, into new shards, and a
+file whose content and class are already stored reuses that row. The
+manifest is replaced last, so an interrupted update leaves the previous
+store readable.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator
+
+import numpy as np
+from PIL import Image
+
+from .clip_remote import CLIP_MEAN, CLIP_STD, clip_pixels
+
+DEFAULT_SHARDS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache", "shards")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_split(split_dir: str) -> list[tuple[str, str]]:
+    """[(path relative to split_dir, class), ...] for split_dir/<class>/<image>."""
+    files = []
+    for cls in sorted(os.listdir(split_dir)):
+        class_dir = os.path.join(split_dir, cls)
+        if not os.path.isdir(class_dir) or cls.startswith("."):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                files.append((f"{cls}/{name}", cls))
+    return files
+
+
+def _write_rows(shard_path: str, start_row: int, paths: list[str], n_px: int) -> list[int]:
+    """Worker: decode images into rows start_row.. of an existing shard. Returns offsets that failed."""
+    shard = np.load(shard_path, mmap_mode="r+")
+    failed = []
+    for offset, path in enumerate(paths):
+        try:
+            with Image.open(path) as image:
+                shard[start_row + offset] = clip_pixels(image.convert("RGB"), n_px)
+        except (OSError, ValueError):
+            failed.append(offset)
+    shard.flush()
+    del shard
+    return failed
+
+
+class ShardStore:
+    """Builds and updates the shards of one split directory."""
+
+    def __init__(self, store_dir: str, resolution: int = 224) -> None:
+        self.store_dir = store_dir
+        self.manifest: dict[str, Any] = {
+            "version": MANIFEST_VERSION,
+            "root": None,
+            "resolution": resolution,
+            "classes": [],
+            "shards": [],
+            "items": {},
+            "failed": {},
+        }
+        if os.path.exists(self._path("manifest.json")):
+            with open(self._path("manifest.json")) as f:
+                self.manifest = json.load(f)
+            if self.manifest["resolution"] != resolution:
+                raise ValueError(
+                    f"Shards at {store_dir} are {self.manifest['resolution']}px, not {resolution}px; use --rebuild"
+                )
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def update(self, split_dir: str, workers: int | None = None, shard_rows: int = 2048,
+               chunk_size: int = 32) -> dict[str, int]:
+        """Bring the store in line with split_dir, decoding only new or changed files."""
+        split_dir = os.path.abspath(split_dir)
+        manifest = self.manifest
+        old_items: dict[str, dict] = manifest["items"]
+        old_failed: dict[str, dict] = manifest.get("failed", {})
+        # Rows already stored, by (content hash, class)
+        stored = {(item["sha256"], item["class"]): (item["shard"], item["row"]) for item in old_items.values()}
+
+        items: dict[str, dict] = {}
+        failed_items: dict[str, dict] = {}
+        pending: dict[tuple[str, str], list[str]] = {}
+        counts = {"unchanged": 0, "reused": 0, "decoded": 0, "failed": 0, "removed": 0}
+        for rel_path, cls in scan_split(split_dir):
+            st = os.stat(os.path.join(split_dir, rel_path))
+            old = old_items.get(rel_path)
+            if old and old["class"] == cls and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                items[rel_path] = old
+                counts["unchanged"] += 1
+                continue
+            bad = old_failed.get(rel_path)
+            if bad and bad["size"] == st.st_size and bad["mtime_ns"] == st.st_mtime_ns:
+                # Undecodable last time and not touched since
+                failed_items[rel_path] = bad
+                counts["failed"] += 1
+                continue
+            entry = {"class": cls, "sha256": file_sha256(os.path.join(split_dir, rel_path)),
+                     "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            key = (entry["sha256"], cls)
+            if key in stored:
+                entry["shard"], entry["row"] = stored[key]
+                counts["reused"] += 1
+            else:
+                pending.setdefault(key, []).append(rel_path)
+            items[rel_path] = entry
+        counts["removed"] = len(set(old_items) - set(items))
+
+        for cls in sorted({item["class"] for item in items.values()}):
+            if cls not in manifest["classes"]:
+                manifest["classes"].append(cls)
+
+        # One row per distinct (content, class); duplicates in the same update share it
+        unique = list(pending.items())
+        os.makedirs(self.store_dir, exist_ok=True)
+        n_px = manifest["resolution"]
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=ctx) as pool:
+            for start in range(0, len(unique), shard_rows):
+                group = unique[start:start + shard_rows]
+                shard_index = len(manifest["shards"])
+                name = f"shard-{shard_index:05d}"
+                shape = (len(group), 3, n_px, n_px)
+                np.lib.format.open_memmap(self._path(f"{name}.npy"), mode="w+", dtype=np.uint8, shape=shape).flush()
+                labels = np.array([manifest["classes"].index(cls) for (_, cls), _ in group], dtype=np.int16)
+                np.save(self._path(f"{name}.labels.npy"), labels)
+
+                futures = [
+                    (offset, pool.submit(
+                        _write_rows, self._path(f"{name}.npy"), offset,
+                        [os.path.join(split_dir, paths[0]) for _, paths in group[offset:offset + chunk_size]], n_px,
+                    ))
+                    for offset in range(0, len(group), chunk_size)
+                ]
+                failed = {offset + i for offset, future in futures for i in future.result()}
+                for row, (_, paths) in enumerate(group):
+                    for rel_path in paths:
+                        if row in failed:
+                            entry = items.pop(rel_path)
+                            failed_items[rel_path] = {"size": entry["size"], "mtime_ns": entry["mtime_ns"]}
+                            counts["failed"] += 1
+                        else:
+                            items[rel_path].update(shard=shard_index, row=row)
+                            counts["decoded"] += 1
+                manifest["shards"].append({"name": name, "rows": len(group)})
+
+        manifest["root"] = split_dir
+        manifest["items"] = dict(sorted(items.items()))
+        manifest["failed"] = dict(sorted(failed_items.items()))
+        tmp_path = self._path("manifest.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path("manifest.json"))
+        counts["stale_rows"] = self.stale_rows()
+        return counts
+
+    def stale_rows(self) -> int:
+        """Stored rows no file points to any more (changed or deleted sources); --rebuild drops them."""
+        live = {(item["shard"], item["row"]) for item in self.manifest["items"].values()}
+        return sum(shard["rows"] for shard in self.manifest["shards"]) - len(live)
+
+
+class ShardDataset:
+    """Read side of a ShardStore: memory-mapped shards yielding normalized CLIP input batches."""
+
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.resolution = self.manifest["resolution"]
+        self.classes: list[str] = self.manifest["classes"]
+        self.root: str = self.manifest["root"]
+        self.shards = [
+            np.load(os.path.join(store_dir, f"{shard['name']}.npy"), mmap_mode="r")
+            for shard in self.manifest["shards"]
+        ]
+        self.shard_labels = [
+            np.load(os.path.join(store_dir, f"{shard['name']}.labels.npy"))
+            for shard in self.manifest["shards"]
+        ]
+        # Files in storage order, so batches read each shard front to back
+        self.items = sorted(self.manifest["items"].items(), key=lambda kv: (kv[1]["shard"], kv[1]["row"]))
+        mean = np.array(CLIP_MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+        std = np.array(CLIP_STD, dtype=np.float32).reshape(1, 3, 1, 1)
+        self._scale = 1.0 / (255.0 * std)
+        self._offset = mean / std
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def paths(self) -> list[str]:
+        return [os.path.join(self.root, rel_path) for rel_path, _ in self.items]
+
+    def _load(self, items: list[tuple[str, dict]]) -> tuple[np.ndarray, np.ndarray, list[str]]:
+        n_px = self.resolution
+        batch = np.empty((len(items), 3, n_px, n_px), dtype=np.float32)
+        labels = np.empty(len(items), dtype=np.int64)
+        i = 0
+        while i < len(items):
+            # Copy each run of rows from the same shard with a single slice or gather
+            shard = items[i][1]["shard"]
+            j = i
+            while j < len(items) and items[j][1]["shard"] == shard:
+                j += 1
+            rows = np.array([item["row"] for _, item in items[i:j]])
+            # Strictly consecutive rows only: identical files share a row, and failed or stale rows leave gaps
+            contiguous = bool(np.all(np.diff(rows) == 1))
+            pixels = self.shards[shard][rows[0]:rows[-1] + 1] if contiguous else self.shards[shard][rows]
+            np.multiply(pixels, self._scale, out=batch[i:j])
+            batch[i:j] -= self._offset
+            labels[i:j] = self.shard_labels[shard][rows]
+            i = j
+        return batch, labels, [os.path.join(self.root, rel_path) for rel_path, _ in items]
+
+    def batches(self, batch_size: int = 64, prefetch: int = 2) -> Iterator[tuple[np.ndarray, np.ndarray, list[str]]]:
+        """Yield (float32 (B, 3, n_px, n_px) normalized images, class ids, source paths).
+
+        A background thread fills the next batches while the caller runs the
+        encoder; numpy releases the GIL for the copy and normalization.
+        """
+        ready: queue.Queue = queue.Queue(maxsize=max(prefetch, 1))
+        stop = threading.Event()
+
+        def fill() -> None:
+            try:
+                for start in range(0, len(self.items), batch_size):
+                    if stop.is_set():
+                        return
+                    ready.put(self._load(self.items[start:start + batch_size]))
+                ready.put(None)
+            except BaseException as e:
+                ready.put(e)
+
+        thread = threading.Thread(target=fill, name="shard-prefetch", daemon=True)
+        thread.start()
+        try:
+            while (batch := ready.get()) is not None:
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            # Unblock the filler if it is waiting on a full queue
+            while thread.is_alive():
+                try:
+                    ready.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.05)
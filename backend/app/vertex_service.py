@@ -1,43 +1,195 @@
+import asyncio
 import base64
+import datetime
 import os
 import json
 import re
+import threading
 from io import BytesIO
 from typing import Any
 
-import requests
+import httpx
 import time
+from .metrics import stage
 from .model_metadata import VERTEX_METRICS
 import google.auth
+import google.auth.credentials
 import google.auth.transport.requests
 from PIL import Image
 
+
+# Input bytes per base64 chunk; a multiple of 3 so chunks encode independently
+B64_CHUNK = 3 * 64 * 1024
+# Request body bytes handed to httpx at a time
+BODY_CHUNK = 256 * 1024
+
+
+def encode_instances(images: list[bytes]) -> bytearray:
+    """The :predict JSON body, with each image base64-encoded straight into one preallocated buffer.
+
+    Same document as json.dumps({"instances": [{"image_bytes": {"b64": ...}, "key": "1"}, ...]}),
+    without the full-size base64 bytes, decoded str and serialized copies in between.
+    """
+    prefix = b'{"image_bytes":{"b64":"'
+    suffixes = [b'"},"key":"%d"}' % (i + 1) for i in range(len(images))]
+    size = len(b'{"instances":[]}') + max(0, len(images) - 1)
+    for image, suffix in zip(images, suffixes):
+        size += len(prefix) + 4 * ((len(image) + 2) // 3) + len(suffix)
+
+    body = bytearray(size)
+    view = memoryview(body)
+    pos = 0
+
+    def put(data: bytes) -> None:
+        nonlocal pos
+        view[pos:pos + len(data)] = data
+        pos += len(data)
+
+    put(b'{"instances":[')
+    for i, (image, suffix) in enumerate(zip(images, suffixes)):
+        if i:
+            put(b",")
+        put(prefix)
+        source = memoryview(image)
+        for start in range(0, len(source), B64_CHUNK):
+            put(base64.b64encode(source[start:start + B64_CHUNK]))
+        put(suffix)
+    put(b"]}")
+    return body
+
+
+def _body_chunks(body: bytearray):
+    view = memoryview(body)
+    for start in range(0, len(view), BODY_CHUNK):
+        yield bytes(view[start:start + BODY_CHUNK])
+
+
+async def _abody_chunks(body: bytearray):
+    for chunk in _body_chunks(body):
+        yield chunk
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
 class VertexService:
-    """Wrapper for Vertex AI Endpoint prediction."""
+    """Wrapper for Vertex AI Endpoint prediction.
+
+    Requests go through persistent keep-alive connection pools (one sync, one
+    async) and the OAuth token is refreshed by a background thread ahead of
+    expiry, so the request path never pays for connection setup or token
+    refresh.
+    """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        pool_size: int | None = None,
+        timeout: float | None = None,
+        connect_timeout: float | None = None,
+        http2: bool | None = None,
+        token_refresh_margin: float | None = None,
+    ) -> None:
         self.project_number = os.getenv("VERTEX_PROJECT_NUMBER")
         self.location = os.getenv("LOCATION")
         self.endpoint_id = os.getenv("VERTEX_ENDPOINT_ID")
+        # VERTEX_URL points at another :predict URL (e.g. the fake from fake_google.py)
+        self.url = os.getenv("VERTEX_URL", "")
+        # VERTEX_ANONYMOUS=true sends no OAuth token (local fakes only)
+        self.anonymous = os.getenv("VERTEX_ANONYMOUS", "false").lower() == "true"
 
-        if not self.project_number or not self.location or not self.endpoint_id:
-            raise ValueError(
-                "Missing Vertex config. Set VERTEX_PROJECT_NUMBER, LOCATION, and VERTEX_ENDPOINT_ID."
-            )
+        if not self.url:
+            if not self.project_number or not self.location or not self.endpoint_id:
+                raise ValueError(
+                    "Missing Vertex config. Set VERTEX_PROJECT_NUMBER, LOCATION, and VERTEX_ENDPOINT_ID (or VERTEX_URL)."
+                )
+
+            # Build the dedicated prediction URL
+            self.base_dns = f"{self.endpoint_id}.{self.location}-{self.project_number}.prediction.vertexai.goog"
+            self.url = f"https://{self.base_dns}/v1/projects/{self.project_number}/locations/{self.location}/endpoints/{self.endpoint_id}:predict"
+
+        # Connection pool settings
+        pool_size = pool_size or int(os.getenv("VERTEX_POOL_SIZE", "10"))
+        timeout = timeout or float(os.getenv("VERTEX_TIMEOUT_S", "10"))
+        connect_timeout = connect_timeout or float(os.getenv("VERTEX_CONNECT_TIMEOUT_S", "3"))
+        if http2 is None:
+            http2 = os.getenv("VERTEX_HTTP2", "true").lower() == "true"
+        self._client_kwargs = {
+            "http2": http2 and _http2_available(),
+            "limits": httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+        }
+        self._client = httpx.Client(**self._client_kwargs)
+        self._async_client: httpx.AsyncClient | None = None
 
-        # Build the dedicated prediction URL
-        self.base_dns = f"{self.endpoint_id}.{self.location}-{self.project_number}.prediction.vertexai.goog"
-        self.url = f"https://{self.base_dns}/v1/projects/{self.project_number}/locations/{self.location}/endpoints/{self.endpoint_id}:predict"
-        
         # Initialize credentials
-        self.credentials, _ = google.auth.default(
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
+        if self.anonymous:
+            self.credentials = google.auth.credentials.AnonymousCredentials()
+        else:
+            self.credentials, _ = google.auth.default(
+                scopes=["https://www.googleapis.com/auth/cloud-platform"]
+            )
         self.auth_req = google.auth.transport.requests.Request()
+        self._token_lock = threading.Lock()
+        self._token_refresh_margin = token_refresh_margin or float(
+            os.getenv("VERTEX_TOKEN_REFRESH_MARGIN_S", "300")
+        )
+        self._stop = threading.Event()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, name="vertex-token-refresh", daemon=True
+        )
+        if not self.anonymous:
+            self._refresher.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._client.close()
+
+    async def aclose(self) -> None:
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+
+    def _refresh_token(self) -> None:
+        with self._token_lock, stage("token_refresh"):
+            self.credentials.refresh(self.auth_req)
+
+    def _seconds_until_refresh(self) -> float:
+        expiry = getattr(self.credentials, "expiry", None)
+        if not self.credentials.valid:
+            return 0.0
+        if expiry is None:
+            # Valid with no known expiry (some user and compute credentials): check back later
+            return 60.0
+        remaining = (expiry - datetime.datetime.utcnow()).total_seconds()
+        return max(0.0, remaining - self._token_refresh_margin)
+
+    def _refresh_loop(self) -> None:
+        """Keep the access token fresh so requests never refresh it inline."""
+        while not self._stop.is_set():
+            delay = self._seconds_until_refresh()
+            if delay > 0:
+                self._stop.wait(min(delay, 60.0))
+                continue
+            try:
+                self._refresh_token()
+            except Exception:
+                # Retry shortly; the request path still refreshes inline if the token lapses.
+                self._stop.wait(10.0)
 
     def _get_token(self) -> str:
         if not self.credentials.valid:
-            self.credentials.refresh(self.auth_req)
+            with self._token_lock:
+                if not self.credentials.valid:
+                    # Inline refresh: the background refresher fell behind (shows up in request latency)
+                    with stage("token_refresh"):
+                        self.credentials.refresh(self.auth_req)
         return self.credentials.token
 
     def _ensure_compatible_image(self, image_bytes: bytes) -> bytes:
@@ -54,37 +206,80 @@ class VertexService:
         except Exception:
             return image_bytes
 
-    def predict(self, image_bytes: bytes) -> dict[str, Any]:
-        image_bytes = self._ensure_compatible_image(image_bytes)
-        encoded = base64.b64encode(image_bytes).decode("utf-8")
-        
-        # AutoML Vision model requires image_bytes and a key
-        payload = {
-            "instances": [
-                {
-                    "image_bytes": {"b64": encoded},
-                    "key": "1"
-                }
-            ]
+    def _build_payload(self, images: list[bytes]) -> bytearray:
+        # AutoML Vision model requires image_bytes and a key per instance
+        with stage("base64_encode"):
+            return encode_instances([self._ensure_compatible_image(image) for image in images])
+
+    def _headers(self, token: str | None, body: bytearray) -> dict[str, str]:
+        headers = {
+            "Content-Type": "application/json",
+            # Explicit length: the body is streamed from the buffer without chunked encoding
+            "Content-Length": str(len(body)),
         }
-        
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+    def predict(self, image_bytes: bytes) -> dict[str, Any]:
+        return self.predict_batch([image_bytes])[0]
+
+    async def apredict(self, image_bytes: bytes) -> dict[str, Any]:
+        return (await self.apredict_batch([image_bytes]))[0]
+
+    def predict_batch(self, images: list[bytes]) -> list[dict[str, Any]]:
+        """Classify several images with a single request (one `instances` entry each)."""
+        payload = self._build_payload(images)
         try:
-            token = self._get_token()
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(self.url, json=payload, headers=headers)
+            headers = self._headers(self._get_token(), payload)
+            with stage("vertex_network"):
+                response = self._client.post(self.url, content=_body_chunks(payload), headers=headers)
             response.raise_for_status()
-            
-            result = response.json()
-            predictions = result.get("predictions", [])
-            parsed = self._parse_prediction(predictions)
-            parsed["raw"] = result
-            return parsed
+            return self._split_results(response.json(), len(images))
         except Exception as e:
-            return {"prediction": f"error: {e}", "confidence": 0.0, "time": 0.0, "raw": {}}
+            return [self._error_result(e) for _ in images]
+
+    async def apredict_batch(self, images: list[bytes]) -> list[dict[str, Any]]:
+        payload = await asyncio.to_thread(self._build_payload, images)
+        try:
+            token = (
+                self.credentials.token
+                if self.credentials.valid
+                else await asyncio.to_thread(self._get_token)
+            )
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(**self._client_kwargs)
+            with stage("vertex_network"):
+                response = await self._async_client.post(
+                    self.url, content=_abody_chunks(payload), headers=self._headers(token, payload)
+                )
+            response.raise_for_status()
+            return self._split_results(response.json(), len(images))
+        except Exception as e:
+            return [self._error_result(e) for _ in images]
+
+    @staticmethod
+    def _error_result(error: Exception) -> dict[str, Any]:
+        return {"prediction": f"error: {error}", "confidence": 0.0, "time": 0.0, "raw": {}}
+
+    def _split_results(self, result: dict[str, Any], count: int) -> list[dict[str, Any]]:
+        """Map each prediction back to its instance via the echoed key (falling back to order)."""
+        predictions = result.get("predictions", [])
+        by_key = {
+            str(p["key"]): p for p in predictions if isinstance(p, dict) and "key" in p
+        }
+        meta = {k: v for k, v in result.items() if k != "predictions"}
+
+        outputs = []
+        for i in range(count):
+            prediction = by_key.get(str(i + 1))
+            if prediction is None and len(by_key) < len(predictions) and i < len(predictions):
+                prediction = predictions[i]
+            instance_predictions = [prediction] if prediction is not None else []
+            parsed = self._parse_prediction(instance_predictions)
+            parsed["raw"] = {**meta, "predictions": instance_predictions}
+            outputs.append(parsed)
+        return outputs
 
     @staticmethod
     def _parse_prediction(predictions: list[Any]) -> dict[str, Any]:
@@ -1,82 +1,200 @@
 from __future__ import annotations
+import asyncio
+import contextvars
+import functools
 import time
 from .model_metadata import VISION_METRICS
+from .label_rules import default_rules
+from .consensus import SKIPPED
+from .resilience import BackendSkipped
 from typing import Any
 
 
 class VisionClipService:
-    """Separate Vision API + CLIP prediction (for comparison)."""
-
-    KEYWORDS = {
-        "metal": [
-            "metal", "tin", "steel", "aluminum", "aluminium", "foil", "cans", "drink can",
-            "steel and tin cans", "aluminium foil", "silver", "brass", "titanium",
-            "energy drink", "bangle", "badge", "emblem", "gold", "aerosol", "canister"
-        ],
-        "plastic": [
-            "plastic", "bottle", "container", "plastic bottle", "water bottle",
-            "plastic wrap", "food storage containers", "bottled water", "two-liter bottle",
-            "polyethylene", "pvc", "pet", "hdpe", "polypropylene"
-        ],
-        "cardboard": [
-            "cardboard", "paper product", "paper", "cardboard packaging", "shipping box",
-            "box", "packing materials", "construction paper", "corrugated board", "carton"
-        ]
-    }
-
-    def __init__(self, vision_service=None, clip_service=None):
+    """Separate Vision API + CLIP prediction (for comparison).
+
+    Vision labels are mapped to classes by the shared label rules
+    (app/label_rules.json); CLIP or kNN is the fallback when none match.
+    """
+
+    def __init__(self, vision_service=None, clip_service=None, knn_service=None, fallback: str = "clip", rules=None, vision_guard=None):
+        self.rules = rules or default_rules()
+        # Optional BackendGuard (deadline, hedging, circuit breaker) around Vision calls
+        self.vision_guard = vision_guard
         self.vision = vision_service
         self.clip = clip_service
+        self.knn = knn_service
+        # "clip" = zero-shot prompts, "knn" = nearest neighbours over the local embedding index
+        self.fallback = fallback if fallback == "knn" and knn_service else "clip"
 
-    def predict(self, image_bytes: bytes) -> dict[str, Any]:
+    def predict(self, image_bytes: bytes, clip_input=None) -> dict[str, Any]:
+        """Classify an image; `clip_input` is an already preprocessed CLIP tensor, if available."""
         start = time.perf_counter()
-        vision_data: dict[str, Any] = {"top_labels": [], "raw": {}}
+        vision_res = self.predict_vision(image_bytes)
+        local_res = None
+        if not self.is_match(vision_res):
+            local_res = self.predict_local(image_bytes, clip_input, vision_res)
+        result = self.combine(vision_res, local_res)
+        result["time"] = round(time.perf_counter() - start, 3)
+        return result
 
-        # Vision-first prediction
-        if self.vision:
-            try:
-                vision_data = self.vision.detect_labels(image_bytes)
-                for label in vision_data["top_labels"]:
-                    text = label["label"].lower()
-                    for cls, keywords in self.KEYWORDS.items():
-                        if any(k in text for k in keywords):
-                            return {
-                                "prediction": cls,
-                                "confidence": label["confidence"],
-                                "precision": VISION_METRICS.get(cls, 0.0),
-                                "time": round(time.perf_counter() - start, 3),
-                                "top_labels": vision_data["top_labels"],
-                                "raw": {
-                                    "vision_api": vision_data["raw"],
-                                    "clip_fallback": None
-                                },
-                            }
-            except Exception:
-                pass
+    def predict_batch(
+        self,
+        images: list[bytes],
+        clip_inputs: list | None = None,
+        vision_results: list[dict[str, Any]] | None = None,
+    ) -> list[dict[str, Any]]:
+        """predict() for many images, with one local forward pass for all images Vision could not map.
 
-        # CLIP fallback
-        if self.clip:
+        `vision_results` may be supplied when the Vision calls were already made elsewhere.
+        """
+        if vision_results is None:
+            vision_results = [self.predict_vision(image_bytes) for image_bytes in images]
+        pending = [i for i, vision_res in enumerate(vision_results) if not self.is_match(vision_res)]
+        local_results: dict[int, dict[str, Any] | None] = {}
+        fallback = self.local_model
+        if fallback and pending:
             try:
-                clip_res = self.clip.predict(image_bytes)
-                return {
-                    "prediction": clip_res["prediction"],
-                    "confidence": clip_res["confidence"],
-                    "precision": VISION_METRICS.get(clip_res["prediction"], 0.0),
-                    "time": round(time.perf_counter() - start, 3),
-                    "top_labels": vision_data.get("top_labels", []),
-                    "raw": {
-                        "vision_api": vision_data.get("raw", {}),
-                        "clip_fallback": clip_res.get("raw", {})
-                    },
-                }
+                inputs = [
+                    clip_inputs[i] if clip_inputs and clip_inputs[i] is not None
+                    else self.clip.preprocess_bytes(images[i])
+                    for i in pending
+                ]
+                for i, clip_res in zip(pending, fallback.predict_batch(inputs)):
+                    local_results[i] = self._local_result(clip_res, vision_results[i])
             except Exception:
                 pass
+        return [self.combine(vision_res, local_results.get(i)) for i, vision_res in enumerate(vision_results)]
 
-        return {
+    @staticmethod
+    def is_match(vision_res: dict[str, Any]) -> bool:
+        """True if Vision mapped the image to a class (no fallback needed)."""
+        return vision_res["prediction"] not in ("unknown", "disabled", SKIPPED)
+
+    @staticmethod
+    def combine(vision_res: dict[str, Any], local_res: dict[str, Any] | None) -> dict[str, Any]:
+        """Vision's class when it found one, else the local model's answer (or "disabled")."""
+        if VisionClipService.is_match(vision_res):
+            return vision_res
+        result = local_res or {
+            "prediction": "disabled",
+            "confidence": 0.0,
+            "precision": 0.0,
+            "top_labels": vision_res["top_labels"],
+            "raw": vision_res["raw"]["vision_api"],
+        }
+        if "skipped" in vision_res:
+            result["skipped"] = vision_res["skipped"]
+        return result
+
+    def predict_vision(self, image_bytes: bytes) -> dict[str, Any]:
+        """Vision labels mapped to a class; prediction is "unknown" when no rule matches
+        and "skipped" when the guard fast-failed or timed out the call."""
+        if not self.vision:
+            return self._vision_result()
+        try:
+            if self.vision_guard:
+                vision_data = self.vision_guard.call(self.vision.detect_labels, image_bytes)
+            else:
+                vision_data = self.vision.detect_labels(image_bytes)
+        except BackendSkipped as e:
+            return self._vision_result(skipped=e.reason)
+        except Exception:
+            return self._vision_result()
+        return self._vision_result(vision_data)
+
+    async def apredict_vision(self, image_bytes: bytes) -> dict[str, Any]:
+        """predict_vision on the event loop; concurrent calls share batched Vision RPCs."""
+        if not self.vision:
+            return self._vision_result()
+        try:
+            if self.vision_guard:
+                vision_data = await self.vision_guard.acall(self.vision.adetect_labels, image_bytes)
+            else:
+                vision_data = await self.vision.adetect_labels(image_bytes)
+        except BackendSkipped as e:
+            return self._vision_result(skipped=e.reason)
+        except Exception:
+            return self._vision_result()
+        return self._vision_result(vision_data)
+
+    async def apredict(self, image_bytes: bytes, clip_input=None, executor=None) -> dict[str, Any]:
+        """predict() with the Vision call on the event loop and only the local model on `executor`."""
+        start = time.perf_counter()
+        vision_res = await self.apredict_vision(image_bytes)
+        local_res = None
+        if not self.is_match(vision_res):
+            local_res = await asyncio.get_running_loop().run_in_executor(
+                executor,
+                functools.partial(contextvars.copy_context().run, self.predict_local, image_bytes, clip_input, vision_res),
+            )
+        result = self.combine(vision_res, local_res)
+        result["time"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _vision_result(self, vision_data: dict[str, Any] | None = None, skipped: str | None = None) -> dict[str, Any]:
+        result = {
             "prediction": "disabled",
             "confidence": 0.0,
             "precision": 0.0,
-            "time": round(time.perf_counter() - start, 3),
-            "top_labels": vision_data.get("top_labels", []),
-            "raw": vision_data.get("raw", {}),
+            "top_labels": [],
+            "raw": {"vision_api": {}, "clip_fallback": None},
         }
+        if skipped:
+            result["prediction"] = SKIPPED
+            result["skipped"] = {"vision": skipped}
+            return result
+        if vision_data is None:
+            return result
+        try:
+            match = self.rules.current().evaluate(vision_data["top_labels"])
+        except Exception:
+            return result
+
+        result["top_labels"] = vision_data["top_labels"]
+        result["raw"]["vision_api"] = vision_data["raw"]
+        if match.predicted_class:
+            cls = match.predicted_class
+            result.update(
+                prediction=cls,
+                confidence=match.matched_label["confidence"],
+                precision=VISION_METRICS.get(cls, 0.0),
+            )
+        else:
+            result["prediction"] = "unknown"
+        return result
+
+    def predict_local(self, image_bytes: bytes, clip_input=None, vision_res: dict[str, Any] | None = None) -> dict[str, Any] | None:
+        """CLIP fallback (zero-shot or kNN); None when no local model is available."""
+        fallback = self.local_model
+        if not fallback:
+            return None
+        try:
+            clip_res = (
+                fallback.predict_tensor(clip_input)
+                if clip_input is not None
+                else fallback.predict(image_bytes)
+            )
+        except Exception:
+            return None
+        return self._local_result(clip_res, vision_res)
+
+    def _local_result(self, clip_res: dict[str, Any], vision_res: dict[str, Any] | None) -> dict[str, Any]:
+        vision_res = vision_res or {}
+        skipped = vision_res.get("skipped")
+        return {
+            "prediction": clip_res["prediction"],
+            "confidence": clip_res["confidence"],
+            "precision": VISION_METRICS.get(clip_res["prediction"], 0.0),
+            "top_labels": vision_res.get("top_labels", []),
+            "raw": {
+                "vision_api": vision_res.get("raw", {}).get("vision_api", {}),
+                "clip_fallback": clip_res.get("raw", {}),
+                "fallback": self.fallback,
+            },
+            **({"skipped": skipped} if skipped else {}),
+        }
+
+    @property
+    def local_model(self):
+        return self.knn if self.fallback == "knn" else self.clip
@@ -1,23 +1,182 @@
 from __future__ import annotations
 
+import asyncio
+import os
+import time
 from typing import Any
 
 from google.cloud import vision
 
+from .metrics import REGISTRY, Histogram, stage
+from .resilience import SharedFailure
+
+REGISTRY.register(
+    "wasteml_vision_batch_images", "histogram", "Images per coalesced Vision batch_annotate_images RPC.",
+    buckets=[1, 2, 4, 8, 12, 16],
+)
+REGISTRY.register("wasteml_vision_rpcs_total", "counter", "Coalesced Vision RPCs by outcome (ok, error).")
+
 
 class VisionService:
-    """Wrapper for Google Cloud Vision label detection."""
+    """Wrapper for Google Cloud Vision label detection.
+
+    `detect_labels` makes one blocking RPC per image. `adetect_labels` runs
+    on the event loop instead: callers arriving within `max_wait_ms` of each
+    other are coalesced into one batch_annotate_images RPC of up to
+    `max_batch_size` images on the async client, and each caller gets its
+    own image's labels back.
+    """
+
+    def __init__(self, timeout: float | None = None, max_batch_size: int | None = None,
+                 max_wait_ms: float | None = None) -> None:
+        # VISION_API_ENDPOINT (host:port) points at another ImageAnnotator, e.g. the fake from
+        # fake_google.py; VISION_INSECURE=true uses a plaintext channel without credentials
+        self.endpoint = os.getenv("VISION_API_ENDPOINT")
+        self.insecure = bool(self.endpoint) and os.getenv("VISION_INSECURE", "false").lower() == "true"
+        if self.insecure:
+            import grpc
+            from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
 
-    def __init__(self) -> None:
-        self._client = vision.ImageAnnotatorClient()
+            transport = ImageAnnotatorGrpcTransport(channel=grpc.insecure_channel(self.endpoint))
+            self._client = vision.ImageAnnotatorClient(transport=transport)
+        elif self.endpoint:
+            self._client = vision.ImageAnnotatorClient(client_options={"api_endpoint": self.endpoint})
+        else:
+            self._client = vision.ImageAnnotatorClient()
+        # Per-call RPC timeout so an abandoned request does not hold its thread forever
+        self.timeout = timeout or float(os.getenv("VISION_TIMEOUT_S", "5"))
+
+        # The API accepts at most 16 images per synchronous batch request
+        self.max_batch_size = min(16, max(1, max_batch_size or int(os.getenv("VISION_BATCH_SIZE", "16"))))
+        wait_ms = max_wait_ms if max_wait_ms is not None else float(os.getenv("VISION_BATCH_WAIT_MS", "5"))
+        self.max_wait = max(0.0, wait_ms) / 1000.0
+        # The async client's channel belongs to the event loop it was created on
+        self._aclient: vision.ImageAnnotatorAsyncClient | None = None
+        self._aclient_loop: asyncio.AbstractEventLoop | None = None
+        self._pending: list[tuple[bytes, int, asyncio.Future, float]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Future] = set()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 12, 16])
+        self.wait_ms = Histogram([1, 2, 5, 10, 20, 50])
+        self.rpc_ms = Histogram([25, 50, 100, 250, 500, 1000, 2500, 5000])
+        self.counters = {"rpcs": 0, "images": 0, "rpc_errors": 0, "image_errors": 0, "abandoned": 0}
 
     def detect_labels(self, image_bytes: bytes, max_results: int = 5) -> dict[str, Any]:
         image = vision.Image(content=image_bytes)
-        response = self._client.label_detection(image=image, max_results=max_results)
+        with stage("vision_rpc"):
+            response = self._client.label_detection(image=image, max_results=max_results, timeout=self.timeout)
 
         if response.error.message:
             raise RuntimeError(f"Vision API error: {response.error.message}")
+        return self._labels(response)
+
+    async def adetect_labels(self, image_bytes: bytes, max_results: int = 5) -> dict[str, Any]:
+        """detect_labels on the event loop, sharing an RPC with concurrent callers."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image_bytes, max_results, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    async def aclose(self) -> None:
+        if self._flush_handle:
+            self._flush_handle.cancel()
+        if self._aclient is not None:
+            await self._aclient.transport.close()
+            self._aclient = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.counters,
+            "pending": len(self._pending),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batch_size": self.batch_sizes.snapshot(),
+            "wait_ms": self.wait_ms.snapshot(),
+            "rpc_ms": self.rpc_ms.snapshot(),
+        }
+
+    def _async_client(self) -> vision.ImageAnnotatorAsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            if self.insecure:
+                import grpc
+                from google.cloud.vision_v1.services.image_annotator.transports import (
+                    ImageAnnotatorGrpcAsyncIOTransport,
+                )
+
+                transport = ImageAnnotatorGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(self.endpoint))
+                self._aclient = vision.ImageAnnotatorAsyncClient(transport=transport)
+            elif self.endpoint:
+                self._aclient = vision.ImageAnnotatorAsyncClient(client_options={"api_endpoint": self.endpoint})
+            else:
+                self._aclient = vision.ImageAnnotatorAsyncClient()
+            self._aclient_loop = loop
+        return self._aclient
+
+    def _flush(self) -> None:
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # Callers that gave up while waiting (deadline, losing hedge) are left out of the RPC
+        batch = [item for item in self._pending if not item[2].done()]
+        self.counters["abandoned"] += len(self._pending) - len(batch)
+        self._pending = []
+        if batch:
+            task = asyncio.ensure_future(self._annotate(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _annotate(self, batch: list[tuple[bytes, int, asyncio.Future, float]]) -> None:
+        started = time.perf_counter()
+        for *_, enqueued in batch:
+            self.wait_ms.observe((started - enqueued) * 1000.0)
+        self.batch_sizes.observe(len(batch))
+        REGISTRY.observe("wasteml_vision_batch_images", len(batch))
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=image_bytes),
+                features=[vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=max_results)],
+            )
+            for image_bytes, max_results, _, _ in batch
+        ]
+        self.counters["rpcs"] += 1
+        self.counters["images"] += len(batch)
+        try:
+            with stage("vision_rpc"):
+                response = await self._async_client().batch_annotate_images(requests=requests, timeout=self.timeout)
+        except Exception as e:
+            self.counters["rpc_errors"] += 1
+            REGISTRY.inc("wasteml_vision_rpcs_total", outcome="error")
+            # One failed RPC is one breaker failure: the other callers get a SharedFailure
+            error: BaseException = e
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+                    error = SharedFailure(e)
+            return
+        finally:
+            self.rpc_ms.observe((time.perf_counter() - started) * 1000.0)
+
+        REGISTRY.inc("wasteml_vision_rpcs_total", outcome="ok")
+        for (_, _, future, _), item in zip(batch, response.responses):
+            if future.done():
+                continue
+            if item.error.message:
+                self.counters["image_errors"] += 1
+                future.set_exception(RuntimeError(f"Vision API error: {item.error.message}"))
+            else:
+                future.set_result(self._labels(item))
+        for _, _, future, _ in batch[len(response.responses):]:
+            if not future.done():
+                future.set_exception(RuntimeError("Vision API error: missing response for image"))
 
+    @staticmethod
+    def _labels(response) -> dict[str, Any]:
+        """top_labels/raw shape from one AnnotateImageResponse."""
         labels = [
             {
                 "label": annotation.description,
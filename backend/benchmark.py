@@ -0,0 +1,331 @@
+"""
+Benchmark and evaluation harness over a labeled split (split/<name>/<class>/*.jpg).
+
+Runs each backend over every image with bounded concurrency and reports
+throughput, latency percentiles, per-class precision/recall and a confusion
+matrix. Measured precision can be written to the metrics file that
+app/model_metadata.py loads at startup.
+
+Examples (run from backend/):
+    python benchmark.py --split ../split/test --backends clip vision_clip
+    python benchmark.py --backends predict --offline --concurrency 16
+    python benchmark.py --backends vertex vision_clip --write-metrics model_metrics.json
+
+--offline swaps Vertex and Vision for the in-process stand-ins in
+app/standins.py. Their predictions are synthetic, so their precision is
+never written to the metrics file.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_SPLIT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "split", "test")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+BACKENDS = ["clip", "vision_clip", "vertex", "predict"]
+
+# Backend name -> section of the metrics file read by model_metadata
+METRICS_SECTIONS = {"vertex": "vertex", "vision_clip": "vision", "clip": "clip", "predict": "consensus"}
+
+
+def load_split(split_dir: str, limit: int | None = None) -> tuple[list[str], list[tuple[str, str]]]:
+    """Return (classes, [(path, label), ...]) for a split directory."""
+    classes = sorted(
+        d for d in os.listdir(split_dir)
+        if os.path.isdir(os.path.join(split_dir, d)) and not d.startswith(".")
+    )
+    per_class = []
+    for cls in classes:
+        class_dir = os.path.join(split_dir, cls)
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        per_class.append([(os.path.join(class_dir, f), cls) for f in files])
+
+    # Interleave classes so a --limit run still covers all of them
+    samples = [s for group in itertools.zip_longest(*per_class) for s in group if s]
+    return classes, samples[:limit] if limit else samples
+
+
+def normalize_prediction(prediction: str) -> str:
+    """Collapse thresholded/error outputs into a single column each."""
+    prediction = str(prediction).strip().lower()
+    if prediction.startswith("error"):
+        return "error"
+    if prediction.startswith("ambiguous"):
+        return "ambiguous"
+    return prediction
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(records: list[tuple[str, str, float]], wall_seconds: float, classes: list[str]) -> dict[str, Any]:
+    """Aggregate (label, prediction, latency_ms) records into a metrics report."""
+    latencies = [r[2] for r in records]
+    predicted_labels = sorted({r[1] for r in records} - set(classes))
+    columns = classes + predicted_labels
+    confusion = {t: {p: 0 for p in columns} for t in classes}
+    for label, prediction, _ in records:
+        confusion[label][prediction] += 1
+
+    per_class = {}
+    for cls in classes:
+        tp = confusion[cls][cls]
+        predicted = sum(confusion[t][cls] for t in classes)
+        support = sum(confusion[cls].values())
+        per_class[cls] = {
+            "precision": round(tp / predicted, 4) if predicted else 0.0,
+            "recall": round(tp / support, 4) if support else 0.0,
+            "support": support,
+        }
+
+    correct = sum(1 for label, prediction, _ in records if label == prediction)
+    return {
+        "images": len(records),
+        "errors": sum(1 for r in records if r[1] == "error"),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_ips": round(len(records) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2) if latencies else 0.0,
+        },
+        "accuracy": round(correct / len(records), 4) if records else 0.0,
+        "precision": {cls: m["precision"] for cls, m in per_class.items()},
+        "recall": {cls: m["recall"] for cls, m in per_class.items()},
+        "per_class": per_class,
+        "confusion": confusion,
+    }
+
+
+async def run_backend(
+    samples: list[tuple[str, str]],
+    predict: Callable[[bytes], Awaitable[str]],
+    concurrency: int,
+) -> tuple[list[tuple[str, str, float]], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    records: list[tuple[str, str, float]] = []
+
+    async def one(path: str, label: str) -> None:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                prediction = await predict(image_bytes)
+            except Exception as e:
+                prediction = f"error: {e}"
+            latency = (time.perf_counter() - start) * 1000.0
+        records.append((label, normalize_prediction(prediction), latency))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(path, label) for path, label in samples))
+    return records, time.perf_counter() - start
+
+
+class Backends:
+    """Lazily constructs the requested backends as async predict(bytes) -> label callables."""
+
+    def __init__(self, args, classes: list[str], executor: ThreadPoolExecutor) -> None:
+        self.args = args
+        self.classes = classes
+        self.executor = executor
+        self._clip = None
+        self._client = None
+
+    def _in_thread(self, fn: Callable[[bytes], str]) -> Callable[[bytes], Awaitable[str]]:
+        async def call(image_bytes: bytes) -> str:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, image_bytes)
+        return call
+
+    def _clip_service(self):
+        if self._clip is None:
+            from app.clip_service import ClipService
+            from app.clip_batcher import ClipBatcher
+
+            service = ClipService(classes=self.classes)
+            if self.args.clip_batch > 1:
+                service = ClipBatcher(service, self.args.clip_batch, self.args.clip_wait_ms)
+            self._clip = service
+        return self._clip
+
+    def _vision_service(self):
+        if self.args.offline:
+            from app.standins import LocalVisionService
+            return LocalVisionService()
+        from app.vision_service import VisionService
+        return VisionService()
+
+    def _vertex_service(self):
+        if self.args.offline:
+            from app.standins import LocalVertexService
+            return LocalVertexService()
+        from app.vertex_service import VertexService
+        return VertexService()
+
+    def get(self, name: str) -> Callable[[bytes], Awaitable[str]]:
+        if name == "clip":
+            service = self._clip_service()
+            return self._in_thread(lambda b: service.predict(b)["prediction"])
+
+        if name == "vision_clip":
+            from app.vision_clip_service import VisionClipService
+
+            service = VisionClipService(self._vision_service(), self._clip_service())
+
+            async def call(image_bytes: bytes) -> str:
+                # Vision runs on the event loop (coalesced RPCs); only the CLIP fallback uses a thread
+                return (await service.apredict(image_bytes, None, self.executor))["prediction"]
+            return call
+
+        if name == "vertex":
+            service = self._vertex_service()
+
+            async def call(image_bytes: bytes) -> str:
+                return (await service.apredict(image_bytes))["prediction"]
+            return call
+
+        if name == "predict":
+            return self._in_thread(self._post_predict)
+
+        raise ValueError(f"Unknown backend: {name}")
+
+    def _post_predict(self, image_bytes: bytes) -> str:
+        if self._client is None:
+            raise RuntimeError("predict backend not started")
+        response = self._client.post(
+            "/predict", files={"file": ("image.jpg", image_bytes, "image/jpeg")}
+        )
+        if response.status_code != 200:
+            return f"error: HTTP {response.status_code}"
+        return response.json()["consensus"]["recommendation"]
+
+    def start_app(self) -> None:
+        """Start the real FastAPI app (lifespan included) in-process, with caching off."""
+        if self._client is not None:
+            return
+        os.environ["ENABLE_CACHE"] = "false"
+        os.environ["BACKGROUND_LOADING"] = "false"
+        if self.args.offline:
+            os.environ["OFFLINE_STANDINS"] = "true"
+        from fastapi.testclient import TestClient
+        import main
+
+        self._client = TestClient(main.app)
+        self._client.__enter__()
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.__exit__(None, None, None)
+        if hasattr(self._clip, "close"):
+            self._clip.close()
+
+
+def write_metrics(path: str, results: dict[str, dict], split_dir: str, offline: bool) -> None:
+    data: dict[str, Any] = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+
+    for backend, summary in results.items():
+        if offline and backend in ("vertex", "vision_clip", "predict"):
+            print(f"  skipping '{backend}' in metrics file: offline stand-in results are synthetic")
+            continue
+        data[METRICS_SECTIONS[backend]] = {
+            "precision": summary["precision"],
+            "recall": summary["recall"],
+            "accuracy": summary["accuracy"],
+            "images": summary["images"],
+            "split": os.path.normpath(split_dir),
+            "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"Metrics written to {path}")
+
+
+def print_summary(name: str, summary: dict[str, Any]) -> None:
+    lat = summary["latency_ms"]
+    print(f"\n== {name} ==")
+    print(
+        f"  {summary['images']} images, {summary['errors']} errors, "
+        f"{summary['throughput_ips']} img/s, accuracy {summary['accuracy']:.3f}"
+    )
+    print(f"  latency ms: p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    for cls, m in summary["per_class"].items():
+        print(f"  {cls:<12} precision {m['precision']:.3f}  recall {m['recall']:.3f}  n={m['support']}")
+    columns = list(next(iter(summary["confusion"].values())).keys())
+    print("  confusion (rows=true, cols=predicted): " + " ".join(f"{c[:10]:>10}" for c in columns))
+    for label, row in summary["confusion"].items():
+        print(f"  {label:<39}" + " ".join(f"{row[c]:>10}" for c in columns))
+
+
+async def main_async(args) -> dict[str, Any]:
+    classes, samples = load_split(args.split, args.limit)
+    if not samples:
+        sys.exit(f"No images found under {args.split}")
+    print(f"{len(samples)} images from {args.split} ({', '.join(classes)}), concurrency {args.concurrency}")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        backends = Backends(args, classes, executor)
+        try:
+            for name in args.backends:
+                if name == "predict":
+                    backends.start_app()
+                predict = backends.get(name)
+                if args.warmup:
+                    await run_backend(samples[: args.warmup], predict, args.concurrency)
+                records, wall = await run_backend(samples, predict, args.concurrency)
+                results[name] = summarize(records, wall, classes)
+                print_summary(name, results[name])
+        finally:
+            backends.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark WasteML backends over a dataset split.")
+    parser.add_argument("--split", default=DEFAULT_SPLIT, help="split directory with one folder per class")
+    parser.add_argument("--backends", nargs="+", default=["clip", "vision_clip", "vertex", "predict"], choices=BACKENDS)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N images")
+    parser.add_argument("--warmup", type=int, default=4, help="untimed warm-up requests per backend")
+    parser.add_argument("--offline", action="store_true", help="use local stand-ins for Vertex and Vision")
+    parser.add_argument("--clip-batch", type=int, default=1, help="CLIP micro-batch size (1 = no batching)")
+    parser.add_argument("--clip-wait-ms", type=float, default=5.0)
+    parser.add_argument("--report", help="write the full JSON report to this path")
+    parser.add_argument("--write-metrics", metavar="PATH", help="merge measured precision into a model metrics file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"split": args.split, "offline": args.offline, "results": results}, f, indent=2)
+        print(f"\nReport written to {args.report}")
+    if args.write_metrics:
+        write_metrics(args.write_metrics, results, args.split, args.offline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Build or incrementally extend the local CLIP kNN index used by VISION_FALLBACK=knn.
+
+Only images that are not indexed yet are embedded, so re-running after new
+files land in split/buffer appends them without rebuilding. With --shards the
+images come from build_shards.py stores instead of being decoded again.
+
+Examples (run from backend/):
+    python build_knn_index.py ../split/train
+    python build_knn_index.py ../split/train ../split/buffer --index-dir cache/knn
+    python build_knn_index.py ../split/train --rebuild
+    python build_knn_index.py --shards cache/shards/train cache/shards/buffer
+"""
+import argparse
+import os
+import shutil
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.clip_service import ClipService
+from app.knn_service import DEFAULT_INDEX_DIR, KnnService
+from app.tensor_shards import ShardDataset
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Embed split folders into the local kNN index.")
+    parser.add_argument("splits", nargs="*", help="directories laid out as <split>/<class>/<image>")
+    parser.add_argument("--shards", nargs="+", default=[], help="tensor shard stores from build_shards.py")
+    parser.add_argument("--index-dir", default=os.getenv("KNN_INDEX_DIR", DEFAULT_INDEX_DIR))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--rebuild", action="store_true", help="delete the existing index first")
+    args = parser.parse_args()
+    if not args.splits and not args.shards:
+        parser.error("give split directories and/or --shards stores")
+
+    if args.rebuild and os.path.isdir(args.index_dir):
+        shutil.rmtree(args.index_dir)
+
+    knn = KnnService(ClipService(classes=["metal", "cardboard", "plastic"]), index_dir=args.index_dir)
+    for split_dir in args.splits:
+        start = time.perf_counter()
+        added = knn.sync_directory(split_dir, batch_size=args.batch_size)
+        print(f"{split_dir}: added {added} images in {time.perf_counter() - start:.1f}s")
+    for store_dir in args.shards:
+        start = time.perf_counter()
+        added = knn.sync_shards(ShardDataset(store_dir), batch_size=args.batch_size)
+        print(f"{store_dir}: added {added} images in {time.perf_counter() - start:.1f}s")
+    print(f"Index at {args.index_dir}: {len(knn.index)} embeddings, classes {knn.index.classes}")
+
+
+if __name__ == "__main__":
+    main()
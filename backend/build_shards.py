@@ -0,0 +1,91 @@
+"""
+Build or incrementally update preprocessed tensor shards of split folders
+(see app/tensor_shards.py), so CLIP passes over a whole split skip JPEG decoding.
+
+Each split gets its own store, <out-dir>/<split name>. Re-running decodes only
+files that were added or changed since the last run.
+
+--eval then runs CLIP zero-shot over the stores (honouring CLIP_MODEL,
+CLIP_ENCODER_PATH and CLIP_PROMPT_TEMPLATES) and prints accuracy and
+throughput, which is the quick loop for trying a new prompt set.
+
+Examples (run from backend/):
+    python build_shards.py ../split/train ../split/test
+    python build_shards.py ../split/buffer --workers 8 --shard-rows 4096
+    python build_shards.py ../split/test --eval --batch-size 128
+    python build_shards.py ../split/train --rebuild
+"""
+import argparse
+import os
+import shutil
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.tensor_shards import DEFAULT_SHARDS_DIR, ShardDataset, ShardStore
+
+
+def evaluate(store_dirs: list[str], batch_size: int) -> None:
+    import torch
+
+    from app.clip_service import ClipService
+
+    for store_dir in store_dirs:
+        dataset = ShardDataset(store_dir)
+        clip = ClipService(classes=dataset.classes)
+        if clip.input_resolution != dataset.resolution:
+            raise SystemExit(
+                f"{store_dir} holds {dataset.resolution}px inputs but {clip.model_name} expects "
+                f"{clip.input_resolution}px; rebuild with --resolution {clip.input_resolution}"
+            )
+        correct = {cls: [0, 0] for cls in dataset.classes}
+        start = time.perf_counter()
+        for images, class_ids, _ in dataset.batches(batch_size):
+            with torch.no_grad():
+                sims = clip.encode_batch(images).to(clip.text_features.dtype) @ clip.text_features.T
+            # The text bank is in dataset.classes order, so argmax is a class id
+            for predicted, actual in zip(sims.argmax(dim=-1).tolist(), class_ids.tolist()):
+                correct[dataset.classes[actual]][0] += predicted == actual
+                correct[dataset.classes[actual]][1] += 1
+        elapsed = time.perf_counter() - start
+        total = sum(n for _, n in correct.values())
+        hits = sum(h for h, _ in correct.values())
+        print(f"{store_dir}: accuracy {hits / max(total, 1):.4f} over {total} images, "
+              f"{total / elapsed:.1f} images/s ({clip.model_name}, templates {clip.prompt_templates})")
+        for cls, (h, n) in correct.items():
+            print(f"  {cls:<12} {h / max(n, 1):.4f}  ({h}/{n})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Preprocess split folders into memory-mapped tensor shards.")
+    parser.add_argument("splits", nargs="+", help="directories laid out as <split>/<class>/<image>")
+    parser.add_argument("--out-dir", default=os.getenv("SHARDS_DIR", DEFAULT_SHARDS_DIR))
+    parser.add_argument("--resolution", type=int, default=224, help="CLIP input size (336 for ViT-L/14@336px)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="decoding processes")
+    parser.add_argument("--shard-rows", type=int, default=2048, help="images per shard file")
+    parser.add_argument("--rebuild", action="store_true", help="delete the existing stores first")
+    parser.add_argument("--eval", action="store_true", help="run CLIP zero-shot over the stores afterwards")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    store_dirs = []
+    for split_dir in args.splits:
+        store_dir = os.path.join(args.out_dir, os.path.basename(os.path.normpath(split_dir)))
+        if args.rebuild and os.path.isdir(store_dir):
+            shutil.rmtree(store_dir)
+        start = time.perf_counter()
+        counts = ShardStore(store_dir, resolution=args.resolution).update(
+            split_dir, workers=args.workers, shard_rows=args.shard_rows
+        )
+        summary = ", ".join(f"{k} {v}" for k, v in counts.items())
+        print(f"{split_dir} -> {store_dir}: {summary} in {time.perf_counter() - start:.1f}s")
+        store_dirs.append(store_dir)
+
+    if args.eval:
+        evaluate(store_dirs, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
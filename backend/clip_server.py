@@ -0,0 +1,47 @@
+"""
+Shared CLIP inference process for multi-worker deployments.
+
+Loads CLIP once with a fixed torch thread budget and serves every uvicorn
+worker over a Unix socket (tensors are passed through shared memory, see
+app/clip_remote.py). Start it before the API and point the workers at it:
+
+Examples (run from backend/):
+    python clip_server.py --threads 4 &
+    CLIP_SERVER_SOCKET=/tmp/wasteml-clip.sock uvicorn main:app --workers 4 --port 8000
+"""
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import torch
+
+from app.clip_remote import DEFAULT_SOCKET_PATH, ClipInferenceServer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve one CLIP model to all API workers.")
+    parser.add_argument("--socket", default=os.getenv("CLIP_SERVER_SOCKET") or DEFAULT_SOCKET_PATH)
+    parser.add_argument("--threads", type=int, default=int(os.getenv("CLIP_SERVER_THREADS", str(os.cpu_count() or 1))),
+                        help="torch intra-op threads for the whole server")
+    parser.add_argument("--max-batch", type=int, default=int(os.getenv("CLIP_MAX_BATCH_SIZE", "8")))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.getenv("CLIP_MAX_WAIT_MS", "5")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Pin the thread budget before any model code runs
+    torch.set_num_threads(args.threads)
+    torch.set_num_interop_threads(1)
+
+    from app.clip_service import ClipService
+
+    clip_service = ClipService(classes=["metal", "cardboard", "plastic"])
+    clip_service.warmup()
+    ClipInferenceServer(clip_service, args.socket, max(1, args.max_batch), args.max_wait_ms).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Export the CLIP image encoder to an optimized CPU artifact and compare it with fp32.
+
+The artifact is TorchScript (default) or ONNX, with int8 dynamic quantization of
+the Linear layers. A `<artifact>.json` sidecar records the model name and input
+resolution, and the class text bank is cached as a side effect, so ClipService
+can run from the artifact alone (CLIP_ENCODER_PATH=<artifact>).
+
+Examples (run from backend/):
+    python export_clip.py --output cache/clip/vit-b-32-int8.pt
+    python export_clip.py --output cache/clip/vit-b-32-int8.onnx --format onnx
+    python export_clip.py --output cache/clip/vit-b-32-int8.pt --compare ../split/test --limit 200
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import torch
+
+from app.clip_service import DEFAULT_MODEL_NAME, ClipService
+
+CLASSES = ["metal", "cardboard", "plastic"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+class ImageEncoder(torch.nn.Module):
+    """CLIP visual tower only; ClipService normalizes the output."""
+
+    def __init__(self, visual: torch.nn.Module) -> None:
+        super().__init__()
+        self.visual = visual
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        return self.visual(images)
+
+
+def export(model_name: str, output: str, fmt: str, quantize: bool) -> dict:
+    # Loading through ClipService also caches the text bank the artifact mode needs; the
+    # full model is needed here even if CLIP_ENCODER_PATH points at an earlier artifact
+    service = ClipService(classes=CLASSES, model_name=model_name, encoder_path="")
+    visual = service.model.visual.float().cpu().eval()
+    resolution = visual.input_resolution
+    encoder = ImageEncoder(visual).eval()
+    example = torch.randn(1, 3, resolution, resolution)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    with torch.no_grad():
+        if fmt == "torchscript":
+            if quantize:
+                encoder = torch.ao.quantization.quantize_dynamic(
+                    encoder, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            traced = torch.jit.trace(encoder, example)
+            torch.jit.save(traced, output)
+            dim = traced(example).shape[-1]
+        else:
+            fp32_path = output if not quantize else f"{output}.fp32.onnx"
+            torch.onnx.export(
+                encoder, example, fp32_path,
+                input_names=["images"], output_names=["features"],
+                dynamic_axes={"images": {0: "batch"}, "features": {0: "batch"}},
+                opset_version=17,
+            )
+            if quantize:
+                try:
+                    from onnxruntime.quantization import QuantType, quantize_dynamic
+                except ImportError as e:
+                    raise SystemExit("--format onnx needs onnxruntime (pip install onnxruntime)") from e
+
+                quantize_dynamic(fp32_path, output, weight_type=QuantType.QInt8)
+                os.remove(fp32_path)
+            dim = encoder(example).shape[-1]
+
+    meta = {
+        "model": service.model_name,
+        "input_resolution": int(resolution),
+        "logit_scale": float(service.logit_scale),
+        "dim": int(dim),
+        "format": fmt,
+        "quantized": quantize,
+        "size_mb": round(os.path.getsize(output) / 1e6, 1),
+    }
+    with open(f"{output}.json", "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _measure(encoder_path: str, model_name: str, paths: list[str], threads: int, out: mp.Queue) -> None:
+    """Runs in a fresh process so resident memory reflects one model only."""
+    torch.set_num_threads(threads)
+    base_rss = _rss_mb()
+    start = time.perf_counter()
+    service = ClipService(classes=CLASSES, model_name=model_name, encoder_path=encoder_path)
+    load_seconds = time.perf_counter() - start
+
+    inputs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            inputs.append(service.preprocess_bytes(f.read()))
+    for tensor in inputs[:3]:
+        service.predict_tensor(tensor)
+
+    latencies, predictions = [], []
+    for tensor in inputs:
+        start = time.perf_counter()
+        predictions.append(service.predict_tensor(tensor)["prediction"])
+        latencies.append((time.perf_counter() - start) * 1000.0)
+
+    out.put({
+        "load_seconds": round(load_seconds, 2),
+        "rss_mb": round(_rss_mb() - base_rss, 1),
+        "latency_ms_mean": round(statistics.mean(latencies), 2),
+        "latency_ms_p50": round(statistics.median(latencies), 2),
+        "predictions": predictions,
+    })
+
+
+def compare(artifact: str, model_name: str, split_dir: str, limit: int, threads: int) -> dict:
+    paths, labels = [], []
+    for cls in sorted(os.listdir(split_dir)):
+        class_dir = os.path.join(split_dir, cls)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_dir, name))
+                labels.append(cls)
+    step = max(1, len(paths) // limit) if limit else 1
+    paths, labels = paths[::step][:limit or None], labels[::step][:limit or None]
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    # "" rather than None, so the fp32 baseline ignores CLIP_ENCODER_PATH
+    for name, encoder_path in (("fp32", ""), ("artifact", artifact)):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_measure, args=(encoder_path, model_name, paths, threads, queue))
+        proc.start()
+        results[name] = queue.get()
+        proc.join()
+
+    fp32, art = results["fp32"]["predictions"], results["artifact"]["predictions"]
+    report = {"images": len(paths), "threads": threads}
+    for name, result in results.items():
+        preds = result.pop("predictions")
+        result["accuracy"] = round(sum(p == l for p, l in zip(preds, labels)) / len(labels), 4)
+        report[name] = result
+    report["top1_agreement"] = round(sum(a == b for a, b in zip(fp32, art)) / len(paths), 4)
+    report["speedup"] = round(results["fp32"]["latency_ms_mean"] / results["artifact"]["latency_ms_mean"], 2)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export a quantized CLIP image encoder for CPU inference.")
+    parser.add_argument("--model", default=os.getenv("CLIP_MODEL", DEFAULT_MODEL_NAME))
+    parser.add_argument("--output", default="cache/clip/image_encoder_int8.pt")
+    parser.add_argument("--format", choices=["torchscript", "onnx"], default="torchscript")
+    parser.add_argument("--no-quantize", action="store_true", help="export fp32 weights")
+    parser.add_argument("--skip-export", action="store_true", help="only run --compare on an existing artifact")
+    parser.add_argument("--compare", metavar="SPLIT_DIR", help="compare latency/memory/agreement with fp32")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        meta = export(args.model, args.output, args.format, not args.no_quantize)
+        print(f"Exported {args.output}: {json.dumps(meta)}")
+    if args.compare:
+        print(json.dumps(compare(args.output, args.model, args.compare, args.limit, args.threads), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Local fakes of the Vertex AI prediction endpoint (HTTP) and the Cloud Vision
+ImageAnnotator service (gRPC), for load tests without paid Google calls.
+
+Both answer deterministically per image (canned labels from app/standins.py
+or --labels) after a configurable latency, and fail or stall at configurable
+rates.
+
+Point the backend at them with:
+
+    VERTEX_URL=http://127.0.0.1:8091/v1/fake:predict VERTEX_ANONYMOUS=true
+    VISION_API_ENDPOINT=127.0.0.1:8092 VISION_INSECURE=true
+
+Examples (run from backend/):
+    python fake_google.py
+    python fake_google.py --vertex-latency-ms 150 --distribution lognormal --error-rate 0.02
+    python fake_google.py --stall-rate 0.01 --stall-ms 3000   # exercise deadlines and hedging
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import math
+import random
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import uvicorn
+from google.cloud.vision_v1 import types as vision_types
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.standins import CANNED_LABELS, _image_seed
+
+logger = logging.getLogger("fake_google")
+
+
+class LatencyModel:
+    """Per-call latency (seconds) and failure draws."""
+
+    def __init__(self, median_ms: float, jitter_ms: float, distribution: str, error_rate: float,
+                 stall_rate: float, stall_ms: float) -> None:
+        self.median_ms = median_ms
+        self.jitter_ms = jitter_ms
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.calls = 0
+        self.errors = 0
+        self.stalls = 0
+        self._lock = threading.Lock()
+
+    def draw(self) -> tuple[float, bool]:
+        """(delay in seconds, fail?) for one call."""
+        if self.distribution == "fixed":
+            delay_ms = self.median_ms
+        elif self.distribution == "lognormal":
+            # median_ms is the median; jitter_ms / median_ms sets the tail (sigma)
+            sigma = self.jitter_ms / max(self.median_ms, 1e-6)
+            delay_ms = random.lognormvariate(math.log(max(self.median_ms, 1e-6)), sigma)
+        else:
+            delay_ms = max(0.0, random.gauss(self.median_ms, self.jitter_ms))
+        stalled = random.random() < self.stall_rate
+        if stalled:
+            delay_ms += self.stall_ms
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+            self.stalls += stalled
+        return delay_ms / 1000.0, failed
+
+    def stats(self) -> dict[str, int]:
+        return {"calls": self.calls, "errors": self.errors, "stalls": self.stalls}
+
+
+def vertex_prediction(image_bytes: bytes, key: str, classes: list[str]) -> dict:
+    """AutoML-style prediction: base64-encoded labels with one score each."""
+    rng = random.Random(_image_seed(image_bytes))
+    best = rng.choice(classes)
+    top = rng.uniform(0.4, 0.99)
+    rest = [c for c in classes if c != best]
+    scores = {best: top, **{c: (1 - top) / len(rest) for c in rest}}
+    return {
+        "key": key,
+        "labels": [base64.b64encode(c.encode()).decode() for c in scores],
+        "scores": [round(s, 4) for s in scores.values()],
+    }
+
+
+def vertex_app(model: LatencyModel, classes: list[str]) -> Starlette:
+    async def predict(request: Request) -> JSONResponse:
+        delay, failed = model.draw()
+        try:
+            body = json.loads(await request.body())
+        except ClientDisconnect:  # the caller gave up (deadline or losing hedge)
+            return JSONResponse({}, status_code=499)
+        await asyncio.sleep(delay)
+        if failed:
+            return JSONResponse({"error": {"code": 503, "message": "fake Vertex failure"}}, status_code=503)
+        predictions = [
+            vertex_prediction(
+                base64.b64decode(instance["image_bytes"]["b64"]), instance.get("key", str(i + 1)), classes
+            )
+            for i, instance in enumerate(body.get("instances", []))
+        ]
+        return JSONResponse({"predictions": predictions, "deployedModelId": "fake"})
+
+    async def stats(request: Request) -> JSONResponse:
+        return JSONResponse(model.stats())
+
+    return Starlette(routes=[
+        Route("/stats", stats),
+        Route("/{path:path}", predict, methods=["POST"]),
+    ])
+
+
+def vision_labels(image_bytes: bytes, max_results: int, labels: dict[str, list[str]]) -> list:
+    rng = random.Random(_image_seed(image_bytes))
+    names = labels[rng.choice(sorted(labels))][:max_results or 5]
+    scores = sorted((rng.uniform(0.5, 0.99) for _ in names), reverse=True)
+    return [
+        vision_types.EntityAnnotation(description=name, score=score, topicality=score)
+        for name, score in zip(names, scores)
+    ]
+
+
+def vision_handler(model: LatencyModel, labels: dict[str, list[str]]) -> grpc.GenericRpcHandler:
+    """ImageAnnotator.BatchAnnotateImages (what label_detection calls), label detection only."""
+
+    def batch_annotate(request, context):
+        delay, failed = model.draw()
+        time.sleep(delay)
+        if failed:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "fake Vision failure")
+        responses = []
+        for item in request.requests:
+            max_results = next((f.max_results for f in item.features), 5)
+            responses.append(vision_types.AnnotateImageResponse(
+                label_annotations=vision_labels(item.image.content, max_results, labels)
+            ))
+        return vision_types.BatchAnnotateImagesResponse(responses=responses)
+
+    return grpc.method_handlers_generic_handler("google.cloud.vision.v1.ImageAnnotator", {
+        "BatchAnnotateImages": grpc.unary_unary_rpc_method_handler(
+            batch_annotate,
+            request_deserializer=vision_types.BatchAnnotateImagesRequest.deserialize,
+            response_serializer=vision_types.BatchAnnotateImagesResponse.serialize,
+        ),
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve fake Vertex (HTTP) and Vision (gRPC) backends.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--vertex-port", type=int, default=8091)
+    parser.add_argument("--vision-port", type=int, default=8092)
+    parser.add_argument("--vertex-latency-ms", type=float, default=120.0, help="median Vertex latency")
+    parser.add_argument("--vision-latency-ms", type=float, default=80.0, help="median Vision latency")
+    parser.add_argument("--jitter-ms", type=float, default=30.0,
+                        help="std-dev for normal, tail width for lognormal")
+    parser.add_argument("--distribution", choices=["normal", "lognormal", "fixed"], default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of calls delayed by --stall-ms")
+    parser.add_argument("--stall-ms", type=float, default=2000.0)
+    parser.add_argument("--labels", help="JSON file {class: [Vision label, ...]} (default: app/standins.py)")
+    parser.add_argument("--vision-threads", type=int, default=64)
+    args = parser.parse_args()
+
+    labels = CANNED_LABELS
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+
+    logging.basicConfig(level=logging.INFO)
+    common = dict(jitter_ms=args.jitter_ms, distribution=args.distribution, error_rate=args.error_rate,
+                  stall_rate=args.stall_rate, stall_ms=args.stall_ms)
+    vertex_model = LatencyModel(args.vertex_latency_ms, **common)
+    vision_model = LatencyModel(args.vision_latency_ms, **common)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=args.vision_threads))
+    server.add_generic_rpc_handlers((vision_handler(vision_model, labels),))
+    server.add_insecure_port(f"{args.host}:{args.vision_port}")
+    server.start()
+    logger.info(f"Fake Vision listening on {args.host}:{args.vision_port} (gRPC)")
+    logger.info(f"Fake Vertex listening on http://{args.host}:{args.vertex_port}/v1/fake:predict")
+    try:
+        uvicorn.run(vertex_app(vertex_model, sorted(labels)), host=args.host, port=args.vertex_port, log_level="warning")
+    finally:
+        server.stop(grace=None)
+        logger.info(f"vertex {vertex_model.stats()} vision {vision_model.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Load generator for a running API: drives POST /predict with split images and
+reports throughput, latency percentiles and error rates.
+
+Closed loop (--concurrency N): N clients, each sends its next request as soon
+as the previous one returns. Open loop (--rate R): requests arrive at R per
+second (Poisson by default) whether or not earlier ones have finished, and
+latency is measured from the scheduled arrival, so queueing shows up in it.
+
+Run against fake_google.py to load-test without paid Google calls:
+
+    python fake_google.py &
+    VERTEX_URL=http://127.0.0.1:8091/v1/fake:predict VERTEX_ANONYMOUS=true \\
+    VISION_API_ENDPOINT=127.0.0.1:8092 VISION_INSECURE=true ENABLE_CACHE=false \\
+        uvicorn main:app --port 8000 &
+    python loadtest.py --concurrency 32 --duration 30 --json-out before.json
+    python loadtest.py --concurrency 32 --duration 30 --baseline before.json
+
+With --baseline the run exits non-zero if throughput fell or p99 latency
+rose by more than --tolerance.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any
+
+import httpx
+
+from benchmark import DEFAULT_SPLIT, load_split, percentile
+
+
+class Recorder:
+    def __init__(self, warmup_until: float) -> None:
+        self.warmup_until = warmup_until
+        self.latencies: list[float] = []
+        self.outcomes: Counter[str] = Counter()
+        self.skipped: Counter[str] = Counter()
+        self.backend_errors: Counter[str] = Counter()
+        self.started: float | None = None
+        self.finished = 0.0
+
+    def record(self, scheduled: float, outcome: str, body: dict | None) -> None:
+        now = time.perf_counter()
+        if scheduled < self.warmup_until:
+            return
+        if self.started is None:
+            self.started = scheduled
+        self.finished = max(self.finished, now)
+        self.outcomes[outcome] += 1
+        if outcome == "ok":
+            self.latencies.append((now - scheduled) * 1000.0)
+            # A backend can fail or be skipped while /predict still answers 200
+            for backend in (body or {}).get("skipped", {}):
+                self.skipped[backend] += 1
+            for backend in ("vertex", "vision"):
+                if "error:" in str((body or {}).get(backend, {}).get("prediction", "")):
+                    self.backend_errors[backend] += 1
+
+    def summary(self) -> dict[str, Any]:
+        total = sum(self.outcomes.values())
+        ok = self.outcomes.get("ok", 0)
+        wall = max(self.finished - (self.started or self.finished), 1e-9)
+        latencies = self.latencies
+        return {
+            "requests": total,
+            "ok": ok,
+            "error_rate": round((total - ok) / total, 4) if total else 0.0,
+            "errors": {k: v for k, v in sorted(self.outcomes.items()) if k != "ok"},
+            "backend_errors": dict(self.backend_errors),
+            "skipped_backends": dict(self.skipped),
+            "wall_seconds": round(wall, 3),
+            "throughput_rps": round(ok / wall, 2),
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                "p50": round(percentile(latencies, 50), 2),
+                "p90": round(percentile(latencies, 90), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "max": round(max(latencies), 2) if latencies else 0.0,
+            },
+        }
+
+
+async def send(client: httpx.AsyncClient, image: tuple[str, bytes], scheduled: float, recorder: Recorder) -> None:
+    name, data = image
+    body = None
+    try:
+        response = await client.post("/predict", files={"file": (name, data, "image/jpeg")})
+        outcome = "ok" if response.status_code == 200 else f"http_{response.status_code}"
+        if outcome == "ok":
+            body = response.json()
+    except httpx.TimeoutException:
+        outcome = "timeout"
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    recorder.record(scheduled, outcome, body)
+
+
+async def closed_loop(client, images, concurrency: int, stop_at: float, recorder: Recorder) -> None:
+    async def worker(offset: int) -> None:
+        i = offset
+        while time.perf_counter() < stop_at:
+            await send(client, images[i % len(images)], time.perf_counter(), recorder)
+            i += concurrency
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+
+async def open_loop(client, images, rate: float, poisson: bool, max_in_flight: int, stop_at: float,
+                    recorder: Recorder) -> None:
+    tasks: set[asyncio.Task] = set()
+    next_at = time.perf_counter()
+    i = 0
+    while next_at < stop_at:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_in_flight:
+            # The server cannot keep up; count it rather than letting the client queue grow unbounded
+            recorder.record(next_at, "client_overload", None)
+        else:
+            task = asyncio.create_task(send(client, images[i % len(images)], next_at, recorder))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        i += 1
+        next_at += random.expovariate(rate) if poisson else 1.0 / rate
+    await asyncio.gather(*tasks)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/readyz", params={"require": "all"})).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise SystemExit(f"API not ready after {timeout:.0f}s")
+        await asyncio.sleep(1)
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Regressions of this run against a baseline report."""
+    problems = []
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        problems.append(f"throughput {result['throughput_rps']} rps < baseline {baseline['throughput_rps']} rps")
+    if result["latency_ms"]["p99"] > baseline["latency_ms"]["p99"] * (1 + tolerance):
+        problems.append(f"p99 {result['latency_ms']['p99']} ms > baseline {baseline['latency_ms']['p99']} ms")
+    if result["error_rate"] > baseline["error_rate"] + tolerance / 10:
+        problems.append(f"error rate {result['error_rate']} > baseline {baseline['error_rate']}")
+    return problems
+
+
+async def run(args) -> dict[str, Any]:
+    _, samples = load_split(args.split, args.limit)
+    images = []
+    for path, _ in samples:
+        with open(path, "rb") as f:
+            images.append((path.rsplit("/", 1)[-1], f.read()))
+    random.Random(0).shuffle(images)
+
+    in_flight = args.concurrency if args.rate is None else args.max_in_flight
+    limits = httpx.Limits(max_connections=in_flight, max_keepalive_connections=in_flight)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        await wait_ready(client, args.ready_timeout)
+        start = time.perf_counter()
+        recorder = Recorder(start + args.warmup)
+        stop_at = start + args.warmup + args.duration
+        if args.rate is None:
+            await closed_loop(client, images, args.concurrency, stop_at, recorder)
+        else:
+            await open_loop(client, images, args.rate, args.arrivals == "poisson", args.max_in_flight,
+                            stop_at, recorder)
+        server_stats = None
+        try:
+            server_stats = (await client.get("/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            pass
+
+    mode = {"concurrency": args.concurrency} if args.rate is None else {"rate": args.rate, "arrivals": args.arrivals}
+    return {"url": args.url, "images": len(images), **mode, **recorder.summary(), "server_stats": server_stats}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test POST /predict on a running API.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--split", default=DEFAULT_SPLIT)
+    parser.add_argument("--limit", type=int, help="use at most this many images")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed-loop clients (ignored with --rate)")
+    parser.add_argument("--rate", type=float, help="open-loop arrivals per second")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=512, help="open-loop cap on outstanding requests")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds excluded from the report")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout")
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--json-out", help="write the report here")
+    parser.add_argument("--baseline", help="report from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report = {k: v for k, v in result.items() if k != "server_stats"}
+    print(json.dumps(report, indent=2))
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
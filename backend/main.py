@@ -1,20 +1,34 @@
+import asyncio
+import contextvars
+import functools
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from fastapi import FastAPI, File, HTTPException, UploadFile, Request
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from app.vertex_service import VertexService
-from app.vision_service import VisionService
-from app.clip_service import ClipService
+# Heavy backends (torch, clip, google.cloud) are imported by the loaders below, off the startup path
 from app.vision_clip_service import VisionClipService
+from app.prediction_cache import PredictionCache, hamming_distance, perceptual_hash
+from app.image_pipeline import ImagePipeline
+from app.consensus import SKIPPED, build_response, skipped_result
+from app.cascade import CascadePolicy, CascadeStats
+from app.resilience import BackendGuard, BackendSkipped
+from app.stream import LatestFrame, StreamStats
+from app.jobs import DEFAULT_JOBS_DIR, FINAL_STATES, JobRunner, JobStore, is_within
+from app.metrics import REGISTRY, stage, start_trace
+from app.profiling import SlowRequestProfiler
+from app.uploads import MULTIPART_OVERHEAD, BodySizeLimit, sniff_image_type
+from app.responses import VIEWS, apply_view, dumps, prediction_response
+from app.label_rules import default_rules
 
 import logging
 
@@ -24,43 +38,263 @@ logger = logging.getLogger(__name__)
 ENABLE_VERTEX = os.getenv("ENABLE_VERTEX", "true").lower() == "true"
 ENABLE_VISION = os.getenv("ENABLE_VISION", "true").lower() == "true"
 ENABLE_CLIP = os.getenv("ENABLE_CLIP", "true").lower() == "true"
+# Replace Vertex and Vision with in-process stand-ins (offline benchmarking/development only)
+OFFLINE_STANDINS = os.getenv("OFFLINE_STANDINS", "false").lower() == "true"
 
 MAX_FILE_SIZE = 10 * 1024 * 1024
 ALLOWED_MIME_TYPES = {"image/jpeg", "image/png", "image/webp"}
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Vertex Service Initialization
-    app.state.vertex_service = None
-    if ENABLE_VERTEX:
-        try:
-            app.state.vertex_service = VertexService()
-            logger.info("VertexService initialized successfully.")
-        except Exception as e:
-            logger.warning(f"VertexService failed to initialize: {e}. Vertex predictions will be disabled.")
+# CLIP micro-batching: one forward pass per CLIP_MAX_BATCH_SIZE images or CLIP_MAX_WAIT_MS
+CLIP_MAX_BATCH_SIZE = int(os.getenv("CLIP_MAX_BATCH_SIZE", "8"))
+CLIP_MAX_WAIT_MS = float(os.getenv("CLIP_MAX_WAIT_MS", "5"))
 
-    # Vision and CLIP Services
-    vision_service = None
-    if ENABLE_VISION:
-        try:
-            vision_service = VisionService()
-            logger.info("VisionService initialized successfully.")
-        except Exception as e:
-            logger.warning(f"VisionService failed to initialize: {e}.")
+# Shared inference process (clip_server.py): when set, workers send tensors there instead of loading CLIP
+CLIP_SERVER_SOCKET = os.getenv("CLIP_SERVER_SOCKET", "")
+# /stats gives up on the shared CLIP server's counters after this long
+CLIP_SERVER_STATS_TIMEOUT_S = 1.0
+
+# Fallback after Vision: "clip" (zero-shot prompts) or "knn" (local index, see build_knn_index.py)
+VISION_FALLBACK = os.getenv("VISION_FALLBACK", "clip").lower()
+
+# Prediction cache (exact SHA-256 match, optional perceptual-hash near-duplicates)
+ENABLE_CACHE = os.getenv("ENABLE_CACHE", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_MAX_MB = float(os.getenv("CACHE_MAX_MB", "64"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_PHASH_DISTANCE = int(os.getenv("CACHE_PHASH_DISTANCE", "-1"))  # -1 disables near-duplicate lookup
+
+# Shared preprocessing: uploads are decoded once and downscaled before going to the remote APIs
+UPLOAD_MAX_SIDE = int(os.getenv("UPLOAD_MAX_SIDE", "1024"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "90"))
+
+# Default /predict and /ws/stream response view when the client sends no ?view= (verbose or compact)
+PREDICT_VIEW = os.getenv("PREDICT_VIEW", "verbose").lower()
+
+# /ws/stream: frames within this dHash distance of the last classified frame are dropped (-1 disables)
+STREAM_DEDUP_DISTANCE = int(os.getenv("STREAM_DEDUP_DISTANCE", "4"))
+
+# Load backends after the server starts accepting traffic (false = block startup until loaded)
+BACKGROUND_LOADING = os.getenv("BACKGROUND_LOADING", "true").lower() == "true"
+
+# Threads for the Vision+CLIP path; remote calls use the default pool.
+# Batches can only fill up to the number of concurrent callers.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(CLIP_MAX_BATCH_SIZE, min(4, os.cpu_count() or 1)))))
+
+# Per-backend deadlines (seconds); hedging and circuit breakers are configured as <NAME>_* (see app/resilience.py)
+VERTEX_DEADLINE_S = float(os.getenv("VERTEX_DEADLINE_S", "8"))
+VISION_DEADLINE_S = float(os.getenv("VISION_DEADLINE_S", "5"))
+
+# Bulk jobs (/jobs): SQLite progress store, upload limit and parallelism (see app/jobs.py)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOBS_DIR = os.getenv("JOBS_DIR", DEFAULT_JOBS_DIR)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(JOBS_DIR, "jobs.sqlite"))
+JOBS_ALLOWED_DIRS = [
+    os.path.abspath(path)
+    for path in os.getenv(
+        "JOBS_ALLOWED_DIRS", f"{os.path.join(REPO_ROOT, 'split')},{os.path.join(REPO_ROOT, 'dataset')}"
+    ).split(",")
+    if path.strip()
+]
+JOBS_MAX_UPLOAD_MB = float(os.getenv("JOBS_MAX_UPLOAD_MB", "2048"))
+JOBS_MAX_EXTRACT_MB = float(os.getenv("JOBS_MAX_EXTRACT_MB", "8192"))
+JOBS_BATCH_SIZE = int(os.getenv("JOBS_BATCH_SIZE", "16"))
+JOBS_PARALLEL_BATCHES = int(os.getenv("JOBS_PARALLEL_BATCHES", "2"))
+JOBS_MAX_RUNNING = int(os.getenv("JOBS_MAX_RUNNING", "1"))
 
-    clip_service = None
-    if ENABLE_CLIP:
+# Slow-request profiler: requests slower than PROFILE_SLOW_MS get a stack-sample profile (0 disables)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "cache/profiles")
+
+REGISTRY.register("wasteml_request_seconds", "histogram", "HTTP request duration by route.")
+REGISTRY.register("wasteml_requests_in_flight", "gauge", "HTTP requests currently being served.")
+REGISTRY.register("wasteml_backend_results_total", "counter", "Backend results by outcome (ok, error, skipped, disabled).")
+REGISTRY.register("wasteml_cache_requests_total", "counter", "Prediction cache lookups by backend and result.")
+REGISTRY.register("wasteml_guard_events_total", "counter", "Deadline, hedging and circuit breaker events by backend.")
+REGISTRY.register("wasteml_circuit_open", "gauge", "1 while a backend's circuit breaker is not closed.")
+
+def is_error_result(result) -> bool:
+    if isinstance(result, list):  # batched call: failed only if every image failed
+        return bool(result) and all(is_error_result(item) for item in result)
+    return str(result.get("prediction", "")).startswith("error")
+
+def load_vertex():
+    if OFFLINE_STANDINS:
+        from app.standins import LocalVertexService
+        return LocalVertexService()
+    from app.vertex_service import VertexService
+    return VertexService()
+
+def load_vision():
+    if OFFLINE_STANDINS:
+        from app.standins import LocalVisionService
+        return LocalVisionService()
+    from app.vision_service import VisionService
+    return VisionService()
+
+def load_clip():
+    if CLIP_SERVER_SOCKET:
+        from app.clip_remote import RemoteClipService
+
+        # This worker only preprocesses (numpy, no torch); the server owns the weights and threads
+        clip_service = RemoteClipService(CLIP_SERVER_SOCKET, connections=INFERENCE_WORKERS)
+        logger.info(f"Using the shared CLIP inference server at {CLIP_SERVER_SOCKET}.")
+    else:
+        from app.clip_service import ClipService
+
+        clip_service = ClipService(classes=["metal", "cardboard", "plastic"])
+        clip_service.warmup()
+
+    knn_service = None
+    if VISION_FALLBACK == "knn":
         try:
-            clip_service = ClipService(classes=["metal", "cardboard", "plastic"])
-            logger.info("ClipService initialized successfully.")
+            from app.knn_service import KnnService
+
+            knn_service = KnnService(clip_service)
+            if len(knn_service.index) == 0:
+                raise ValueError("index is empty; run build_knn_index.py")
+            logger.info(f"KnnService initialized with {len(knn_service.index)} embeddings.")
         except Exception as e:
-            logger.warning(f"ClipService failed to initialize: {e}.")
+            knn_service = None
+            logger.warning(f"KnnService failed to initialize: {e}. Falling back to zero-shot CLIP.")
+
+    # The shared server batches across workers itself
+    if CLIP_MAX_BATCH_SIZE > 1 and not CLIP_SERVER_SOCKET:
+        from app.clip_batcher import ClipBatcher
+
+        clip_service = ClipBatcher(clip_service, CLIP_MAX_BATCH_SIZE, CLIP_MAX_WAIT_MS)
+        logger.info(f"CLIP micro-batching enabled (max batch {CLIP_MAX_BATCH_SIZE}, max wait {CLIP_MAX_WAIT_MS}ms).")
+    return clip_service, knn_service
+
+def on_vertex_ready(service):
+    app.state.vertex_service = service
+
+def on_vision_ready(service):
+    app.state.vision_clip_service.vision = service
+
+def on_clip_ready(services):
+    clip_service, knn_service = services
+    # The remote client's stats() is a socket round trip, so /stats queries it off the loop
+    if CLIP_SERVER_SOCKET:
+        app.state.clip_remote = clip_service
+    elif hasattr(clip_service, "stats"):
+        app.state.clip_batcher = clip_service
+    vision_clip = app.state.vision_clip_service
+    vision_clip.knn = knn_service
+    vision_clip.fallback = VISION_FALLBACK if VISION_FALLBACK == "knn" and knn_service else "clip"
+    vision_clip.clip = clip_service
+    app.state.image_pipeline.clip_preprocess = clip_service.preprocess
+
+async def start_backend(name: str, loader, on_ready):
+    """Initialize one backend in a worker thread; the server keeps serving meanwhile."""
+    start = time.perf_counter()
+    try:
+        service = await asyncio.to_thread(loader)
+    except Exception as e:
+        app.state.readiness[name] = "failed"
+        logger.warning(f"{name} backend failed to initialize: {e}. Its predictions will be disabled.")
+        return
+    on_ready(service)
+    app.state.readiness[name] = "ready"
+    logger.info(f"{name} backend ready in {time.perf_counter() - start:.1f}s.")
 
-    app.state.vision_clip_service = VisionClipService(vision_service, clip_service)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.vertex_service = None
+    app.state.clip_batcher = None
+    app.state.clip_remote = None
+    app.state.rule_store = default_rules()
+    app.state.backend_guards = {
+        "vertex": BackendGuard.from_env("vertex", VERTEX_DEADLINE_S, is_failure=is_error_result),
+        "vision": BackendGuard.from_env("vision", VISION_DEADLINE_S),
+    }
+    app.state.vision_clip_service = VisionClipService(
+        rules=app.state.rule_store, vision_guard=app.state.backend_guards["vision"]
+    )
+    app.state.image_pipeline = ImagePipeline(
+        max_side=UPLOAD_MAX_SIDE,
+        jpeg_quality=UPLOAD_JPEG_QUALITY,
+    )
+    app.state.prediction_cache = (
+        PredictionCache(
+            max_entries=CACHE_MAX_ENTRIES,
+            max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+            ttl_seconds=CACHE_TTL_SECONDS,
+            phash_distance=CACHE_PHASH_DISTANCE,
+        )
+        if ENABLE_CACHE
+        else None
+    )
+    # Cascade routing policy (CASCADE_MODE=off|on|shadow, see app/cascade.py)
+    app.state.cascade_policy = CascadePolicy.from_env()
+    app.state.cascade_stats = CascadeStats()
+    if app.state.cascade_policy.mode != "off":
+        logger.info(
+            f"Cascade routing '{app.state.cascade_policy.mode}': {' -> '.join(app.state.cascade_policy.stages)}."
+        )
+    app.state.inference_executor = ThreadPoolExecutor(
+        max_workers=INFERENCE_WORKERS, thread_name_prefix="inference"
+    )
+
+    # Backends load in the background: "disabled" | "loading" | "ready" | "failed"
+    backends = {
+        "vertex": (ENABLE_VERTEX, load_vertex, on_vertex_ready),
+        "vision": (ENABLE_VISION, load_vision, on_vision_ready),
+        "clip": (ENABLE_CLIP, load_clip, on_clip_ready),
+    }
+    app.state.readiness = {name: "loading" if enabled else "disabled" for name, (enabled, _, _) in backends.items()}
+    app.state.loader_tasks = [
+        asyncio.create_task(start_backend(name, loader, on_ready))
+        for name, (enabled, loader, on_ready) in backends.items()
+        if enabled
+    ]
+    if not BACKGROUND_LOADING:
+        await asyncio.gather(*app.state.loader_tasks)
+
+    app.state.job_store = JobStore(JOBS_DB_PATH)
+    app.state.job_runner = JobRunner(
+        app.state.job_store,
+        classify_batch,
+        JOBS_DIR,
+        batch_size=JOBS_BATCH_SIZE,
+        parallel_batches=JOBS_PARALLEL_BATCHES,
+        max_running=JOBS_MAX_RUNNING,
+        max_file_bytes=MAX_FILE_SIZE,
+        max_extract_bytes=int(JOBS_MAX_EXTRACT_MB * 1024 * 1024),
+        wait_until_ready=wait_for_backends,
+    )
+    app.state.job_runner.start()
+    app.state.profiler = (
+        SlowRequestProfiler(PROFILE_SLOW_MS, PROFILE_INTERVAL_MS, PROFILE_DIR) if PROFILE_SLOW_MS > 0 else None
+    )
     yield
+    if app.state.profiler:
+        app.state.profiler.close()
+    await app.state.job_runner.stop()
+    app.state.job_store.close()
+    app.state.inference_executor.shutdown(wait=False)
+    for guard in app.state.backend_guards.values():
+        guard.close()
+    if app.state.vertex_service:
+        await app.state.vertex_service.aclose()
+    if app.state.vision_clip_service.vision:
+        await app.state.vision_clip_service.vision.aclose()
+    if app.state.clip_batcher:
+        app.state.clip_batcher.close()
+    if app.state.clip_remote:
+        app.state.clip_remote.close()
 
 app = FastAPI(title="WasteML Compare API", lifespan=lifespan)
 
+# Oversized bodies are refused while they stream in, before they are spooled
+app.add_middleware(
+    BodySizeLimit,
+    limits={
+        "/predict": MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/jobs": int(JOBS_MAX_UPLOAD_MB * 1024 * 1024) + MULTIPART_OVERHEAD,
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -73,128 +307,591 @@ app.add_middleware(
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Domain Guard Config
-NEGATIVE_DOMAINS = {"fruit", "vehicle", "animal", "person", "plant", "food", "organism", "clothing", "car", "automotive", "mammal", "wheel"}
-POSITIVE_INDICATORS = {"waste", "trash", "garbage", "container", "packaging", "recycling", "bottle", "can", "box"}
-CONFIDENCE_THRESHOLD = 0.60
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Request duration and in-flight metrics; slow requests are profiled when PROFILE_SLOW_MS is set."""
+    profiler = getattr(request.app.state, "profiler", None)
+    spans = start_trace() if profiler else None
+    started = profiler.begin() if profiler else time.perf_counter()
+    REGISTRY.inc("wasteml_requests_in_flight", 1)
+    try:
+        return await call_next(request)
+    finally:
+        REGISTRY.inc("wasteml_requests_in_flight", -1)
+        route = request.scope.get("route")
+        label = route.path if route is not None else "unmatched"
+        REGISTRY.observe("wasteml_request_seconds", time.perf_counter() - started, route=label)
+        if profiler:
+            profiler.end(started, f"{request.method} {label}", spans)
+
+def run_in_context(executor, fn, *args):
+    """run_in_executor that carries the request's context (stage spans) into the worker thread."""
+    return asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(contextvars.copy_context().run, fn, *args)
+    )
+
+async def run_timed(fn, *args, executor=None):
+    """Await an async backend call, or run a blocking one off the event loop, and time it in ms."""
+    start = time.perf_counter()
+    if asyncio.iscoroutinefunction(fn):
+        result = await fn(*args)
+    else:
+        result = await run_in_context(executor, fn, *args)
+    return result, int((time.perf_counter() - start) * 1000)
+
+def count_result(backend: str, result: dict) -> None:
+    if result.get("prediction") == "disabled":
+        outcome = "disabled"
+    elif "skipped" in result and backend in result["skipped"]:
+        outcome = "skipped"
+    else:
+        outcome = "error" if is_error_result(result) else "ok"
+    REGISTRY.inc("wasteml_backend_results_total", backend=backend, outcome=outcome)
+
+def is_cacheable(result: dict) -> bool:
+    """Only successful predictions are cached so a failing backend is retried next time."""
+    if not result:
+        return False
+    prediction = str(result.get("prediction", ""))
+    if prediction in ("disabled", "unknown", SKIPPED) or "skipped" in result:
+        return False
+    return not prediction.startswith("error")
+
+async def run_cached(backend: str, cache_key, fn, *args, executor=None):
+    """Serve a backend result from the prediction cache, or call it and store the result."""
+    cache = app.state.prediction_cache
+    if cache and cache_key:
+        hit = cache.get(cache_key, backend)
+        if hit is not None:
+            result, kind = hit
+            return result, 0, kind
+
+    result, latency = await run_timed(fn, *args, executor=executor)
+    if cache and cache_key and is_cacheable(result):
+        cache.put(cache_key, backend, result)
+    return result, latency, None
+
+async def run_vertex(image_bytes: bytes, cache_key=None):
+    if not app.state.vertex_service:
+        return {"prediction": "disabled", "confidence": 0.0, "raw": {}}, 0, None
+    return await run_cached("vertex", cache_key, guarded_vertex_predict, image_bytes)
+
+async def guarded_vertex_predict(image_bytes: bytes) -> dict:
+    """Vertex call under its deadline, hedging and circuit breaker."""
+    try:
+        return await app.state.backend_guards["vertex"].acall(app.state.vertex_service.apredict, image_bytes)
+    except BackendSkipped as e:
+        return skipped_result("vertex", e.reason)
+
+def cascade_backends() -> dict[str, str]:
+    """Backend answering each cascade stage right now; stages still loading are left out."""
+    vision_clip = app.state.vision_clip_service
+    backends = {}
+    if vision_clip.local_model:
+        backends["local"] = vision_clip.fallback
+    if vision_clip.vision:
+        backends["vision"] = "vision"
+    if app.state.vertex_service:
+        backends["vertex"] = "vertex"
+    return backends
+
+async def run_stage(stage: str, prepared, cache_key=None):
+    vision_clip = app.state.vision_clip_service
+    if stage == "vertex":
+        return await run_vertex(prepared.payload, cache_key)
+    if stage == "vision":
+        return await run_cached("vision_labels", cache_key, vision_clip.apredict_vision, prepared.payload)
+    return await run_cached(
+        "local", cache_key, vision_clip.predict_local, prepared.payload, prepared.clip_input,
+        executor=app.state.inference_executor,
+    )
+
+async def predict_cascade(prepared, cache_key=None):
+    """Call stages in policy order and stop at the first confident one."""
+    policy = app.state.cascade_policy
+    backends = cascade_backends()
+    classes = set(app.state.rule_store.current().classes)
+
+    results, latencies, caches = {}, {}, {}
+    stopped_at = None
+    for stage in policy.stages:
+        if stage not in backends:
+            continue
+        results[stage], latencies[stage], caches[stage] = await run_stage(stage, prepared, cache_key)
+        stopped_at = stage
+        if policy.accepts(backends[stage], results[stage], classes):
+            break
+    skipped = [stage for stage in policy.stages if stage in backends and stage not in results]
+    app.state.cascade_stats.record(
+        stopped_at,
+        {stage: latency for stage, latency in latencies.items() if caches[stage] is None},
+        skipped,
+    )
+
+    # Vision + CLIP side: a Vision class match wins, else the local model with Vision's labels
+    vision_res, local_res = results.get("vision"), results.get("local")
+    vc_stage = None
+    if vision_res and vision_res["prediction"] in classes:
+        vc_stage, vc_res = "vision", vision_res
+    elif local_res:
+        vc_stage = "local"
+        vc_res = dict(local_res)
+        if vision_res:
+            vc_res["top_labels"] = vision_res["top_labels"]
+            vc_res["raw"] = {**local_res["raw"], "vision_api": vision_res["raw"]["vision_api"]}
+            if "skipped" in vision_res:
+                vc_res["skipped"] = vision_res["skipped"]
+    elif vision_res:
+        vc_stage, vc_res = "vision", vision_res
+    elif "local" in skipped or "vision" in skipped:
+        vc_res = skipped_result("vision", "cascade")
+    else:
+        vc_res = {"prediction": "disabled", "confidence": 0.0, "raw": {}}
+
+    if "vertex" in results:
+        vertex_res = results["vertex"]
+    elif "vertex" in skipped:
+        vertex_res = skipped_result("vertex", "cascade")
+    else:
+        vertex_res = {"prediction": "disabled", "confidence": 0.0, "raw": {}}
+
+    route = {"mode": "on", "stopped_at": stopped_at, "called": list(results), "skipped": skipped}
+    return (
+        (vertex_res, latencies.get("vertex", 0), caches.get("vertex")),
+        (vc_res, latencies.get("local", 0) + latencies.get("vision", 0), caches.get(vc_stage)),
+        route,
+    )
+
+def shadow_route(local, vertex, vision, recommendation: str) -> dict:
+    """Where the cascade would have stopped for a request that called every backend."""
+    policy = app.state.cascade_policy
+    backends = cascade_backends()
+    classes = set(app.state.rule_store.current().classes)
+    (vertex_res, v_latency, _), (vc_res, vc_latency, _) = vertex, vision
+
+    results = {"vertex": vertex_res}
+    latencies = {"vertex": v_latency, "vision": vc_latency}
+    if "vision" in backends:
+        # The combined result is a Vision answer only when no CLIP fallback was needed
+        from_vision = vc_res.get("raw", {}).get("clip_fallback") is None
+        results["vision"] = vc_res if from_vision else None
+    if local is not None:
+        results["local"], latencies["local"], _ = local
+    results = {stage: res for stage, res in results.items() if stage in backends}
+
+    would_stop_at = policy.decide(results, backends, classes)
+    order = [stage for stage in policy.stages if stage in results]
+    would_skip = order[order.index(would_stop_at) + 1:] if would_stop_at else []
+    agrees = not would_skip or results[would_stop_at]["prediction"] == recommendation
+    app.state.cascade_stats.record_shadow(would_stop_at, latencies, would_skip, agrees)
+    return {"mode": "shadow", "would_stop_at": would_stop_at, "would_skip": would_skip, "agrees": agrees}
+
+def prepare_upload(image_bytes: bytes):
+    """Decode the upload once and derive the shared artifacts plus its cache key."""
+    prepared = app.state.image_pipeline.prepare(image_bytes)
+    cache_key = None
+    if app.state.prediction_cache:
+        cache_key = app.state.prediction_cache.key_for(image_bytes, prepared.image)
+    return prepared, cache_key
+
+async def classify(prepared, cache_key=None) -> dict:
+    """Run the backends for one prepared image and build the consensus response."""
+    mode = app.state.cascade_policy.mode
+    route = None
+    if mode == "on":
+        (vertex_res, v_latency, v_cache), (vc_res, vc_latency, vc_cache), route = await predict_cascade(
+            prepared, cache_key
+        )
+    else:
+        # Vertex and Vision + CLIP predictions run concurrently; each reports its own latency
+        calls = [
+            run_vertex(prepared.payload, cache_key),
+            run_cached(
+                "vision",
+                cache_key,
+                app.state.vision_clip_service.apredict,
+                prepared.payload,
+                prepared.clip_input,
+                app.state.inference_executor,
+            ),
+        ]
+        # Shadow mode also runs the local stage on its own to see whether it would have sufficed
+        if mode == "shadow" and "local" in cascade_backends():
+            calls.append(run_stage("local", prepared, cache_key))
+        vertex, vision, *local = await asyncio.gather(*calls)
+        (vertex_res, v_latency, v_cache), (vc_res, vc_latency, vc_cache) = vertex, vision
+
+    count_result("vertex", vertex_res)
+    count_result("vision", vc_res)
+    with stage("consensus"):
+        response = build_response(
+            vertex_res, v_latency, vc_res, vc_latency, rules=app.state.rule_store.current()
+        )
+    response["vertex"]["cache"] = v_cache
+    response["vision"]["cache"] = vc_cache
+    if mode == "shadow":
+        route = shadow_route(local[0] if local else None, vertex, vision, response["consensus"]["recommendation"])
+    if route:
+        response["cascade"] = route
+    # Backends that were not called or ran out of time, with the reason
+    skipped = {**vertex_res.get("skipped", {}), **vc_res.get("skipped", {})}
+    if skipped:
+        response["skipped"] = skipped
+    return response
+
+async def wait_for_backends() -> None:
+    """Jobs start once no backend is still loading, so every image sees the same backends."""
+    while "loading" in app.state.readiness.values():
+        await asyncio.sleep(1)
+
+async def classify_batch(images: list[bytes]) -> list[dict]:
+    """classify() for a batch of images using each backend's batched path (used by bulk jobs).
+
+    Vertex gets one request for the whole batch and the local model one forward
+    pass for every image Vision could not map. Jobs always call every backend;
+    cascade routing and the prediction cache apply to /predict only.
+    """
+    loop = asyncio.get_running_loop()
+    executor = app.state.inference_executor
+    vision_clip = app.state.vision_clip_service
+
+    def prepare(image_bytes: bytes):
+        try:
+            return app.state.image_pipeline.prepare(image_bytes)
+        except Exception:
+            return None
+
+    prepared_all = await loop.run_in_executor(executor, lambda: [prepare(image) for image in images])
+    prepared = [item for item in prepared_all if item is not None]
+    payloads = [item.payload for item in prepared]
+
+    async def vertex_batch():
+        if not app.state.vertex_service:
+            return [{"prediction": "disabled", "confidence": 0.0, "raw": {}}] * len(payloads)
+        try:
+            return await app.state.backend_guards["vertex"].acall(app.state.vertex_service.apredict_batch, payloads)
+        except BackendSkipped as e:
+            return [skipped_result("vertex", e.reason) for _ in payloads]
+
+    async def vision_clip_batch():
+        # Concurrent calls are coalesced into batch_annotate_images RPCs by VisionService
+        vision_results = await asyncio.gather(*(vision_clip.apredict_vision(payload) for payload in payloads))
+        return await loop.run_in_executor(
+            executor, vision_clip.predict_batch, payloads, [item.clip_input for item in prepared], vision_results
+        )
+
+    results = []
+    if prepared:
+        (vertex_results, v_latency), (vc_results, vc_latency) = await asyncio.gather(
+            run_timed(vertex_batch), run_timed(vision_clip_batch)
+        )
+        rules = app.state.rule_store.current()
+        for vertex_res, vc_res in zip(vertex_results, vc_results):
+            count_result("vertex", vertex_res)
+            count_result("vision", vc_res)
+            with stage("consensus"):
+                response = build_response(vertex_res, v_latency, vc_res, vc_latency, rules=rules)
+            skipped = {**vertex_res.get("skipped", {}), **vc_res.get("skipped", {})}
+            if skipped:
+                response["skipped"] = skipped
+            results.append(response)
+
+    responses = iter(results)
+    return [next(responses) if item is not None else {"error": "Could not decode image"} for item in prepared_all]
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    if file.content_type not in ALLOWED_MIME_TYPES:
-        raise HTTPException(status_code=400, detail="Invalid image type")
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and the event loop responds."""
+    return {"status": "ok"}
 
-    image_bytes = await file.read()
-    if len(image_bytes) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="File too large")
-
-    # Vertex Prediction
-    v_start = time.perf_counter()
-    vertex_res = (
-        app.state.vertex_service.predict(image_bytes)
-        if app.state.vertex_service
-        else {"prediction": "disabled", "confidence": 0.0, "raw": {}}
+@app.get("/readyz")
+async def readyz(require: str = "any"):
+    """Readiness per backend. 200 once one backend (or, with require=all, every enabled one) is ready."""
+    readiness = app.state.readiness
+    enabled = [state for state in readiness.values() if state != "disabled"]
+    if require == "all":
+        ready = bool(enabled) and all(state in ("ready", "failed") for state in enabled) and "ready" in enabled
+    else:
+        ready = "ready" in enabled
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "backends": readiness},
     )
-    v_latency = int((time.perf_counter() - v_start) * 1000)
-
-    # Vision + CLIP Prediction
-    vc_start = time.perf_counter()
-    vc_res = app.state.vision_clip_service.predict(image_bytes)
-    vc_latency = int((time.perf_counter() - vc_start) * 1000)
-
-    # Waste Guard Logic
-    vision_labels = [L["label"].lower() for L in vc_res.get("top_labels", [])]
-    is_negative = any(any(neg in label for neg in NEGATIVE_DOMAINS) for label in vision_labels)
-    has_positive = any(any(pos in label for pos in POSITIVE_INDICATORS) for label in vision_labels)
-
-    is_unrecognized = is_negative and not has_positive
-
-    # Final result assembly with thresholds and guard
-    v_pred = vertex_res["prediction"]
-    v_conf = vertex_res["confidence"]
-    if is_unrecognized or v_conf < CONFIDENCE_THRESHOLD:
-        v_pred = "unrecognized" if is_unrecognized else f"ambiguous ({v_pred})"
-
-    vc_pred = vc_res["prediction"]
-    vc_conf = vc_res["confidence"]
-    if is_unrecognized or vc_conf < CONFIDENCE_THRESHOLD:
-        vc_pred = "unrecognized" if is_unrecognized else f"ambiguous ({vc_pred})"
-
-    # Comparison Logic
-    match = v_pred.lower() == vc_pred.lower()
-    faster = "vertex" if v_latency < vc_latency else "vision"
-
-    # Consensus Reasoning (Multi-Label Validation & Tie-Breaking)
-    raw_v_pred = vertex_res.get("prediction", "disabled").lower()
-    
-    # 1. Multi-Label Validation: Check if Vertex pred is in Vision's descriptive labels
-    is_validated = any(raw_v_pred in label for label in vision_labels)
-    
-    # 2. Recommendation Logic
-    recommendation = v_pred
-    reasoning = "Vertex AI (Custom) and Pretrained Models are in full agreement."
-    reliability = max(v_conf, vc_conf)
-
-    if is_unrecognized:
-        recommendation = "unrecognized"
-        reasoning = "Both models agree this item is outside the waste domain (Waste Guard trigger)."
-        reliability = 1.0
-    elif not match:
-        if is_validated:
-            recommendation = v_pred
-            reasoning = f"Vertex predicted '{v_pred}', which was validated by Vision's descriptive labels."
-        else:
-            # Tie-break: Priority to Custom Model for specific waste classes
-            recommendation = v_pred
-            reasoning = f"Models disagree. Prioritizing Vertex AI as the domain specialist for waste classification."
-            reliability = v_conf * 0.9 # Slight penalty for disagreement
-
-    if "ambiguous" in v_pred and "ambiguous" in vc_pred:
-        recommendation = "ambiguous"
-        reasoning = "Both models are uncertain. Please provide a clearer image."
-        reliability = 0.5
 
+async def clip_server_stats() -> dict | None:
+    """Counters of the shared CLIP server, fetched in a thread so a slow server cannot stall the loop."""
+    if not app.state.clip_remote:
+        return None
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(app.state.clip_remote.stats), CLIP_SERVER_STATS_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        return {"error": "timeout", "socket": CLIP_SERVER_SOCKET}
+    except Exception as e:
+        return {"error": str(e), "socket": CLIP_SERVER_SOCKET}
+
+@app.get("/stats")
+async def stats():
+    """Runtime counters for tuning (per worker process)."""
     return {
-        "consensus": {
-            "recommendation": recommendation,
-            "reasoning": reasoning,
-            "reliability": round(reliability, 2),
-            "is_validated_by_vision": is_validated,
-            "prediction_match": match,
-            "faster_model": faster
-        },
-        "vertex": {
-            "prediction": v_pred,
-            "confidence": v_conf,
-            "precision": vertex_res.get("precision", v_conf),
-            "latency_ms": v_latency,
-            "raw": {
-                **vertex_res.get("raw", {}),
-                "waste_guard": {
-                    "is_negative": is_negative,
-                    "has_positive": has_positive,
-                    "is_unrecognized": is_unrecognized,
-                    "threshold_applied": v_conf < CONFIDENCE_THRESHOLD
-                }
-            },
-        },
-        "vision": {
-            "prediction": vc_pred,
-            "confidence": vc_conf,
-            "precision": vc_res.get("precision", vc_conf),
-            "top_labels": vc_res.get("top_labels", []),
-            "latency_ms": vc_latency,
-            "raw": {
-                **vc_res.get("raw", {}),
-                "waste_guard": {
-                    "is_negative": is_negative,
-                    "has_positive": has_positive,
-                    "is_unrecognized": is_unrecognized,
-                    "threshold_applied": vc_conf < CONFIDENCE_THRESHOLD
-                }
-            },
-        }
+        "clip_batcher": app.state.clip_batcher.stats() if app.state.clip_batcher else None,
+        "clip_server": await clip_server_stats(),
+        "vision_batching": getattr(app.state.vision_clip_service.vision, "stats", lambda: None)(),
+        "prediction_cache": app.state.prediction_cache.stats() if app.state.prediction_cache else None,
+        "label_rules": app.state.rule_store.stats(),
+        "cascade": {"mode": app.state.cascade_policy.mode, **app.state.cascade_stats.snapshot()},
+        "backends": {name: guard.stats() for name, guard in app.state.backend_guards.items()},
+        "profiler": app.state.profiler.stats() if app.state.profiler else None,
     }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus exposition of stage latencies, in-flight gauges and cache/error counters (per worker process)."""
+    cache = app.state.prediction_cache
+    if cache:
+        for backend, counters in cache.stats()["backends"].items():
+            for key, result in (("exact_hits", "exact_hit"), ("near_hits", "near_hit"), ("misses", "miss")):
+                REGISTRY.set("wasteml_cache_requests_total", counters[key], backend=backend, result=result)
+    for name, guard in app.state.backend_guards.items():
+        guard_stats = guard.stats()
+        for event in ("calls", "errors", "timeouts", "hedges", "hedge_wins", "skipped"):
+            REGISTRY.set("wasteml_guard_events_total", guard_stats[event], backend=name, event=event)
+        REGISTRY.set("wasteml_circuit_open", int(guard_stats["circuit"] != "closed"), backend=name)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/rules/reload")
+async def reload_rules():
+    """Recompile label rules from disk immediately (they also reload on file change)."""
+    app.state.rule_store.reload()
+    return app.state.rule_store.stats()
+
+def resolve_view(view: str | None) -> str:
+    view = (view or PREDICT_VIEW).lower()
+    if view not in VIEWS:
+        raise HTTPException(status_code=400, detail=f"view must be one of {', '.join(VIEWS)}")
+    return view
+
+@app.post("/predict")
+async def predict(request: Request, file: UploadFile = File(...), view: str | None = None):
+    """Classify one image. `view=compact` returns only the consensus and per-backend
+    prediction/confidence/latency; `Accept: application/msgpack` selects MessagePack."""
+    view = resolve_view(view)
+    # The body limit already capped the request; this checks the file part itself before reading it
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+    with stage("upload_read"):
+        # One buffer, shared by every backend from here on
+        image_bytes = await file.read()
+    if len(image_bytes) > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+    # The type comes from the file's magic bytes, not the client's Content-Type
+    if sniff_image_type(image_bytes) not in ALLOWED_MIME_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid image type")
+
+    if "ready" not in app.state.readiness.values():
+        raise HTTPException(
+            status_code=503,
+            detail={"message": "Models are still loading", "backends": app.state.readiness},
+            headers={"Retry-After": "5"},
+        )
+
+    try:
+        prepared, cache_key = await run_in_context(app.state.inference_executor, prepare_upload, image_bytes)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+
+    response = await classify(prepared, cache_key)
+    return prediction_response(response, view, request.headers.get("accept"))
+
+@app.websocket("/ws/stream")
+async def stream(websocket: WebSocket, view: str | None = None):
+    """Camera stream: binary image frames in, /predict-style results out as they complete.
+
+    Frames visually unchanged from the last classified one are dropped, and when
+    inference falls behind only the newest frame is kept. Send the text message
+    "stats" to get the connection counters at any time. `?view=compact` trims
+    each result as for /predict.
+    """
+    await websocket.accept()
+    view = (view or PREDICT_VIEW).lower()
+    if view not in VIEWS:
+        await websocket.close(code=1008, reason=f"view must be one of {', '.join(VIEWS)}")
+        return
+    mailbox, stats = LatestFrame(), StreamStats()
+    send_lock = asyncio.Lock()
+
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_text(dumps(message))
+
+    worker = asyncio.create_task(stream_worker(mailbox, stats, send, view))
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                stats.received += 1
+                frame = message["bytes"]
+                if len(frame) > MAX_FILE_SIZE:
+                    stats.errors += 1
+                    await send({"type": "error", "frame": stats.received, "detail": "File too large"})
+                    continue
+                if mailbox.put((stats.received, frame, time.perf_counter())):
+                    stats.dropped_stale += 1
+            elif (message.get("text") or "").strip() == "stats":
+                await send({"type": "stats", "stats": stats.snapshot()})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        mailbox.close()
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+async def stream_worker(mailbox: LatestFrame, stats: StreamStats, send, view: str = "verbose"):
+    """Classify the newest frame whenever the previous one is done."""
+    loop = asyncio.get_running_loop()
+    executor = app.state.inference_executor
+    last_hash = None
+    while (frame := await mailbox.get()) is not None:
+        seq, image_bytes, received_at = frame
+        if "ready" not in app.state.readiness.values():
+            stats.dropped_not_ready += 1
+            await send({"type": "error", "frame": seq, "detail": "Models are still loading"})
+            continue
+        if sniff_image_type(image_bytes) not in ALLOWED_MIME_TYPES:
+            stats.errors += 1
+            await send({"type": "error", "frame": seq, "detail": "Invalid image type"})
+            continue
+
+        frame_hash = None
+        if STREAM_DEDUP_DISTANCE >= 0:
+            frame_hash = await loop.run_in_executor(executor, perceptual_hash, image_bytes)
+            if (
+                frame_hash is not None
+                and last_hash is not None
+                and hamming_distance(frame_hash, last_hash) <= STREAM_DEDUP_DISTANCE
+            ):
+                stats.dropped_unchanged += 1
+                continue
+
+        try:
+            prepared, cache_key = await loop.run_in_executor(executor, prepare_upload, image_bytes)
+        except Exception:
+            stats.errors += 1
+            await send({"type": "error", "frame": seq, "detail": "Could not decode image"})
+            continue
+
+        try:
+            result = await classify(prepared, cache_key)
+        except Exception as e:
+            stats.errors += 1
+            logger.warning(f"Stream frame {seq} failed: {e}")
+            await send({"type": "error", "frame": seq, "detail": "Prediction failed"})
+            continue
+        last_hash = frame_hash
+        latency_ms = (time.perf_counter() - received_at) * 1000
+        stats.observe(latency_ms)
+        await send({
+            "type": "prediction",
+            "frame": seq,
+            "latency_ms": round(latency_ms, 1),
+            "result": apply_view(result, view),
+            "stats": stats.snapshot(),
+        })
+
+def save_upload(upload, path: str, max_bytes: int) -> None:
+    """Copy an uploaded archive to disk in chunks, refusing it once it exceeds max_bytes."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    with open(path, "wb") as out:
+        while chunk := upload.read(1024 * 1024):
+            written += len(chunk)
+            if written > max_bytes:
+                raise ValueError("Archive too large")
+            out.write(chunk)
+
+def get_job(job_id: str) -> dict:
+    job = app.state.job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile | None = File(None), directory: str | None = Form(None)):
+    """Queue a bulk job for a zip/tar upload (`file`) or a server-side `directory` under JOBS_ALLOWED_DIRS."""
+    if (file is None) == (directory is None):
+        raise HTTPException(status_code=400, detail="Send either an archive file or a directory")
+
+    if directory is not None:
+        path = directory if os.path.isabs(directory) else os.path.join(REPO_ROOT, directory)
+        if not is_within(path, JOBS_ALLOWED_DIRS):
+            raise HTTPException(status_code=403, detail="Directory is outside JOBS_ALLOWED_DIRS")
+        if not os.path.isdir(path):
+            raise HTTPException(status_code=404, detail="Directory not found")
+        job_id = app.state.job_store.create("directory", os.path.realpath(path))
+    else:
+        name = f"{time.time_ns()}-{os.path.basename(file.filename or 'upload')}"
+        path = os.path.join(JOBS_DIR, "uploads", name)
+        try:
+            await asyncio.to_thread(save_upload, file.file, path, int(JOBS_MAX_UPLOAD_MB * 1024 * 1024))
+        except ValueError as e:
+            os.remove(path)
+            raise HTTPException(status_code=413, detail=str(e))
+        job_id = app.state.job_store.create("archive", path)
+
+    app.state.job_runner.submit(job_id)
+    return get_job(job_id)
+
+@app.get("/jobs")
+async def list_jobs(limit: int = 50):
+    return app.state.job_store.list(limit)
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return get_job(job_id)
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str, after: int = 0, follow: bool = True):
+    """Results as NDJSON in completion order. With follow=true the stream stays open until the job ends.
+
+    Each line carries a `cursor`; pass the last one as `after` to continue an interrupted stream.
+    """
+    get_job(job_id)
+    store = app.state.job_store
+
+    async def lines():
+        cursor = after
+        while True:
+            # Read the status first so results written just before the job ended are not missed
+            status = (await asyncio.to_thread(store.get, job_id))["status"]
+            rows = await asyncio.to_thread(store.results, job_id, cursor)
+            for cursor, record in rows:
+                yield f'{{"cursor": {cursor}, {record[1:]}\n'
+            if rows:
+                continue
+            if not follow or status in FINAL_STATES:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Stop a queued or running job after its in-flight batches; it can be resumed later."""
+    if get_job(job_id)["status"] in FINAL_STATES:
+        raise HTTPException(status_code=409, detail="Job already finished")
+    app.state.job_runner.cancel(job_id)
+    return get_job(job_id)
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    """Re-queue a canceled or failed job; images that already have a result are not repeated."""
+    if get_job(job_id)["status"] not in ("canceled", "failed"):
+        raise HTTPException(status_code=409, detail="Only canceled or failed jobs can be resumed")
+    app.state.job_runner.submit(job_id)
+    return get_job(job_id)
@@ -0,0 +1,133 @@
+"""
+Peak Python memory per request on the upload and Vertex-encoding paths.
+
+Uses tracemalloc, so it counts Python-level buffers (upload bytes, multipart
+spool, base64 and JSON copies) but not PIL's or torch's native allocations.
+
+  vertex-body  building the Vertex :predict body for one image, with the
+               former json= path (base64 bytes -> str -> JSON str -> bytes)
+               and with encode_instances()
+  predict      one POST /predict sent straight into the ASGI app in 64 KB
+               body messages (stand-in backends, CLIP disabled); the
+               request body itself is built beforehand and not counted
+  oversized    the same with an --oversized-mb upload that must be rejected
+
+Examples (run from backend/):
+    python measure_memory.py
+    python measure_memory.py --image ../split/test/metal/metal1.jpg --oversized-mb 50
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import gc
+import io
+import json
+import os
+import tracemalloc
+from typing import Callable
+
+from PIL import Image
+
+
+def peak_mb(fn: Callable[[], object]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return (peak - base) / (1024 * 1024)
+
+
+def synthetic_jpeg(side: int) -> bytes:
+    """A noisy JPEG that compresses poorly, to get a large upload."""
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def legacy_vertex_body(image: bytes) -> bytes:
+    payload = {"instances": [{"image_bytes": {"b64": base64.b64encode(image).decode("utf-8")}, "key": "1"}]}
+    return json.dumps(payload).encode("utf-8")  # what httpx did with json=payload
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure peak memory per request.")
+    parser.add_argument("--image", help="image to upload (default: a synthetic ~6 MB JPEG)")
+    parser.add_argument("--oversized-mb", type=float, default=40.0)
+    args = parser.parse_args()
+
+    image = open(args.image, "rb").read() if args.image else synthetic_jpeg(2000)
+    print(f"image: {len(image) / (1024 * 1024):.2f} MB")
+
+    from app.vertex_service import encode_instances
+
+    print(f"vertex-body  legacy json=          {peak_mb(lambda: legacy_vertex_body(image)):7.2f} MB")
+    print(f"vertex-body  encode_instances()    {peak_mb(lambda: encode_instances([image])):7.2f} MB")
+
+    os.environ.setdefault("OFFLINE_STANDINS", "true")
+    os.environ.setdefault("ENABLE_CLIP", "false")
+    os.environ.setdefault("ENABLE_CACHE", "false")
+    os.environ.setdefault("BACKGROUND_LOADING", "false")
+    os.environ.setdefault("STANDIN_LATENCY_MS", "1")
+
+    from fastapi.testclient import TestClient
+
+    import main as api
+
+    boundary = "measurememoryboundary"
+
+    def multipart(data: bytes) -> bytes:
+        head = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="upload.jpg"\r\n'
+            "Content-Type: image/jpeg\r\n\r\n"
+        ).encode()
+        return head + data + f"\r\n--{boundary}--\r\n".encode()
+
+    async def request(body: bytes) -> int:
+        """One POST /predict straight into the ASGI app, with the body in 64 KB messages as uvicorn sends it."""
+        view = memoryview(body)
+        sent = 0
+        status = 0
+
+        async def receive():
+            nonlocal sent
+            if sent < len(view):
+                chunk = bytes(view[sent:sent + 65536])
+                sent += len(chunk)
+                return {"type": "http.request", "body": chunk, "more_body": sent < len(view)}
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/predict", "raw_path": b"/predict", "query_string": b"",
+            "root_path": "", "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 8000),
+            "headers": [
+                (b"content-type", f"multipart/form-data; boundary={boundary}".encode()),
+                # No Content-Length, as with a chunked upload, so the streaming limit is what applies
+            ],
+        }
+        await api.app(scope, receive, send)
+        return status
+
+    body = multipart(image)
+    oversized = multipart(os.urandom(int(args.oversized_mb * 1024 * 1024)))
+    with TestClient(api.app) as client:
+        def post(data: bytes) -> int:
+            return client.portal.call(request, data)
+
+        post(body)  # warm up routes and lazy imports
+        print(f"predict      status {post(body)}          {peak_mb(lambda: post(body)):7.2f} MB")
+        print(f"oversized    status {post(oversized)}          {peak_mb(lambda: post(oversized)):7.2f} MB")
+
+if __name__ == "__main__":
+    main()
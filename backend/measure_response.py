@@ -0,0 +1,134 @@
+"""
+Payload size and encode time of /predict responses, per view and serializer.
+
+Collects verbose responses for images of a split, from the in-process app
+with stand-in backends (default) or from a running API (--url, e.g. one
+pointed at fake_google.py or the real backends). Each response is then
+encoded in both views with:
+
+  json      what FastAPI did for a returned dict (jsonable_encoder + json.dumps)
+  orjson    app/responses.encode as JSON (orjson when installed)
+  msgpack   app/responses.encode as MessagePack (only when msgpack is installed)
+
+The stand-ins return a smaller raw Vertex payload than the real endpoint, so
+use --url against real backends for absolute verbose sizes.
+
+Examples (run from backend/):
+    python measure_response.py
+    python measure_response.py --limit 100 --repeat 500 --json-out response_sizes.json
+    python measure_response.py --url http://127.0.0.1:8000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable
+
+from benchmark import DEFAULT_SPLIT, load_split, percentile
+
+
+def files(name: str, data: bytes) -> dict[str, tuple[str, bytes, str]]:
+    return {"file": (name, data, "image/jpeg")}
+
+
+def collect(args, images: list[tuple[str, bytes]]) -> list[dict[str, Any]]:
+    if args.url:
+        import httpx
+
+        with httpx.Client(base_url=args.url, timeout=60) as client:
+            return [
+                client.post("/predict", params={"view": "verbose"}, files=files(name, data)).raise_for_status().json()
+                for name, data in images
+            ]
+
+    os.environ.setdefault("OFFLINE_STANDINS", "true")
+    os.environ.setdefault("ENABLE_CLIP", "false")
+    os.environ.setdefault("ENABLE_CACHE", "false")
+    os.environ.setdefault("BACKGROUND_LOADING", "false")
+    os.environ.setdefault("STANDIN_LATENCY_MS", "1")
+
+    from fastapi.testclient import TestClient
+
+    import main as api
+
+    with TestClient(api.app) as client:
+        return [
+            client.post("/predict", params={"view": "verbose"}, files=files(name, data)).json()
+            for name, data in images
+        ]
+
+
+def encoders() -> dict[str, Callable[[Any], bytes]]:
+    from fastapi.encoders import jsonable_encoder
+
+    from app import responses
+
+    def legacy(content: Any) -> bytes:
+        # fastapi.routing.serialize_response + JSONResponse.render for a returned dict
+        return json.dumps(
+            jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+    found = {"json": legacy, "orjson": lambda content: responses.encode(content, responses.JSON)}
+    if responses.msgpack is not None:
+        found["msgpack"] = lambda content: responses.encode(content, responses.MSGPACK)
+    return found
+
+
+def measure(samples: list[dict[str, Any]], encode: Callable[[Any], bytes], repeat: int) -> dict[str, float]:
+    sizes, micros = [], []
+    for sample in samples:
+        sizes.append(len(encode(sample)))
+        start = time.perf_counter_ns()
+        for _ in range(repeat):
+            encode(sample)
+        micros.append((time.perf_counter_ns() - start) / repeat / 1000.0)
+    return {
+        "mean_bytes": round(sum(sizes) / len(sizes), 1),
+        "encode_us_p50": round(percentile(micros, 50), 2),
+        "encode_us_p99": round(percentile(micros, 99), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure /predict response size and encode time.")
+    parser.add_argument("--split", default=DEFAULT_SPLIT)
+    parser.add_argument("--limit", type=int, default=30, help="images to collect responses for")
+    parser.add_argument("--repeat", type=int, default=200, help="encodes per response when timing")
+    parser.add_argument("--url", help="running API to collect responses from (default: in-process stand-ins)")
+    parser.add_argument("--json-out", help="write the results here")
+    args = parser.parse_args()
+
+    _, samples = load_split(args.split, args.limit)
+    images = []
+    for path, _ in samples:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+    verbose = collect(args, images)
+
+    from app.responses import compact_view
+
+    views = {"verbose": verbose, "compact": [compact_view(r) for r in verbose]}
+    results: dict[str, dict[str, Any]] = {}
+    baseline = None
+    print(f"{len(verbose)} responses, {args.repeat} encodes each")
+    print(f"{'view':<8} {'format':<8} {'bytes':>9} {'p50 µs':>9} {'p99 µs':>9} {'size':>7} {'time':>7}")
+    for view, data in views.items():
+        for name, encode in encoders().items():
+            row = measure(data, encode, args.repeat)
+            baseline = baseline or row  # verbose + json, i.e. the previous behaviour
+            row["size_vs_baseline"] = round(row["mean_bytes"] / baseline["mean_bytes"], 3)
+            row["time_vs_baseline"] = round(row["encode_us_p50"] / baseline["encode_us_p50"], 3)
+            results[f"{view}/{name}"] = row
+            print(f"{view:<8} {name:<8} {row['mean_bytes']:>9.0f} {row['encode_us_p50']:>9.1f} "
+                  f"{row['encode_us_p99']:>9.1f} {row['size_vs_baseline']:>6.2f}x {row['time_vs_baseline']:>6.2f}x")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"responses": len(verbose), "repeat": args.repeat, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
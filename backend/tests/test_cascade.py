@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.cascade import DEFAULT_POLICY_PATH, CascadePolicy
+from app.clip_service import DEFAULT_LOGIT_SCALE, ClipService
+from app.consensus import CONFIDENCE_THRESHOLD, build_response, skipped_result
+
+CLASSES = ["metal", "cardboard", "plastic"]
+
+
+def clip_result(sims):
+    """ClipService's output for given cosine similarities, without loading a model."""
+    clip = object.__new__(ClipService)
+    clip.classes, clip.logit_scale = CLASSES, DEFAULT_LOGIT_SCALE
+    return clip._format_scores(torch.tensor(sims))
+
+
+def test_local_cascade_stop_gives_a_usable_recommendation():
+    with open(DEFAULT_POLICY_PATH) as f:
+        policy = CascadePolicy(json.load(f), mode="on")
+    # Typical zero-shot cosine similarities: the best class only leads by a few hundredths
+    local = clip_result([0.30, 0.24, 0.25])
+    assert local["prediction"] == "metal"
+    assert policy.accepts("clip", local, set(CLASSES))
+
+    vc_res = {**local, "top_labels": []}
+    response = build_response(skipped_result("vertex", "cascade"), 0, vc_res, 5)
+    assert response["consensus"]["recommendation"] == "metal"
+    assert response["vision"]["prediction"] == "metal"
+
+
+def test_cascade_never_stops_below_the_consensus_threshold():
+    policy = CascadePolicy({"mode": "on", "thresholds": {"clip": {"default": 0.1}}})
+    local = clip_result([0.27, 0.265, 0.26])
+    assert local["confidence"] < CONFIDENCE_THRESHOLD
+    assert not policy.accepts("clip", local, set(CLASSES))
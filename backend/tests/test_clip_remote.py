@@ -0,0 +1,59 @@
+import multiprocessing as mp
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from app.clip_remote import ClipInferenceServer, RemoteClipService
+
+
+class FailingClip:
+    """Stand-in ClipService whose forward pass fails for images filled with negative values."""
+
+    classes = ["cardboard", "metal", "plastic"]
+    model_name = "fake"
+    input_resolution = 8
+    preprocess = None
+
+    def predict_batch(self, images):
+        if float(images[0][0, 0, 0]) < 0:
+            raise ValueError("forward pass failed")
+        return [{"prediction": "metal", "confidence": 0.9, "raw": {}} for _ in images]
+
+
+def serve(socket_path):
+    ClipInferenceServer(FailingClip(), socket_path, max_batch_size=4, max_wait_ms=1).serve_forever()
+
+
+@pytest.fixture
+def client(tmp_path):
+    # A separate process, as in production, so the shared-memory slots are tracked once per side
+    socket_path = str(tmp_path / "clip.sock")
+    server = mp.get_context("spawn").Process(target=serve, args=(socket_path,), daemon=True)
+    server.start()
+    remote = RemoteClipService(socket_path, connections=2, connect_timeout=30)
+    yield remote
+    remote.close()
+    server.terminate()
+    server.join()
+
+
+def test_server_errors_return_the_connection_to_the_pool(client):
+    bad = np.full((3, 8, 8), -1.0, dtype=np.float32)
+    good = np.ones((3, 8, 8), dtype=np.float32)
+
+    def run():
+        # More failing requests than there are connections, then a good one
+        for _ in range(client.max_connections + 2):
+            with pytest.raises(RuntimeError, match="forward pass failed"):
+                client.predict_tensor(bad)
+        results.append(client.predict_tensor(good))
+
+    results = []
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(timeout=10)
+    assert results and results[0]["prediction"] == "metal", "CLIP call blocked waiting for a pooled connection"
+    assert client._opened <= client.max_connections
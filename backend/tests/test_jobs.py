@@ -0,0 +1,35 @@
+import os
+
+from app.jobs import JobRunner, JobStore, list_images
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8")
+
+
+def test_labels_come_from_class_folders(tmp_path):
+    touch(tmp_path / "test" / "metal" / "a.jpg")
+    touch(tmp_path / "test" / "plastic" / "b.png")
+    assert list_images(str(tmp_path / "test")) == [
+        (os.path.join("metal", "a.jpg"), "metal"),
+        (os.path.join("plastic", "b.png"), "plastic"),
+    ]
+
+
+def test_directory_job_rooted_at_a_class_folder_is_labelled(tmp_path):
+    root = tmp_path / "split" / "test" / "metal"
+    touch(root / "a.jpg")
+    touch(root / "b.jpg")
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    runner = JobRunner(store, classify_batch=None, jobs_dir=str(tmp_path / "jobs"))
+    job_id = store.create("directory", str(root))
+
+    runner._enumerate(store.get(job_id))
+
+    assert [(item["path"], item["label"]) for item in store.pending(job_id, 10)] == [
+        ("a.jpg", "metal"),
+        ("b.jpg", "metal"),
+    ]
+    store.close()
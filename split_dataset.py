@@ -1,68 +1,276 @@
-import os
-import shutil
-import random
-
-# ==============================
-# CONFIGURATION
-# ==============================
-SOURCE_DIR = os.path.expanduser("~/Documents/github/Waste-Identifiacation/dataset")
-TARGET_DIR = os.path.expanduser("~/Documents/github/Waste-Identifiacation/split")
-
-CLASSES = ["cardboard", "metal", "plastic"]
-
-TRAIN_RATIO = 0.7
-TEST_RATIO = 0.2
-BUFFER_RATIO = 0.1
-
-IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
-
-random.seed(42)  # for reproducibility
-
-# ==============================
-# CREATE FOLDER STRUCTURE
-# ==============================
-for split in ["train", "test", "buffer"]:
-    for cls in CLASSES:
-        os.makedirs(os.path.join(TARGET_DIR, split, cls), exist_ok=True)
-
-# ==============================
-# SPLIT DATA
-# ==============================
-for cls in CLASSES:
-    class_path = os.path.join(SOURCE_DIR, cls)
-    images = [
-        f for f in os.listdir(class_path)
-        if f.lower().endswith(IMAGE_EXTENSIONS)
-    ]
-
-    random.shuffle(images)
-    total = len(images)
-
-    train_end = int(total * TRAIN_RATIO)
-    test_end = train_end + int(total * TEST_RATIO)
-
-    train_images = images[:train_end]
-    test_images = images[train_end:test_end]
-    buffer_images = images[test_end:]
-
-    for img in train_images:
-        shutil.copy(
-            os.path.join(class_path, img),
-            os.path.join(TARGET_DIR, "train", cls, img)
-        )
-
-    for img in test_images:
-        shutil.copy(
-            os.path.join(class_path, img),
-            os.path.join(TARGET_DIR, "test", cls, img)
-        )
-
-    for img in buffer_images:
-        shutil.copy(
-            os.path.join(class_path, img),
-            os.path.join(TARGET_DIR, "buffer", cls, img)
-        )
-
-    print(f"✅ {cls}: {len(train_images)} train, {len(test_images)} test, {len(buffer_images)} buffer")
-
-print("\n🎉 Dataset split completed successfully!")
+"""
+Split dataset/<class>/ images into split/{train,test,buffer}/<class>/.
+
+Every image is identified by the SHA-256 of its content, and split/manifest.json
+records the split of each hash. Re-running only assigns images that are new,
+keeping each class close to the configured ratios, and never moves an image
+that was already placed. Identical images are placed once: duplicates within
+a class are recorded and skipped, and images that appear under two different
+classes are left out of every split as conflicts.
+
+Files are placed as reflinks (copy-on-write clones) or hardlinks when the
+filesystem allows it, and copied otherwise. Hashing and placing run in a
+process pool. Without a manifest, images already in split/ are adopted
+where they are, so an existing split stays reproducible.
+
+Examples:
+    python split_dataset.py
+    python split_dataset.py --classes cardboard metal plastic glass --workers 8
+    python split_dataset.py --link copy --dry-run
+"""
+import argparse
+import errno
+import hashlib
+import json
+import os
+import random
+import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# ==============================
+# CONFIGURATION
+# ==============================
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(ROOT_DIR, "dataset")
+TARGET_DIR = os.path.join(ROOT_DIR, "split")
+
+CLASSES = ["cardboard", "metal", "plastic"]
+
+# Split name -> share of each class
+SPLITS = {"train": 0.7, "test": 0.2, "buffer": 0.1}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+SEED = 42  # for reproducibility
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# ioctl that clones a file's extents (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return path, digest.hexdigest()
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def place(task):
+    """Worker: put src (content hash digest) at dst as a reflink, hardlink or copy. Returns the method used."""
+    src, dst, digest, link = task
+    if os.path.exists(dst):
+        # A stale or foreign file at dst is replaced; only the same content counts as placed
+        if os.path.samefile(src, dst) or file_sha256(dst)[1] == digest:
+            return "existing"
+        os.remove(dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+    methods = {"auto": ["reflink", "hardlink", "copy"], "reflink": ["reflink", "copy"],
+               "hardlink": ["hardlink", "copy"], "copy": ["copy"]}[link]
+    tmp = f"{dst}.tmp"
+    for method in methods:
+        try:
+            if method == "hardlink":
+                os.link(src, dst)
+                return method
+            if method == "reflink":
+                _reflink(src, tmp)
+            else:
+                shutil.copy2(src, tmp)
+            # Renamed into place, so an interrupted run never leaves a partial image
+            os.replace(tmp, dst)
+            return method
+        except OSError as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if method == "copy" or e.errno not in (
+                errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK, errno.ENOSYS,
+            ):
+                raise
+    raise RuntimeError(f"could not place {src}")
+
+
+def list_images(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def hash_all(paths, pool):
+    return dict(pool.map(file_sha256, paths, chunksize=32))
+
+
+def load_manifest(target_dir, classes, pool):
+    """The saved manifest, or one adopting whatever split/ already holds.
+
+    Also returns the extra copies of images adopted more than once (the same
+    image in two splits), which are removed.
+    """
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f), []
+
+    manifest = {"version": MANIFEST_VERSION, "seed": SEED, "splits": SPLITS, "files": {}, "duplicates": {},
+                "conflicts": {}}
+    existing = [
+        (split, cls, p)
+        for split in SPLITS for cls in classes
+        for p in list_images(os.path.join(target_dir, split, cls))
+    ]
+    hashes = hash_all([p for _, _, p in existing], pool)
+    extra = []
+    for split, cls, p in existing:
+        if hashes[p] in manifest["files"]:
+            extra.append(os.path.relpath(p, target_dir))
+            continue
+        manifest["files"][hashes[p]] = {
+            "class": cls, "split": split, "path": os.path.relpath(p, target_dir), "source": None,
+        }
+    if existing:
+        print(f"📥 Adopted {len(manifest['files'])} images already in {target_dir}")
+    return manifest, extra
+
+
+def assign(new_hashes, counts, rng):
+    """Give each new image the split furthest below its target share."""
+    order = sorted(new_hashes)
+    rng.shuffle(order)
+    assigned = {}
+    for digest in order:
+        total = sum(counts.values()) + 1
+        split = max(SPLITS, key=lambda s: SPLITS[s] * total - counts[s])
+        counts[split] += 1
+        assigned[digest] = split
+    return assigned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split dataset/<class>/ into train/test/buffer incrementally.")
+    parser.add_argument("--source", default=SOURCE_DIR)
+    parser.add_argument("--target", default=TARGET_DIR)
+    parser.add_argument("--classes", nargs="+", default=CLASSES)
+    parser.add_argument("--link", choices=["auto", "reflink", "hardlink", "copy"], default="auto",
+                        help="auto tries reflink, then hardlink, then copy")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without touching split/")
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        manifest, removals = load_manifest(args.target, args.classes, pool)
+        files = manifest["files"]
+
+        # ==============================
+        # HASH SOURCES
+        # ==============================
+        sources = [(cls, p) for cls in args.classes for p in list_images(os.path.join(args.source, cls))]
+        hashes = hash_all([p for _, p in sources], pool)
+
+        by_hash = {}
+        for cls, p in sources:
+            by_hash.setdefault(hashes[p], []).append((cls, p))
+
+        # A source whose content changed replaces its old entry
+        rel = {p: os.path.relpath(p, args.source) for _, p in sources}
+        current = {rel[p]: hashes[p] for _, p in sources}
+        for digest, entry in list(files.items()):
+            if entry.get("source") in current and current[entry["source"]] != digest:
+                removals.append(entry["path"])
+                del files[digest]
+
+        # ==============================
+        # DEDUP AND ASSIGN
+        # ==============================
+        duplicates, conflicts = {}, {}
+        new_by_class = {cls: [] for cls in args.classes}
+        for digest, found in by_hash.items():
+            classes = sorted({cls for cls, _ in found})
+            if len(classes) > 1:
+                # Same image under different labels: keep it out of every split
+                conflicts[digest] = sorted(rel[p] for _, p in found)
+                if digest in files:
+                    removals.append(files.pop(digest)["path"])
+                continue
+            paths = sorted(p for _, p in found)
+            if len(paths) > 1:
+                duplicates[digest] = [rel[p] for p in paths[1:]]
+            entry = files.get(digest)
+            if entry is None:
+                new_by_class[classes[0]].append(digest)
+            elif entry["class"] != classes[0]:
+                # Relabelled in dataset/: it cannot stay under the old class
+                removals.append(files.pop(digest)["path"])
+                new_by_class[classes[0]].append(digest)
+            elif entry.get("source") is None:
+                entry["source"] = rel[paths[0]]
+        manifest["duplicates"], manifest["conflicts"] = duplicates, conflicts
+
+        tasks, summary = [], {}
+        for cls in args.classes:
+            counts = Counter({split: 0 for split in SPLITS})
+            counts.update(e["split"] for e in files.values() if e["class"] == cls)
+            assigned = assign(new_by_class[cls], counts, random.Random(f"{manifest['seed']}:{cls}"))
+            taken = {e["path"] for e in files.values()}
+            for digest, split in assigned.items():
+                src = min(p for _, p in by_hash[digest])
+                name = os.path.basename(src)
+                path = os.path.join(split, cls, name)
+                if path in taken:
+                    stem, ext = os.path.splitext(name)
+                    path = os.path.join(split, cls, f"{stem}-{digest[:8]}{ext}")
+                taken.add(path)
+                files[digest] = {"class": cls, "split": split, "path": path, "source": rel[src]}
+            # Also restore placed files that went missing from split/
+            for digest, entry in files.items():
+                if entry["class"] == cls and (digest in assigned or not os.path.exists(
+                        os.path.join(args.target, entry["path"]))) and digest in by_hash:
+                    src = min(p for _, p in by_hash[digest])
+                    tasks.append((src, os.path.join(args.target, entry["path"]), digest, args.link))
+            summary[cls] = (dict(counts), len(assigned))
+
+        if args.dry_run:
+            for cls, (counts, added) in summary.items():
+                print(f"🔎 {cls}: would add {added} -> " + ", ".join(f"{n} {s}" for s, n in counts.items()))
+            print(f"🔎 {len(removals)} removals, {len(duplicates)} duplicate groups, {len(conflicts)} conflicts")
+            return
+
+        # ==============================
+        # PLACE FILES
+        # ==============================
+        for path in removals:
+            full = os.path.join(args.target, path)
+            if os.path.exists(full):
+                os.remove(full)
+        methods = Counter(pool.map(place, tasks, chunksize=32))
+
+    os.makedirs(args.target, exist_ok=True)
+    manifest["files"] = dict(sorted(files.items(), key=lambda kv: kv[1]["path"]))
+    manifest_path = os.path.join(args.target, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    for cls, (counts, added) in summary.items():
+        print(f"✅ {cls}: " + ", ".join(f"{n} {s}" for s, n in counts.items()) + f" ({added} new)")
+    if duplicates or conflicts:
+        print(f"♻️  {sum(len(v) for v in duplicates.values())} duplicate images skipped, "
+              f"{len(conflicts)} images found under several classes left out")
+    print(f"📦 Placed {len(tasks)} files: " + (", ".join(f"{n} {m}" for m, n in methods.items()) or "nothing to do"))
+    print("\n🎉 Dataset split completed successfully!")
+
+
+if __name__ == "__main__":
+    main()